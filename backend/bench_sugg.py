@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+
+"""
+Measures the per-query cost of search suggestion lookups using a tree's
+in-memory suggestion index, for prefix queries and for fuzzy queries.
+
+Fuzzy queries are made by applying random edits to names of random
+popular nodes. Reports index build times, query latency percentiles,
+and the fraction of fuzzy queries whose source node was suggested.
+"""
+
+import argparse
+import random
+import sqlite3
+import statistics
+import time
+
+from tilo import DB_FILE, DEFAULT_SUGG_LIM, SuggIndex, getTableSuffix
+
+LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+
+def runBenchmark(dbFile: str, tree: str, numQueries: int, maxEdits: int, seed: int) -> None:
+	rand = random.Random(seed)
+	dbCon = sqlite3.connect(dbFile)
+	dbCur = dbCon.cursor()
+
+	print('Building index')
+	startTime = time.perf_counter()
+	suggIndex = SuggIndex.fromDb(tree, dbCur)
+	print(f'Indexed {len(suggIndex.names)} names in {time.perf_counter() - startTime:.1f} s')
+	startTime = time.perf_counter()
+	suggIndex.getGramIndex()
+	print(f'Built trigram index in {time.perf_counter() - startTime:.1f} s')
+
+	print('Picking names')
+	nodesTable = f'nodes_{getTableSuffix(tree)}'
+	query = f'SELECT {nodesTable}.name FROM {nodesTable} INNER JOIN node_pop ON {nodesTable}.name = node_pop.name' \
+		f' WHERE {nodesTable}.name NOT LIKE "[%" ORDER BY pop DESC LIMIT ?'
+	names = [name for (name,) in dbCur.execute(query, (numQueries * 10,))]
+	dbCon.close()
+	if not names:
+		print('No popular names found')
+		return
+	names = [rand.choice(names) for _ in range(numQueries)]
+
+	print('Running prefix queries')
+	times = []
+	for name in names:
+		prefix = name[:rand.randint(1, min(len(name), 6))]
+		startTime = time.perf_counter()
+		suggIndex.lookupSuggs(prefix, DEFAULT_SUGG_LIM)
+		times.append(time.perf_counter() - startTime)
+	printStats(times)
+
+	print('Running fuzzy queries')
+	times = []
+	numFound = 0
+	for name in names:
+		searchStr = applyEdits(name.lower(), rand.randint(1, maxEdits), rand)
+		startTime = time.perf_counter()
+		suggs = suggIndex.lookupFuzzySuggs(searchStr, DEFAULT_SUGG_LIM, set())
+		times.append(time.perf_counter() - startTime)
+		if any(sugg.name == name or sugg.canonicalName == name for sugg in suggs):
+			numFound += 1
+	printStats(times)
+	print(f'Source node suggested for {numFound} of {len(names)} queries')
+
+def applyEdits(s: str, numEdits: int, rand: random.Random) -> str:
+	""" Applies random insertions, deletions, and substitutions to a string """
+	for _ in range(numEdits):
+		pos = rand.randrange(len(s) + 1)
+		editType = rand.randrange(3)
+		if editType == 0:
+			s = s[:pos] + rand.choice(LETTERS) + s[pos:]
+		elif editType == 1 and len(s) > 1:
+			pos = min(pos, len(s) - 1)
+			s = s[:pos] + s[pos + 1:]
+		else:
+			pos = min(pos, len(s) - 1)
+			s = s[:pos] + rand.choice(LETTERS) + s[pos + 1:]
+	return s
+
+def printStats(times: list[float]) -> None:
+	times = sorted(t * 1000 for t in times)
+	def percentile(p: float) -> float:
+		return times[min(len(times) - 1, int(p * len(times)))]
+	print(f'Per-query ms: mean {statistics.mean(times):.3f}, median {percentile(0.5):.3f},'
+		f' p95 {percentile(0.95):.3f}, p99 {percentile(0.99):.3f}, max {times[-1]:.3f}')
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--db', default=DB_FILE, help='Database file to use')
+	parser.add_argument('--tree', choices=['trimmed', 'images', 'picked'], default='images', help='Tree to use')
+	parser.add_argument('--queries', type=int, default=1000, help='Number of queries of each kind')
+	parser.add_argument('--edits', type=int, choices=[1, 2], default=2, help='Max number of edits per fuzzy query')
+	parser.add_argument('--seed', type=int, default=0, help='Seed for random choices')
+	args = parser.parse_args()
+
+	runBenchmark(args.db, args.tree, args.queries, args.edits, args.seed)
@@ -1,38 +1,302 @@
 #!/usr/bin/python3
 
 """
-Runs a basic dev server that serves a WSGI script and image files
+Runs a dev server that serves a WSGI script and image files.
+
+Requests can be handled by multiple threads (using --threads), and by
+multiple processes that share a listening socket (using --workers).
 """
 
 from typing import Iterable
+import sys
 import os
-from wsgiref import simple_server, util
+import stat
+import time
+import signal
+import socket
+import email.utils
 import mimetypes
+import threading
+import collections
+import concurrent.futures
+from wsgiref import simple_server, util
+import argparse
+
+import tilo
 from tilo import application
 
-import argparse
-parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
-parser.parse_args()
+PORT = 8000
+IMG_URL_PATH = '/tol_data/img/'
+IMG_DIR = 'tol_data/img'
+IMG_CACHE_CONTROL = 'public, max-age=86400'
+IMG_CACHE_FILES = 256 # Max number of image files to keep open
+IMG_MISS_SECS = 10 # Number of seconds to remember that an image file is missing
+
+# ========== For serving image files ==========
 
 def wrappingApp(environ: dict[str, str], start_response) -> Iterable[bytes]:
 	""" WSGI handler that uses 'application', but also serves image files """
 	urlPath = environ['PATH_INFO']
 	if urlPath.startswith('/data/'):
 		return application(environ, start_response) # Run WSGI script
-	elif urlPath.startswith('/tol_data/img/'): # Serve image file
-		imgPath = os.path.join(os.getcwd(), urlPath[1:])
-		if os.path.exists(imgPath):
-			imgType = mimetypes.guess_type(imgPath)[0]
-			start_response('200 OK', [('Content-type', imgType)])
-			return util.FileWrapper(open(imgPath, 'rb'))
-		else:
-			start_response('404 Not Found', [('Content-type', 'text/plain')])
-			return [b'No image found']
+	elif urlPath.startswith(IMG_URL_PATH): # Serve image file
+		return serveImage(environ, start_response, urlPath[len(IMG_URL_PATH):])
 	else:
 		start_response('404 Not Found', [('Content-type', 'text/plain')])
 		return [b'Unrecognised path']
 
-# Start server
-with simple_server.make_server('', 8000, wrappingApp) as httpd:
-    print('Serving HTTP on port 8000...')
-    httpd.serve_forever()
+class ImgFile:
+	""" An open image file, with header values, that may be used by concurrent responses """
+	def __init__(self, fd: int, fileStat: os.stat_result):
+		self.fd = fd
+		self.size = fileStat.st_size
+		self.etag = f'"{fileStat.st_mtime_ns:x}-{fileStat.st_size:x}"'
+		self.lastModified = int(fileStat.st_mtime)
+		self.numUsers = 0
+		self.evicted = False
+
+class ImgFileReader:
+	""" A file-like object for sending an ImgFile in a response, which releases it upon closing """
+	def __init__(self, imgFile: ImgFile, cache: 'ImgFileCache'):
+		self.imgFile = imgFile
+		self.cache = cache
+		self.size = imgFile.size
+		self.offset = 0
+		self.closed = False
+
+	def fileno(self) -> int:
+		return self.imgFile.fd
+
+	def read(self, size=-1) -> bytes:
+		""" Reads without using the descriptor's file position, which may be shared """
+		if size < 0:
+			size = self.size - self.offset
+		data = os.pread(self.imgFile.fd, size, self.offset)
+		self.offset += len(data)
+		return data
+
+	def close(self) -> None:
+		if not self.closed:
+			self.closed = True
+			self.cache.release(self.imgFile)
+
+class ImgFileCache:
+	""" A thread-safe LRU cache of open image files, which also remembers missing files for a while.
+		Evicted files are closed once no response is using them. """
+	def __init__(self, maxFiles: int, missSecs: float):
+		self.maxFiles = maxFiles
+		self.missSecs = missSecs
+		self.files: collections.OrderedDict[str, ImgFile] = collections.OrderedDict()
+		self.misses: collections.OrderedDict[str, float] = collections.OrderedDict() # Maps paths to expiry times
+		self.hits = 0
+		self.lock = threading.Lock()
+
+	def acquire(self, path: str) -> ImgFile | None:
+		""" Returns an open image file, or None if it's missing. The file must be released after use. """
+		with self.lock:
+			imgFile = self.files.get(path)
+			if imgFile is not None:
+				self.hits += 1
+				self.files.move_to_end(path)
+				imgFile.numUsers += 1
+				return imgFile
+			if path in self.misses:
+				if self.misses[path] > time.monotonic():
+					self.hits += 1
+					return None
+				del self.misses[path]
+		# Open the file outside the lock
+		try:
+			fd = os.open(path, os.O_RDONLY)
+		except OSError:
+			self.addMiss(path)
+			return None
+		fileStat = os.fstat(fd)
+		if not stat.S_ISREG(fileStat.st_mode):
+			os.close(fd)
+			self.addMiss(path)
+			return None
+		with self.lock:
+			if path in self.files: # If another thread opened the file meanwhile
+				os.close(fd)
+				imgFile = self.files[path]
+			else:
+				imgFile = ImgFile(fd, fileStat)
+				self.files[path] = imgFile
+				while len(self.files) > self.maxFiles:
+					_, oldFile = self.files.popitem(last=False)
+					oldFile.evicted = True
+					if oldFile.numUsers == 0:
+						os.close(oldFile.fd)
+			imgFile.numUsers += 1
+			return imgFile
+
+	def release(self, imgFile: ImgFile) -> None:
+		with self.lock:
+			imgFile.numUsers -= 1
+			if imgFile.evicted and imgFile.numUsers == 0:
+				os.close(imgFile.fd)
+
+	def addMiss(self, path: str) -> None:
+		with self.lock:
+			self.misses[path] = time.monotonic() + self.missSecs
+			self.misses.move_to_end(path)
+			while len(self.misses) > self.maxFiles:
+				self.misses.popitem(last=False)
+
+	def clear(self) -> None:
+		""" Closes unused files, and forgets all files (eg: after images are replaced) """
+		with self.lock:
+			for imgFile in self.files.values():
+				imgFile.evicted = True
+				if imgFile.numUsers == 0:
+					os.close(imgFile.fd)
+			self.files.clear()
+			self.misses.clear()
+
+imgFileCache = ImgFileCache(IMG_CACHE_FILES, IMG_MISS_SECS)
+
+def serveImage(environ: dict[str, str], start_response, imgName: str) -> Iterable[bytes]:
+	""" Serves an image file, with caching headers, and '304 Not Modified' responses for current client copies """
+	imgPath = os.path.join(IMG_DIR, imgName)
+	imgFile = imgFileCache.acquire(imgPath) if '/' not in imgName and not imgName.startswith('.') else None
+	if imgFile is None:
+		start_response('404 Not Found', [('Content-type', 'text/plain')])
+		return [b'No image found']
+	reader = ImgFileReader(imgFile, imgFileCache)
+	try:
+		headers = [
+			('ETag', imgFile.etag),
+			('Last-Modified', email.utils.formatdate(imgFile.lastModified, usegmt=True)),
+			('Cache-Control', IMG_CACHE_CONTROL),
+		]
+		if tilo.isNotModified(environ, imgFile.etag, imgFile.lastModified):
+			start_response('304 Not Modified', headers)
+			reader.close()
+			return []
+		headers.append(('Content-type', mimetypes.guess_type(imgPath)[0] or 'application/octet-stream'))
+		headers.append(('Content-Length', str(imgFile.size)))
+		start_response('200 OK', headers)
+		if environ['REQUEST_METHOD'] == 'HEAD':
+			reader.close()
+			return []
+	except BaseException:
+		reader.close()
+		raise
+	fileWrapper = environ.get('wsgi.file_wrapper', util.FileWrapper)
+	return fileWrapper(reader)
+
+# ========== For running the server ==========
+
+class SendfileHandler(simple_server.ServerHandler):
+	""" Sends files returned by WSGI applications using os.sendfile() """
+	def __init__(self, *args, sock: socket.socket, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.sock = sock
+
+	def sendfile(self) -> bool:
+		file = self.result.filelike
+		if not hasattr(os, 'sendfile') or not hasattr(file, 'fileno'):
+			return False
+		if not self.headers_sent:
+			self.send_headers()
+		self._flush()
+		fd = file.fileno()
+		size = file.size if isinstance(file, ImgFileReader) else os.fstat(fd).st_size
+		offset = 0
+		while offset < size:
+			numSent = os.sendfile(self.sock.fileno(), fd, offset, size - offset)
+			if numSent == 0:
+				break
+			offset += numSent
+		self.bytes_sent += offset
+		return True
+
+class RequestHandler(simple_server.WSGIRequestHandler):
+	""" Like WSGIRequestHandler, but uses SendfileHandler """
+	def handle(self) -> None:
+		self.raw_requestline = self.rfile.readline(65537)
+		if len(self.raw_requestline) > 65536:
+			self.requestline = ''
+			self.request_version = ''
+			self.command = ''
+			self.send_error(414)
+			return
+		if not self.parse_request():
+			return
+		handler = SendfileHandler(
+			self.rfile, self.wfile, self.get_stderr(), self.get_environ(),
+			multithread=isinstance(self.server, ThreadPoolServer), sock=self.connection)
+		handler.request_handler = self
+		handler.run(self.server.get_app())
+
+class ThreadPoolServer(simple_server.WSGIServer):
+	""" A WSGI server that handles requests using a fixed number of threads """
+	def __init__(self, serverAddress: tuple[str, int], handlerClass, numThreads: int):
+		super().__init__(serverAddress, handlerClass)
+		self.executor = concurrent.futures.ThreadPoolExecutor(numThreads, thread_name_prefix='server')
+
+	def process_request(self, request, clientAddress) -> None:
+		self.executor.submit(self.processRequestThread, request, clientAddress)
+
+	def processRequestThread(self, request, clientAddress) -> None:
+		try:
+			self.finish_request(request, clientAddress)
+		except Exception:
+			self.handle_error(request, clientAddress)
+		finally:
+			self.shutdown_request(request)
+
+	def server_close(self) -> None:
+		super().server_close()
+		self.executor.shutdown(wait=False, cancel_futures=True)
+
+def makeServer(port: int, numThreads: int) -> simple_server.WSGIServer:
+	if numThreads > 1:
+		server = ThreadPoolServer(('', port), RequestHandler, numThreads)
+	else:
+		server = simple_server.WSGIServer(('', port), RequestHandler)
+	server.set_app(wrappingApp)
+	return server
+
+def runServer(port: int, numWorkers: int, numThreads: int) -> None:
+	""" Runs a server, forking worker processes that accept connections on the same socket """
+	with makeServer(port, numThreads) as server:
+		childPids: list[int] = []
+		for _ in range(numWorkers - 1):
+			pid = os.fork()
+			if pid == 0:
+				try:
+					server.serve_forever()
+				except KeyboardInterrupt:
+					pass
+				finally:
+					os._exit(0)
+			childPids.append(pid)
+		print(f'Serving HTTP on port {port}, with {numWorkers} process(es) of {numThreads} thread(s)...')
+		signal.signal(signal.SIGTERM, lambda *_: sys.exit(0)) # Allows stopping workers upon termination
+		try:
+			server.serve_forever()
+		except KeyboardInterrupt:
+			pass
+		finally:
+			for pid in childPids:
+				try:
+					os.kill(pid, signal.SIGTERM)
+					os.waitpid(pid, 0)
+				except (ProcessLookupError, ChildProcessError):
+					pass
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--port', type=int, default=PORT, help='Port to listen on')
+	parser.add_argument('--db', help='Database file to use, instead of tilo.DB_FILE')
+	parser.add_argument('--workers', type=int, default=1, help='Number of server processes')
+	parser.add_argument('--threads', type=int, default=1, help='Number of request-handling threads per process')
+	args = parser.parse_args()
+	if args.workers < 1 or args.threads < 1:
+		parser.error('--workers and --threads must be positive')
+	if args.db is not None:
+		tilo.DB_FILE = args.db
+
+	runServer(args.port, args.workers, args.threads)
@@ -0,0 +1,66 @@
+import unittest
+import tempfile
+import os
+import shutil
+
+from PIL import Image
+
+from tests.common import readTestDbTable
+from tests.test_tilo import initTestDb
+from tol_data.gen_atlases import genData, CELL_SZ
+from tilo import handleReq, AtlasRef
+
+RED_IMG = os.path.join(os.path.dirname(__file__), 'red.png')
+GREEN_IMG = os.path.join(os.path.dirname(__file__), 'green.png')
+
+class TestGenData(unittest.TestCase):
+	def test_gen(self):
+		with tempfile.TemporaryDirectory() as tempDir:
+			# Create temp tree-of-life db
+			dbFile = os.path.join(tempDir, 'data.db')
+			initTestDb(dbFile)
+			# Create temp images (one's children 'two' and 'five' use ott4.jpg and ott5.jpg)
+			imgDir = os.path.join(tempDir, 'img')
+			os.mkdir(imgDir)
+			shutil.copy(RED_IMG, os.path.join(imgDir, 'ott4.jpg'))
+			shutil.copy(GREEN_IMG, os.path.join(imgDir, 'ott5.jpg'))
+			# Run
+			genData(['trimmed'], dbFile, imgDir, 2, 4)
+			# Check
+			self.assertEqual(
+				readTestDbTable(dbFile, 'SELECT parent, page, file, cols, rows, cell_size, offsets FROM atlases_t'),
+				{('one', 0, 'atlas_t_0.jpg', 2, 1, CELL_SZ, '{"ott4.jpg": [0, 0], "ott5.jpg": [1, 0]}')}
+			)
+			self.assertEqual(
+				readTestDbTable(dbFile, 'SELECT name, parent, page, pos FROM atlas_nodes_t'),
+				{('two', 'one', 0, '[0, 0]'), ('five', 'one', 0, '[1, 0]')}
+			)
+			with Image.open(os.path.join(imgDir, 'atlas_t_0.jpg')) as atlas:
+				self.assertEqual(atlas.size, (2 * CELL_SZ, CELL_SZ))
+				red, green, _ = atlas.getpixel((CELL_SZ // 2, CELL_SZ // 2))
+				self.assertGreater(red, green)
+				red, green, _ = atlas.getpixel((CELL_SZ * 3 // 2, CELL_SZ // 2))
+				self.assertGreater(green, red)
+			response = handleReq(dbFile, {'QUERY_STRING': 'name=one&type=node&tree=trimmed'})
+			self.assertEqual(response['five'].atlas, AtlasRef('atlas_t_0.jpg', 2, 1, [1, 0]))
+
+	def test_gen_pages(self):
+		with tempfile.TemporaryDirectory() as tempDir:
+			dbFile = os.path.join(tempDir, 'data.db')
+			initTestDb(dbFile)
+			imgDir = os.path.join(tempDir, 'img')
+			os.mkdir(imgDir)
+			shutil.copy(RED_IMG, os.path.join(imgDir, 'ott4.jpg'))
+			shutil.copy(GREEN_IMG, os.path.join(imgDir, 'ott5.jpg'))
+			genData(['trimmed'], dbFile, imgDir, 2, 1)
+			self.assertEqual(
+				readTestDbTable(dbFile, 'SELECT parent, page, file, cols, rows, offsets FROM atlases_t'),
+				{
+					('one', 0, 'atlas_t_0.jpg', 1, 1, '{"ott4.jpg": [0, 0]}'),
+					('one', 1, 'atlas_t_1.jpg', 1, 1, '{"ott5.jpg": [0, 0]}'),
+				}
+			)
+			self.assertEqual(
+				readTestDbTable(dbFile, 'SELECT name, parent, page FROM atlas_nodes_t'),
+				{('two', 'one', 0), ('five', 'one', 1)}
+			)
@@ -0,0 +1,89 @@
+import unittest
+import tempfile
+import os
+
+from tests.common import createTestDbTable, readTestDbTable
+from tol_data.gen_node_ranges import genData
+
+class TestGenData(unittest.TestCase):
+	def test_gen(self):
+		with tempfile.TemporaryDirectory() as tempDir:
+			# Create temp tree-of-life db
+				# Test tree:
+					# one -> two -> three
+					#            -> four
+					#     -> five -> six
+				# Reduced tree:
+					# one -> five
+					#     -> two
+			dbFile = os.path.join(tempDir, 'data.db')
+			createTestDbTable(
+				dbFile,
+				'CREATE TABLE nodes (name TEXT PRIMARY KEY, id TEXT UNIQUE, tips INT)',
+				'INSERT INTO nodes VALUES (?, ?, ?)',
+				{
+					('one', 'ott1', 3),
+					('two', 'ott2', 2),
+					('three', 'ott3', 1),
+					('four', 'ott4', 1),
+					('five', 'ott5', 1),
+					('six', 'ott6', 1),
+				}
+			)
+			createTestDbTable(
+				dbFile,
+				'CREATE TABLE edges (parent TEXT, child TEXT, p_support INT, PRIMARY KEY (parent, child))',
+				'INSERT INTO edges VALUES (?, ?, ?)',
+				{
+					('one', 'two', 1),
+					('two', 'three', 1),
+					('two', 'four', 0),
+					('one', 'five', 1),
+					('five', 'six', 1),
+				}
+			)
+			createTestDbTable(
+				dbFile,
+				'CREATE TABLE nodes_i (name TEXT PRIMARY KEY, id TEXT UNIQUE, tips INT)',
+				'INSERT INTO nodes_i VALUES (?, ?, ?)',
+				{
+					('one', 'ott1', 2),
+					('two', 'ott2', 1),
+					('five', 'ott5', 1),
+				}
+			)
+			createTestDbTable(
+				dbFile,
+				'CREATE TABLE edges_i (parent TEXT, child TEXT, p_support INT, ord INT, PRIMARY KEY (parent, child))',
+				'INSERT INTO edges_i VALUES (?, ?, ?, ?)',
+				{
+					('one', 'two', 1, 1),
+					('one', 'five', 1, 0),
+				}
+			)
+			# Run
+			genData(['full', 'trimmed', 'images'], dbFile)
+			# Check
+			self.assertEqual(
+				readTestDbTable(dbFile, 'SELECT name, pre_idx, end_idx, depth FROM node_ranges'),
+				{
+					('one', 0, 5, 0),
+					('five', 1, 2, 1),
+					('six', 2, 2, 2),
+					('two', 3, 5, 1),
+					('four', 4, 4, 2),
+					('three', 5, 5, 2),
+				}
+			)
+			self.assertEqual(
+				readTestDbTable(dbFile, 'SELECT name, pre_idx, end_idx, depth FROM node_ranges_i'),
+				{
+					('one', 0, 2, 0),
+					('five', 1, 1, 1),
+					('two', 2, 2, 1),
+				}
+			)
+			self.assertEqual(
+				readTestDbTable(dbFile, 'SELECT name FROM sqlite_master WHERE name = "node_ranges_t"'),
+				set()
+			)
@@ -0,0 +1,51 @@
+import unittest
+import tempfile
+import os
+import sqlite3
+
+from tests.common import readTestDbTable
+from tests.test_tilo import initTestDb
+from tol_data.gen_node_views import genData
+from tilo import handleReq
+
+class TestGenData(unittest.TestCase):
+	def test_gen(self):
+		with tempfile.TemporaryDirectory() as tempDir:
+			# Create temp tree-of-life db
+			dbFile = os.path.join(tempDir, 'data.db')
+			initTestDb(dbFile)
+			dbCon = sqlite3.connect(dbFile)
+			dbCon.execute('INSERT INTO linked_imgs VALUES (?, ?)', ('three', ',ott4'))
+			dbCon.commit()
+			dbCon.close()
+			queryStrs = [
+				'name=one&type=node&tree=trimmed',
+				'name=two&type=node&tree=trimmed',
+				'name=seven&type=node&toroot=1&tree=trimmed',
+				'name=six&type=info&tree=trimmed',
+				'name=eight&type=node&tree=trimmed',
+			]
+			responses = [handleReq(dbFile, {'QUERY_STRING': q}) for q in queryStrs]
+			# Run
+			genData(['trimmed', 'images'], dbFile)
+			# Check
+			self.assertEqual(
+				readTestDbTable(dbFile, 'SELECT name, id, tips, parent, p_support, children,' \
+					' img_name, img_name2, img_pair, common_name, iucn FROM node_view_t'),
+				{
+					('one', 'ott1', 3, None, 0, '["two", "five"]', 'ott1.jpg', None, 0, 'turtle', 'vulnerable'),
+					('two', 'ott2', 2, 'one', 1, '["four", "three"]', 'ott4.jpg', None, 0, 'II', None),
+					('three', 'ott3', 1, 'two', 0, '[]', None, 'ott4.jpg', 1, None, None),
+					('four', 'ott4', 1, 'two', 1, '[]', 'ott4.jpg', None, 0, None, None),
+					('five', 'ott5', 1, 'one', 0, '["six"]', 'ott5.jpg', None, 0, None, None),
+					('six', 'ott6', 1, 'five', 1, '["seven"]', 'ott6.jpg', None, 0, 'VI', 'endangered'),
+					('seven', 'ott7', 1, 'six', 1, '[]', None, None, 0, None, None),
+				}
+			)
+			for queryStr, response in zip(queryStrs, responses):
+				newResponse = handleReq(dbFile, {'QUERY_STRING': queryStr})
+				self.assertEqual(newResponse, response)
+				if isinstance(response, dict):
+					for name, node in response.items():
+						self.assertEqual(newResponse[name].children, node.children)
+						self.assertEqual(newResponse[name].imgName, node.imgName)
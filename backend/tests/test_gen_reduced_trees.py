@@ -114,11 +114,11 @@ class TestGenData(unittest.TestCase):
 				}
 			)
 			self.assertEqual(
-				readTestDbTable(dbFile, 'SELECT parent, child, p_support from edges_p'),
+				readTestDbTable(dbFile, 'SELECT parent, child, p_support, ord from edges_p'),
 				{
-					('one', 'five', 0),
-					('one', 'eight', 1),
-					('one', 'eleven', 1),
+					('one', 'five', 0, 2),
+					('one', 'eight', 1, 0),
+					('one', 'eleven', 1, 1),
 				}
 			)
 			self.assertEqual(
@@ -133,13 +133,13 @@ class TestGenData(unittest.TestCase):
 				}
 			)
 			self.assertEqual(
-				readTestDbTable(dbFile, 'SELECT parent, child, p_support from edges_i'),
+				readTestDbTable(dbFile, 'SELECT parent, child, p_support, ord from edges_i'),
 				{
-					('one', 'two', 1),
-					('two', 'three', 1),
-					('two', 'five', 0),
-					('one', 'eight', 1),
-					('one', 'ten', 0),
+					('one', 'two', 1, 0),
+					('two', 'three', 1, 1),
+					('two', 'five', 0, 0),
+					('one', 'eight', 1, 1),
+					('one', 'ten', 0, 2),
 				}
 			)
 			self.assertEqual(
@@ -156,14 +156,14 @@ class TestGenData(unittest.TestCase):
 				}
 			)
 			self.assertEqual(
-				readTestDbTable(dbFile, 'SELECT parent, child, p_support from edges_t'),
+				readTestDbTable(dbFile, 'SELECT parent, child, p_support, ord from edges_t'),
 				{
-					('one', 'two', 1),
-					('two', 'three', 1),
-					('two', 'five', 0),
-					('one', '[seven + eight]', 1),
-					('[seven + eight]', 'seven', 0),
-					('[seven + eight]', 'eight', 1),
-					('one', 'ten', 0),
+					('one', 'two', 1, 1),
+					('two', 'three', 1, 1),
+					('two', 'five', 0, 0),
+					('one', '[seven + eight]', 1, 0),
+					('[seven + eight]', 'seven', 0, 1),
+					('[seven + eight]', 'eight', 1, 0),
+					('one', 'ten', 0, 2),
 				}
 			)
@@ -0,0 +1,29 @@
+import unittest
+import unittest.mock
+import tempfile
+import os
+import gzip
+
+from tests.common import readTestDbTable
+from tests.test_tilo import initTestDb
+from tol_data.gen_response_cache import genData
+import tilo
+from tilo import handleReq, encodeResponse
+
+class TestGenData(unittest.TestCase):
+	def test_gen(self):
+		with tempfile.TemporaryDirectory() as tempDir:
+			# Create temp tree-of-life db
+			dbFile = os.path.join(tempDir, 'data.db')
+			initTestDb(dbFile)
+			# Run, without orjson, to check that stored responses match those encoded by the server with it
+			with unittest.mock.patch.object(tilo, 'orjson', None):
+				genData(dbFile, 2, 1)
+			# Check
+			rows = readTestDbTable(dbFile, 'SELECT tree, name, data, gzip_data FROM response_cache')
+			self.assertEqual({(tree, name) for tree, name, _, _ in rows},
+				{('trimmed', 'one'), ('trimmed', 'two'), ('trimmed', 'five')})
+			for tree, name, data, gzipData in rows:
+				response = handleReq(dbFile, {'QUERY_STRING': f'name={name}&type=node&tree=trimmed'})
+				self.assertEqual(data, encodeResponse(response))
+				self.assertEqual(gzip.decompress(gzipData), data)
@@ -0,0 +1,57 @@
+import unittest
+import tempfile
+import os
+
+from tests.common import readTestDbTable
+from tests.test_tilo import initTestDb
+from tol_data.gen_search_data import genData
+from tilo import handleReq, SearchSugg
+
+class TestGenData(unittest.TestCase):
+	def test_gen(self):
+		with tempfile.TemporaryDirectory() as tempDir:
+			# Create temp tree-of-life db
+			dbFile = os.path.join(tempDir, 'data.db')
+			initTestDb(dbFile)
+			queryStrs = [f'name={s}&type=sugg&tree=trimmed&limit={limit}'
+				for s in ['t', 'T', 'tw', 'wo', 'hre', 'x'] for limit in [1, 2, 5]]
+			queryStrs += [f'name={s}&type=sugg&tree=trimmed&limit=5' for s in ['e', 'v']] # Avoids popularity ties
+			responses = [handleReq(dbFile, {'QUERY_STRING': q}) for q in queryStrs]
+			pagedSearchStrs = ['t', 'tu', 'o', 'e', 'v', 'i', 'x']
+			pagedResponses = [getAllSuggPages(dbFile, s, limit) for s in pagedSearchStrs for limit in [1, 2, 50]]
+			# Run
+			genData(dbFile)
+			# Check
+			self.assertEqual(
+				readTestDbTable(dbFile, 'SELECT search_name, name, alt_name, pref_alt, pop FROM search_t'),
+				{
+					('one', 'one', None, None, 10),
+					('two', 'two', None, None, 20),
+					('three', 'three', None, None, 0),
+					('four', 'four', None, None, 0),
+					('five', 'five', None, None, 0),
+					('six', 'six', None, None, 0),
+					('seven', 'seven', None, None, 0),
+					('turtle', 'one', 'turtle', 1, 10),
+					('ii', 'two', 'II', 1, 20),
+					('v', 'five', 'V', 0, 0),
+					('vi', 'six', 'VI', 1, 0),
+				}
+			)
+			for queryStr, response in zip(queryStrs, responses):
+				self.assertEqual(handleReq(dbFile, {'QUERY_STRING': queryStr}), response, queryStr)
+			# Check a search string ending with the max code point
+			self.assertEqual(handleReq(dbFile, {'QUERY_STRING': 'name=t%F4%8F%BF%BF&type=sugg&tree=trimmed'}).suggs, [])
+			self.assertEqual(
+				[getAllSuggPages(dbFile, s, limit) for s in pagedSearchStrs for limit in [1, 2, 50]], pagedResponses)
+
+def getAllSuggPages(dbFile: str, searchStr: str, limit: int) -> list[SearchSugg]:
+	""" Returns the suggestions from all pages of a paged 'sugg' request """
+	suggs: list[SearchSugg] = []
+	queryStr = f'name={searchStr}&type=sugg&tree=trimmed&paged=1&limit={limit}'
+	while True:
+		response = handleReq(dbFile, {'QUERY_STRING': queryStr})
+		suggs.extend(response.suggs)
+		if not response.hasMore:
+			return suggs
+		queryStr = f'name={searchStr}&type=sugg&tree=trimmed&limit={limit}&cursor={response.cursor}'
@@ -0,0 +1,43 @@
+import unittest
+import tempfile
+import os
+import sqlite3
+
+from tests.test_tilo import initTestDb
+from tol_data.gen_sugg_index import genData
+from tilo import SuggIndex, getDbIdentity, getDbPool, getSuggIndex
+
+class TestGenData(unittest.TestCase):
+	def test_gen(self):
+		with tempfile.TemporaryDirectory() as tempDir:
+			# Create temp tree-of-life db
+			dbFile = os.path.join(tempDir, 'data.db')
+			initTestDb(dbFile)
+			# Run
+			genData(['trimmed', 'images'], dbFile, tempDir)
+			# Check
+			self.assertFalse(os.path.exists(os.path.join(tempDir, 'sugg_i.json')))
+			dbCon = sqlite3.connect(dbFile)
+			dbIndex = SuggIndex.fromDb('trimmed', dbCon.cursor())
+			dbCon.close()
+			fileIndex = SuggIndex.load(os.path.join(tempDir, 'sugg_t.json'), getDbIdentity(dbFile))
+			assert fileIndex is not None
+			for prefix in ['t', 'T', 'tw', 'tu', 'o', 'v', 'x']:
+				for limit in [1, 2, 5]:
+					self.assertEqual(fileIndex.lookupSuggs(prefix, limit), dbIndex.lookupSuggs(prefix, limit))
+			self.assertEqual(fileIndex.lookupSuggs('t', 1).suggs[0].name, 'two')
+
+	def test_db_identity(self):
+		with tempfile.TemporaryDirectory() as tempDir:
+			dbFile = os.path.join(tempDir, 'data.db')
+			initTestDb(dbFile)
+			genData(['trimmed'], dbFile, tempDir)
+			self.assertEqual(getSuggIndex(getDbPool(dbFile), 'trimmed').lookupSuggs('t', 1).suggs[0].name, 'two')
+			# Check that a file generated from a different version of the db is ignored
+			dbCon = sqlite3.connect(dbFile)
+			dbCon.execute('UPDATE node_pop SET pop = 30 WHERE name = ?', ('one',))
+			dbCon.commit()
+			dbCon.close()
+			self.assertIsNone(SuggIndex.load(os.path.join(tempDir, 'sugg_t.json'), getDbIdentity(dbFile)))
+			self.assertEqual(getSuggIndex(getDbPool(dbFile), 'trimmed').lookupSuggs('t', 1).suggs[0].name, 'turtle')
+			getDbPool(dbFile).close()
@@ -0,0 +1,66 @@
+import unittest
+import tempfile
+import os
+import sqlite3
+
+from tests.test_tilo import initTestDb
+from tol_data.gen_tree_files import genData
+from tilo import DbTreeSnapshot, MappedTreeSnapshot, getDbPool, getTreeSnapshot
+
+class TestGenData(unittest.TestCase):
+	def test_gen(self):
+		with tempfile.TemporaryDirectory() as tempDir:
+			# Create temp tree-of-life db
+			dbFile = os.path.join(tempDir, 'data.db')
+			initTestDb(dbFile)
+			dbCon = sqlite3.connect(dbFile)
+			dbCon.execute('INSERT INTO linked_imgs VALUES (?, ?)', ('three', ',ott4'))
+			dbCon.commit()
+			# Run
+			genData(['trimmed'], dbFile, tempDir)
+			# Check
+			dbSnapshot = DbTreeSnapshot('trimmed', dbCon.cursor())
+			dbCon.close()
+			mappedSnapshot = MappedTreeSnapshot(os.path.join(tempDir, 'tree_t.bin'))
+			names = ['one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight']
+			for name in names:
+				idx = dbSnapshot.getIdx(name)
+				mappedIdx = mappedSnapshot.getIdx(name)
+				if idx is None:
+					self.assertIsNone(mappedIdx)
+					continue
+				self.assertEqual(mappedSnapshot.getName(mappedIdx), name)
+				self.assertEqual(mappedSnapshot.getNode(mappedIdx), dbSnapshot.getNode(idx))
+				self.assertEqual(mappedSnapshot.getNode(mappedIdx).children, dbSnapshot.getNode(idx).children)
+			self.assertEqual(
+				mappedSnapshot.lookupAncestry('seven', 'four'),
+				dbSnapshot.lookupAncestry('seven', 'four'))
+
+	def test_gen_without_ord(self):
+		with tempfile.TemporaryDirectory() as tempDir:
+			dbFile = os.path.join(tempDir, 'data.db')
+			initTestDb(dbFile)
+			dbCon = sqlite3.connect(dbFile)
+			dbCon.execute('ALTER TABLE edges_t DROP COLUMN ord')
+			dbCon.commit()
+			dbCon.close()
+			genData(['trimmed'], dbFile, tempDir)
+			mappedSnapshot = MappedTreeSnapshot(os.path.join(tempDir, 'tree_t.bin'))
+			self.assertEqual(mappedSnapshot.getNode(mappedSnapshot.getIdx('one')).children, ['two', 'five'])
+			self.assertEqual(mappedSnapshot.getNode(mappedSnapshot.getIdx('two')).children, ['four', 'three'])
+
+	def test_db_identity(self):
+		with tempfile.TemporaryDirectory() as tempDir:
+			dbFile = os.path.join(tempDir, 'data.db')
+			initTestDb(dbFile)
+			genData(['trimmed'], dbFile, tempDir)
+			self.assertIsInstance(getTreeSnapshot(getDbPool(dbFile), 'trimmed'), MappedTreeSnapshot)
+			# Check that a file generated from a different version of the db is ignored
+			dbCon = sqlite3.connect(dbFile)
+			dbCon.execute('UPDATE nodes_t SET tips = 4 WHERE name = ?', ('one',))
+			dbCon.commit()
+			dbCon.close()
+			snapshot = getTreeSnapshot(getDbPool(dbFile), 'trimmed')
+			self.assertIsInstance(snapshot, DbTreeSnapshot)
+			self.assertEqual(snapshot.getNode(snapshot.getIdx('one')).tips, 4)
+			getDbPool(dbFile).close()
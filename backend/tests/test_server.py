@@ -0,0 +1,119 @@
+import unittest
+import unittest.mock
+import tempfile
+import os
+import shutil
+import threading
+import urllib.request
+import urllib.error
+
+import server
+
+TEST_IMG = os.path.join(os.path.dirname(__file__), 'red.png')
+
+class TestServeImage(unittest.TestCase):
+	def test_serve(self):
+		with tempfile.TemporaryDirectory() as tempDir:
+			shutil.copy(TEST_IMG, os.path.join(tempDir, 'a.png'))
+			with unittest.mock.patch.object(server, 'IMG_DIR', tempDir):
+				status, headers, data = runApp({'PATH_INFO': '/tol_data/img/a.png', 'REQUEST_METHOD': 'GET'})
+				self.assertEqual(status, '200 OK')
+				with open(TEST_IMG, 'rb') as file:
+					self.assertEqual(data, file.read())
+				self.assertEqual(headers['Content-Length'], str(len(data)))
+				self.assertEqual(headers['Content-type'], 'image/png')
+				self.assertEqual(headers['Cache-Control'], server.IMG_CACHE_CONTROL)
+				# Check conditional and HEAD requests
+				conditionalEnviron = {'PATH_INFO': '/tol_data/img/a.png', 'REQUEST_METHOD': 'GET',
+					'HTTP_IF_NONE_MATCH': headers['ETag']}
+				self.assertEqual(runApp(conditionalEnviron)[:3:2], ('304 Not Modified', b''))
+				headEnviron = {'PATH_INFO': '/tol_data/img/a.png', 'REQUEST_METHOD': 'HEAD'}
+				self.assertEqual(runApp(headEnviron)[2], b'')
+				# Check missing images
+				for path in ['/tol_data/img/b.png', '/tol_data/img/../a.png', '/tol_data/img/.']:
+					self.assertEqual(runApp({'PATH_INFO': path, 'REQUEST_METHOD': 'GET'})[0], '404 Not Found')
+
+class TestImgFileCache(unittest.TestCase):
+	def test_cache(self):
+		with tempfile.TemporaryDirectory() as tempDir:
+			paths = [os.path.join(tempDir, name) for name in ['a.png', 'b.png', 'c.png']]
+			for path in paths[:2]:
+				shutil.copy(TEST_IMG, path)
+			cache = server.ImgFileCache(1, 100)
+			fileA = cache.acquire(paths[0])
+			assert fileA is not None
+			self.assertEqual(fileA.size, os.path.getsize(TEST_IMG))
+			self.assertIs(cache.acquire(paths[0]), fileA)
+			self.assertEqual((fileA.numUsers, cache.hits), (2, 1))
+			# Check that evicted files are closed once unused
+			fileB = cache.acquire(paths[1])
+			assert fileB is not None
+			self.assertTrue(fileA.evicted)
+			cache.release(fileA)
+			os.fstat(fileA.fd)
+			cache.release(fileA)
+			with self.assertRaises(OSError):
+				os.fstat(fileA.fd)
+			cache.release(fileB)
+			os.fstat(fileB.fd)
+			# Check caching of missing files
+			self.assertIsNone(cache.acquire(paths[2]))
+			shutil.copy(TEST_IMG, paths[2])
+			self.assertIsNone(cache.acquire(paths[2]))
+			self.assertEqual(cache.hits, 2)
+			cache.misses[paths[2]] = 0
+			fileC = cache.acquire(paths[2])
+			assert fileC is not None
+			cache.release(fileC)
+			cache.clear()
+			with self.assertRaises(OSError):
+				os.fstat(fileC.fd)
+
+	def test_responses_release_files(self):
+		with tempfile.TemporaryDirectory() as tempDir:
+			shutil.copy(TEST_IMG, os.path.join(tempDir, 'a.png'))
+			cache = server.ImgFileCache(10, 100)
+			with unittest.mock.patch.object(server, 'IMG_DIR', tempDir), \
+					unittest.mock.patch.object(server, 'imgFileCache', cache):
+				_, headers, _ = runApp({'PATH_INFO': '/tol_data/img/a.png', 'REQUEST_METHOD': 'GET'})
+				runApp({'PATH_INFO': '/tol_data/img/a.png', 'REQUEST_METHOD': 'HEAD'})
+				runApp({'PATH_INFO': '/tol_data/img/a.png', 'REQUEST_METHOD': 'GET', 'HTTP_IF_NONE_MATCH': headers['ETag']})
+				# Check a response that is closed without being read, as for a client disconnect
+				dataIter = server.wrappingApp({'PATH_INFO': '/tol_data/img/a.png', 'REQUEST_METHOD': 'GET'}, lambda *args: None)
+				self.assertEqual(cache.files[os.path.join(tempDir, 'a.png')].numUsers, 1)
+				dataIter.close()
+				self.assertEqual(cache.files[os.path.join(tempDir, 'a.png')].numUsers, 0)
+			cache.clear()
+
+class TestServer(unittest.TestCase):
+	def test_threaded_server(self):
+		with tempfile.TemporaryDirectory() as tempDir:
+			shutil.copy(TEST_IMG, os.path.join(tempDir, 'a.png'))
+			with unittest.mock.patch.object(server, 'IMG_DIR', tempDir), \
+					unittest.mock.patch.object(server.RequestHandler, 'log_message'), \
+					server.makeServer(0, 4) as httpd:
+				thread = threading.Thread(target=httpd.serve_forever)
+				thread.start()
+				try:
+					url = f'http://localhost:{httpd.server_port}/tol_data/img/a.png'
+					with urllib.request.urlopen(url) as response:
+						data = response.read()
+						self.assertEqual(response.headers['Content-Length'], str(len(data)))
+					with open(TEST_IMG, 'rb') as file:
+						self.assertEqual(data, file.read())
+					with self.assertRaises(urllib.error.HTTPError):
+						urllib.request.urlopen(f'http://localhost:{httpd.server_port}/x')
+				finally:
+					httpd.shutdown()
+					thread.join()
+
+def runApp(environ: dict) -> tuple[str, dict[str, str], bytes]:
+	""" Runs the server's WSGI app, and returns the status, headers, and data """
+	result: list = []
+	def start_response(status, headers):
+		result.extend([status, dict(headers)])
+	dataIter = server.wrappingApp(environ, start_response)
+	data = b''.join(dataIter)
+	if hasattr(dataIter, 'close'):
+		dataIter.close()
+	return result[0], result[1], data
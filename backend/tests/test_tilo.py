@@ -1,9 +1,19 @@
 import unittest
+import unittest.mock
 import tempfile
 import os
+import sqlite3
+import json
+import gzip
+import io
+import urllib.parse
+import asyncio
+import time
+import threading
 
 from tests.common import createTestDbTable
-from tilo import handleReq, TolNode, SearchSuggResponse, SearchSugg, InfoResponse, NodeInfo, DescInfo, ImgInfo
+import tilo
+from tilo import getDbPool, encodeResponse, parseQuery, getResponseData, ResponseCache, CachedResponse, CompressionCache, negotiateEncoding, compressResponse, SingleFlight, SuggIndex, getEditDistance, handleReq, TreeSnapshot, TolNode, SearchSuggResponse, SearchSugg, InfoResponse, NodeInfo, DescInfo, ImgInfo, AtlasRef, AtlasInfo, AtlasResponse
 
 def initTestDb(dbFile: str) -> None:
 	# Test tree (I/D means image/desc):
@@ -26,15 +36,15 @@ def initTestDb(dbFile: str) -> None:
 	)
 	createTestDbTable(
 		dbFile,
-		'CREATE TABLE edges_t (parent TEXT, child TEXT, p_support INT, PRIMARY KEY (parent, child))',
-		'INSERT INTO edges_t VALUES (?, ?, ?)',
+		'CREATE TABLE edges_t (parent TEXT, child TEXT, p_support INT, ord INT, PRIMARY KEY (parent, child))',
+		'INSERT INTO edges_t VALUES (?, ?, ?, ?)',
 		{
-			('one', 'two', 1),
-			('two', 'three', 0),
-			('two', 'four', 1),
-			('one', 'five', 0),
-			('five', 'six', 1),
-			('six', 'seven', 1),
+			('one', 'two', 1, 0),
+			('two', 'three', 0, 1),
+			('two', 'four', 1, 0),
+			('one', 'five', 0, 1),
+			('five', 'six', 1, 0),
+			('six', 'seven', 1, 0),
 		}
 	)
 	createTestDbTable(
@@ -135,6 +145,26 @@ class TestHandleReq(unittest.TestCase):
 			'four': TolNode('ott4', [], 'two', 1, True, None, 'ott4.jpg', None),
 		})
 
+	def test_node_child_order(self):
+		response = handleReq(self.dbFile, {'QUERY_STRING': 'name=one&type=node&tree=trimmed'})
+		self.assertEqual(response['one'].children, ['two', 'five']) # Ordered by tips
+		self.assertEqual(response['two'].children, ['four', 'three']) # Ordered by name for equal tips
+
+	def test_node_child_order_without_ord(self):
+		dbCon = sqlite3.connect(self.dbFile)
+		dbCon.execute('ALTER TABLE edges_t DROP COLUMN ord')
+		dbCon.commit()
+		dbCon.close()
+		response = handleReq(self.dbFile, {'QUERY_STRING': 'name=one&type=node&tree=trimmed'})
+		self.assertEqual(response['one'].children, ['two', 'five'])
+		self.assertEqual(response['two'].children, ['four', 'three'])
+		tilo.SNAPSHOT_TREES = {'trimmed'}
+		try:
+			snapshotResponse = handleReq(self.dbFile, {'QUERY_STRING': 'name=one&type=node&tree=trimmed'})
+			self.assertEqual(snapshotResponse['two'].children, ['four', 'three'])
+		finally:
+			tilo.SNAPSHOT_TREES = set()
+
 	def test_node_toroot_req(self):
 		response = handleReq(self.dbFile, {'QUERY_STRING': 'name=seven&type=node&toroot=1&excl=five&tree=trimmed'})
 		self.assertEqual(response, {
@@ -143,6 +173,124 @@ class TestHandleReq(unittest.TestCase):
 			'seven': TolNode('ott7', [], 'six', 1, 1, None, None, None),
 		})
 
+	def test_node_toroot_no_excl_req(self):
+		response = handleReq(self.dbFile, {'QUERY_STRING': 'name=three&type=node&toroot=1&tree=trimmed'})
+		self.assertEqual(list(response.keys()), ['three', 'two', 'four', 'one', 'five'])
+		self.assertEqual(response, {
+			'one': TolNode('ott1', ['two', 'five'], None, 3, False, 'turtle', 'ott1.jpg', 'vulnerable'),
+			'two': TolNode('ott2', ['three', 'four'], 'one', 2, True, 'II', 'ott4.jpg', None),
+			'three': TolNode('ott3', [], 'two', 1, False, None, None, None),
+			'four': TolNode('ott4', [], 'two', 1, True, None, 'ott4.jpg', None),
+			'five': TolNode('ott5', ['six'], 'one', 1, False, None, 'ott5.jpg', None),
+		})
+
+	def test_node_toroot_ranges_req(self):
+		createTestDbTable(
+			self.dbFile,
+			'CREATE TABLE node_ranges_t (name TEXT PRIMARY KEY, pre_idx INT UNIQUE, end_idx INT, depth INT)',
+			'INSERT INTO node_ranges_t VALUES (?, ?, ?, ?)',
+			{
+				('one', 0, 6, 0),
+				('two', 1, 3, 1),
+				('four', 2, 2, 2),
+				('three', 3, 3, 2),
+				('five', 4, 6, 1),
+				('six', 5, 6, 2),
+				('seven', 6, 6, 3),
+			}
+		)
+		response = handleReq(self.dbFile, {'QUERY_STRING': 'name=seven&type=node&toroot=1&excl=four&tree=trimmed'})
+		self.assertEqual(response, {
+			'five': TolNode('ott5', ['six'], 'one', 1, 0, None, 'ott5.jpg', None),
+			'six': TolNode('ott6', ['seven'], 'five', 1, 1, 'VI', 'ott6.jpg', 'endangered'),
+			'seven': TolNode('ott7', [], 'six', 1, 1, None, None, None),
+		})
+
+	def test_node_snapshot_req(self):
+		queryStrs = [
+			'name=one&type=node&tree=trimmed',
+			'name=two&type=node&tree=trimmed',
+			'name=eight&type=node&tree=trimmed',
+			'name=seven&type=node&toroot=1&tree=trimmed',
+			'name=seven&type=node&toroot=1&excl=four&tree=trimmed',
+		]
+		responses = [handleReq(self.dbFile, {'QUERY_STRING': q}) for q in queryStrs]
+		tilo.SNAPSHOT_TREES = {'trimmed'}
+		try:
+			for queryStr, response in zip(queryStrs, responses):
+				snapshotResponse = handleReq(self.dbFile, {'QUERY_STRING': queryStr})
+				self.assertEqual(snapshotResponse, response)
+				if response is not None:
+					for name, node in response.items():
+						self.assertEqual(snapshotResponse[name].children, node.children)
+				if 'toroot' in queryStr:
+					self.assertEqual(list(snapshotResponse.keys()), list(response.keys()))
+			self.assertIn('trimmed', getDbPool(self.dbFile).snapshots)
+		finally:
+			tilo.SNAPSHOT_TREES = set()
+
+	def test_node_depth_req(self):
+		response = handleReq(self.dbFile, {'QUERY_STRING': 'name=one&type=node&depth=1&tree=trimmed'})
+		self.assertEqual(response, handleReq(self.dbFile, {'QUERY_STRING': 'name=one&type=node&tree=trimmed'}))
+		response = handleReq(self.dbFile, {'QUERY_STRING': 'name=one&type=node&depth=2&tree=trimmed'})
+		self.assertEqual(list(response.keys()), ['one', 'two', 'five', 'four', 'three', 'six'])
+		self.assertEqual(response['six'], TolNode('ott6', ['seven'], 'five', 1, True, 'VI', 'ott6.jpg', 'endangered'))
+		response = handleReq(self.dbFile, {'QUERY_STRING': 'name=one&type=node&depth=5&tree=trimmed'})
+		self.assertEqual(set(response.keys()), {'one', 'two', 'three', 'four', 'five', 'six', 'seven'})
+		# Check node limit, which should exclude the children of 'five' before those of 'two'
+		with unittest.mock.patch.object(tilo, 'MAX_DEPTH_NODES', 5):
+			response = handleReq(self.dbFile, {'QUERY_STRING': 'name=one&type=node&depth=2&tree=trimmed'})
+			self.assertEqual(list(response.keys()), ['one', 'two', 'five', 'four', 'three'])
+			tilo.SNAPSHOT_TREES = {'trimmed'}
+			try:
+				snapshotResponse = handleReq(self.dbFile, {'QUERY_STRING': 'name=one&type=node&depth=2&tree=trimmed'})
+				self.assertEqual(list(snapshotResponse.keys()), list(response.keys()))
+			finally:
+				tilo.SNAPSHOT_TREES = set()
+		# Check with 'nodes' request
+		nodesStr = urllib.parse.quote(json.dumps([{'name': 'five', 'depth': 2}, 'two']))
+		response = handleReq(self.dbFile, {'QUERY_STRING': f'type=nodes&tree=trimmed&nodes={nodesStr}'})
+		self.assertEqual(set(response.keys()), {'five', 'six', 'seven', 'two', 'three', 'four'})
+		# Check invalid depths
+		for depth in ['0', 'x', str(tilo.MAX_NODE_DEPTH + 1)]:
+			self.assertIsNone(handleReq(self.dbFile, {'QUERY_STRING': f'name=one&type=node&depth={depth}&tree=trimmed'}))
+
+	def test_nodes_req(self):
+		nodeReqs = [
+			{'name': 'two'},
+			'five',
+			{'name': 'seven', 'toroot': 1, 'excl': 'four'},
+			{'name': 'three', 'toroot': True},
+			{'name': 'eight'},
+		]
+		queryStrs = ['name=two&type=node&tree=trimmed', 'name=five&type=node&tree=trimmed',
+			'name=seven&type=node&toroot=1&excl=four&tree=trimmed', 'name=three&type=node&toroot=1&tree=trimmed']
+		expected: dict[str, TolNode] = {}
+		for queryStr in queryStrs:
+			expected.update(handleReq(self.dbFile, {'QUERY_STRING': queryStr}))
+		nodesStr = urllib.parse.quote(json.dumps(nodeReqs))
+		response = handleReq(self.dbFile, {'QUERY_STRING': f'type=nodes&tree=trimmed&nodes={nodesStr}'})
+		self.assertEqual(response, expected)
+		for name, node in response.items():
+			self.assertEqual(node.children, expected[name].children)
+		# Check POST request
+		body = json.dumps(nodeReqs).encode()
+		environ = {'QUERY_STRING': 'type=nodes&tree=trimmed', 'REQUEST_METHOD': 'POST',
+			'CONTENT_LENGTH': str(len(body)), 'wsgi.input': io.BytesIO(body)}
+		self.assertEqual(handleReq(self.dbFile, environ), expected)
+		# Check with snapshot
+		tilo.SNAPSHOT_TREES = {'trimmed'}
+		try:
+			response = handleReq(self.dbFile, {'QUERY_STRING': f'type=nodes&tree=trimmed&nodes={nodesStr}'})
+			self.assertEqual(response, expected)
+		finally:
+			tilo.SNAPSHOT_TREES = set()
+		# Check invalid requests
+		for nodesStr in ['[', '{}', '[1]', '[{"name": "two", "excl": 1, "toroot": 1}]',
+				json.dumps(['two'] * (tilo.MAX_BATCH_NODES + 1))]:
+			queryStr = f'type=nodes&tree=trimmed&nodes={urllib.parse.quote(nodesStr)}'
+			self.assertIsNone(handleReq(self.dbFile, {'QUERY_STRING': queryStr}))
+
 	def test_sugg_req(self):
 		response = handleReq(self.dbFile, {'QUERY_STRING': 'name=t&type=sugg&tree=trimmed'})
 		self.assertEqual(response, SearchSuggResponse(
@@ -154,6 +302,60 @@ class TestHandleReq(unittest.TestCase):
 			False
 		))
 
+	def test_sugg_paged_req(self):
+		response = handleReq(self.dbFile, {'QUERY_STRING': 'name=t&type=sugg&tree=trimmed&paged=1&limit=2'})
+		self.assertEqual(response.suggs, [SearchSugg('turtle', 'one', 10), SearchSugg('two', None, 20)])
+		self.assertTrue(response.hasMore)
+		response = handleReq(self.dbFile,
+			{'QUERY_STRING': f'name=t&type=sugg&tree=trimmed&limit=2&cursor={response.cursor}'})
+		self.assertEqual(response, SearchSuggResponse([SearchSugg('three', None, 0)], False))
+		# Check that paging gives the same suggestions as a non-paged request
+		for searchStr in ['t', 'e', 'v', 'i', 'x']:
+			expected = handleReq(self.dbFile, {'QUERY_STRING': f'name={searchStr}&type=sugg&tree=trimmed&limit=50'})
+			for limit in [1, 2, 3]:
+				suggs: list[SearchSugg] = []
+				queryStr = f'name={searchStr}&type=sugg&tree=trimmed&paged=1&limit={limit}'
+				while True:
+					response = handleReq(self.dbFile, {'QUERY_STRING': queryStr})
+					suggs.extend(response.suggs)
+					if not response.hasMore:
+						self.assertIsNone(response.cursor)
+						break
+					queryStr = f'name={searchStr}&type=sugg&tree=trimmed&limit={limit}&cursor={response.cursor}'
+				self.assertEqual(len(suggs), len(expected.suggs))
+				self.assertEqual(set(suggs), set(expected.suggs), (searchStr, limit))
+		# Check invalid cursors
+		self.assertIsNone(handleReq(self.dbFile, {'QUERY_STRING': 'name=t&type=sugg&tree=trimmed&cursor=abc'}))
+		self.assertIsNone(handleReq(self.dbFile, {'QUERY_STRING': 'name=t&type=sugg&tree=trimmed&cursor=WzUsMCwiYSJd'}))
+
+	def test_sugg_index_req(self):
+		queryStrs = [f'name={s}&type=sugg&tree=trimmed&limit={limit}'
+			for s in ['t', 'T', 'tw', 'tu', 'x'] for limit in [1, 2, 5]]
+		queryStrs += [f'name={s}&type=sugg&tree=trimmed&limit=5' for s in ['f', 'v', 's', 'e']] # Avoids popularity ties
+		responses = [handleReq(self.dbFile, {'QUERY_STRING': q}) for q in queryStrs]
+		tilo.SUGG_INDEX_TREES = {'trimmed'}
+		try:
+			for queryStr, response in zip(queryStrs, responses):
+				self.assertEqual(handleReq(self.dbFile, {'QUERY_STRING': queryStr}), response, queryStr)
+			self.assertIn('trimmed', getDbPool(self.dbFile).suggIndexes)
+		finally:
+			tilo.SUGG_INDEX_TREES = set()
+
+	def test_sugg_fuzzy_req(self):
+		queryStr = 'name=tirtle&type=sugg&tree=trimmed&fuzzy=1'
+		self.assertEqual(handleReq(self.dbFile, {'QUERY_STRING': queryStr}), SearchSuggResponse([], False))
+		tilo.SUGG_INDEX_TREES = {'trimmed'}
+		try:
+			self.assertEqual(handleReq(self.dbFile, {'QUERY_STRING': queryStr}),
+				SearchSuggResponse([SearchSugg('turtle', 'one', 10)], False))
+			# Check that exact matches come first, and that 'hasMore' accounts for fuzzy matches
+			response = handleReq(self.dbFile, {'QUERY_STRING': 'name=sevem&type=sugg&tree=trimmed&fuzzy=1'})
+			self.assertEqual(response, SearchSuggResponse([SearchSugg('seven', None, 0)], False))
+			response = handleReq(self.dbFile, {'QUERY_STRING': 'name=tw&type=sugg&tree=trimmed&fuzzy=1&limit=1'})
+			self.assertEqual(response, SearchSuggResponse([SearchSugg('two', None, 20)], False))
+		finally:
+			tilo.SUGG_INDEX_TREES = set()
+
 	def test_info_req(self):
 		response = handleReq(self.dbFile, {'QUERY_STRING': 'name=six&type=info&tree=trimmed'})
 		self.assertEqual(response, InfoResponse(
@@ -164,3 +366,510 @@ class TestHandleReq(unittest.TestCase):
 			),
 			[]
 		))
+
+	def test_info_omit_tolnode_req(self):
+		response = handleReq(self.dbFile, {'QUERY_STRING': 'name=two&type=info&tree=trimmed&tolnode=0'})
+		self.assertEqual(response, InfoResponse(
+			NodeInfo(
+				None,
+				DescInfo('two is 2', 200, True),
+				ImgInfo(10, 'enwiki', 'url2', 'license2', 'artist2', 'credit2'),
+			),
+			[]
+		))
+		self.assertIsNone(handleReq(self.dbFile, {'QUERY_STRING': 'name=eight&type=info&tree=trimmed&tolnode=0'}))
+
+	def test_info_compound_req(self):
+		dbCon = sqlite3.connect(self.dbFile)
+		dbCon.execute('INSERT INTO nodes_t VALUES (?, ?, ?)', ('[three + eight]', 'mrcaott3ott8', 1))
+		dbCon.execute('INSERT INTO edges_t VALUES (?, ?, ?, ?)', ('five', '[three + eight]', 0, 1))
+		dbCon.commit()
+		dbCon.close()
+		for tolnodeParam in ['', '&tolnode=0']:
+			response = handleReq(self.dbFile,
+				{'QUERY_STRING': f'name=[three %2B eight]&type=info&tree=trimmed{tolnodeParam}'})
+			self.assertEqual(response, InfoResponse(
+				NodeInfo(
+					TolNode('mrcaott3ott8', [], 'five', 1, False, None, None, None) if not tolnodeParam else None,
+					None,
+					None,
+				),
+				[
+					NodeInfo(
+						TolNode('ott3', [], 'two', 1, False, None, None, None),
+						DescInfo('three is 3', 300, False),
+						None,
+					),
+					None,
+				]
+			))
+
+	def test_atlas_req(self):
+		createTestDbTable(
+			self.dbFile,
+			'CREATE TABLE atlases_t (parent TEXT, page INT, file TEXT,' \
+				' cols INT, rows INT, cell_size INT, offsets TEXT, PRIMARY KEY (parent, page))',
+			'INSERT INTO atlases_t VALUES (?, ?, ?, ?, ?, ?, ?)',
+			{
+				('one', 0, 'atlas_t_0.jpg', 1, 1, 200, '{"ott4.jpg": [0, 0]}'),
+				('one', 1, 'atlas_t_1.jpg', 1, 1, 200, '{"ott5.jpg": [0, 0]}'),
+			}
+		)
+		createTestDbTable(
+			self.dbFile,
+			'CREATE TABLE atlas_nodes_t (name TEXT PRIMARY KEY, parent TEXT, page INT, pos TEXT)',
+			'INSERT INTO atlas_nodes_t VALUES (?, ?, ?, ?)',
+			{
+				('two', 'one', 0, '[0, 0]'),
+				('five', 'one', 1, '[0, 0]'),
+			}
+		)
+		response = handleReq(self.dbFile, {'QUERY_STRING': 'name=one&type=atlas&tree=trimmed'})
+		self.assertEqual(response, AtlasResponse([
+			AtlasInfo('atlas_t_0.jpg', 1, 1, 200, {'ott4.jpg': [0, 0]}),
+			AtlasInfo('atlas_t_1.jpg', 1, 1, 200, {'ott5.jpg': [0, 0]}),
+		]))
+		self.assertIsNone(handleReq(self.dbFile, {'QUERY_STRING': 'name=two&type=atlas&tree=trimmed'}))
+		# Check atlas references in node responses
+		queryStr = 'name=one&type=node&tree=trimmed'
+		response = handleReq(self.dbFile, {'QUERY_STRING': queryStr})
+		self.assertEqual(response['two'].atlas, AtlasRef('atlas_t_0.jpg', 1, 1, [0, 0]))
+		self.assertEqual(response['five'].atlas, AtlasRef('atlas_t_1.jpg', 1, 1, [0, 0]))
+		self.assertIsNone(response['one'].atlas)
+		self.assertEqual(json.loads(encodeResponse(response))['two']['atlas'],
+			{'file': 'atlas_t_0.jpg', 'size': [1, 1], 'pos': [0, 0]})
+		self.assertNotIn('atlas', json.loads(encodeResponse(response))['one'])
+		tilo.SNAPSHOT_TREES = {'trimmed'}
+		try:
+			self.assertEqual(handleReq(self.dbFile, {'QUERY_STRING': queryStr}), response)
+		finally:
+			tilo.SNAPSHOT_TREES = set()
+
+class TestSuggIndex(unittest.TestCase):
+	def test_prefix_lookup(self):
+		rows = [
+			('one', None, None, 10),
+			('onyx', None, None, 5),
+			('two', None, None, 20),
+			('ten', None, None, None),
+			('tent', None, None, 3),
+			('one', 'Turtle', 1, 10),
+			('one', 'tortoise', 0, 10),
+			('two', 'tortilla', 0, 20),
+			('ten', 'toad', 1, None),
+		]
+		# Check that precomputed entry lists give the same results as scanning
+		with unittest.mock.patch.object(SuggIndex, 'SCAN_LIMIT', 1):
+			suggIndex = SuggIndex(rows)
+		self.assertIn('t', suggIndex.altNameIndex.topEntries)
+		scanIndex = SuggIndex(rows)
+		self.assertEqual(scanIndex.altNameIndex.topEntries, {})
+		for prefix in ['', 'o', 'on', 'one', 'onyx', 't', 'T', 'to', 'tor', 'tort', 'te', 'x']:
+			for limit in [1, 2, 3]:
+				self.assertEqual(
+					suggIndex.lookupSuggs(prefix, limit), scanIndex.lookupSuggs(prefix, limit), (prefix, limit))
+		# Check results
+		self.assertEqual(suggIndex.lookupSuggs('t', 2), SearchSuggResponse(
+			[SearchSugg('tortilla', 'two', 20), SearchSugg('Turtle', 'one', 10)], True))
+		self.assertEqual(suggIndex.lookupSuggs('on', 1), SearchSuggResponse([SearchSugg('one', None, 10)], True))
+		self.assertEqual(suggIndex.lookupSuggs('on', 2), None)
+
+	def test_fuzzy_lookup(self):
+		rows = [
+			('Panthera leo', None, None, 100),
+			('Panthera pardus', None, None, 80),
+			('Panthera onca', None, None, 50),
+			('Pantera', None, None, 5),
+			('Panthera leo', 'lion', 1, 100),
+			('Panthera pardus', 'leopard', 1, 80),
+		]
+		suggIndex = SuggIndex(rows)
+		self.assertEqual(suggIndex.lookupFuzzySuggs('panthera lep', 5, set()), [SearchSugg('Panthera leo', None, 100)])
+		self.assertEqual(suggIndex.lookupFuzzySuggs('panthera prdsu', 5, set()), [])
+		self.assertEqual(suggIndex.lookupFuzzySuggs('panthera prdus', 5, set()),
+			[SearchSugg('Panthera pardus', None, 80)])
+		self.assertEqual(suggIndex.lookupFuzzySuggs('lepard', 5, set()), [SearchSugg('leopard', 'Panthera pardus', 80)])
+		self.assertEqual(suggIndex.lookupFuzzySuggs('pnthera', 5, {'Pantera'}), [])
+		self.assertEqual(suggIndex.lookupFuzzySuggs('lio', 5, set()), [SearchSugg('lion', 'Panthera leo', 100)])
+		self.assertEqual(suggIndex.lookupFuzzySuggs('li', 5, set()), [])
+		# Check names with common trigrams, whose index lists exceed the limit
+		rows = [(f'Panthera le{i:02}', None, None, i) for i in range(50)] + [('Panthera leo', None, None, 100)]
+		with unittest.mock.patch.object(SuggIndex, 'FUZZY_MAX_POSTINGS', 10):
+			suggIndex = SuggIndex(rows)
+			self.assertEqual(suggIndex.lookupFuzzySuggs('panthera lep', 3, set()), [
+				SearchSugg('Panthera leo', None, 100), SearchSugg('Panthera le49', None, 49),
+				SearchSugg('Panthera le48', None, 48)])
+		# Check that the trigram index isn't stored
+		self.assertIsNotNone(suggIndex.gramIndex)
+		with tempfile.TemporaryDirectory() as tempDir:
+			indexFile = os.path.join(tempDir, 'sugg_t.json')
+			suggIndex.save(indexFile, (1, 2))
+			self.assertIsNone(SuggIndex.load(indexFile, (1, 3)))
+			loadedIndex = SuggIndex.load(indexFile, (1, 2))
+			assert loadedIndex is not None
+		self.assertIsNone(loadedIndex.gramIndex)
+		self.assertEqual(loadedIndex.lookupFuzzySuggs('lepard', 5, set()), suggIndex.lookupFuzzySuggs('lepard', 5, set()))
+
+	def test_edit_distance(self):
+		self.assertEqual(getEditDistance('leopard', 'leopard', 2), 0)
+		self.assertEqual(getEditDistance('leopard', 'lepard', 2), 1)
+		self.assertEqual(getEditDistance('leopard', 'leapord', 2), 2)
+		self.assertEqual(getEditDistance('leopard', 'lopar', 1), None)
+		self.assertEqual(getEditDistance('leopard', 'lion', 2), None)
+
+class TestTreeSnapshot(unittest.TestCase):
+	def test_abstract(self):
+		class PartialSnapshot(TreeSnapshot):
+			def getIdx(self, name):
+				return None
+		with self.assertRaises(TypeError):
+			PartialSnapshot() # type: ignore[abstract]
+
+class TestDbConnPool(unittest.TestCase):
+	def test_pool(self):
+		with tempfile.TemporaryDirectory() as tempDir:
+			dbFile = os.path.join(tempDir, 'data.db')
+			initTestDb(dbFile)
+			pool = getDbPool(dbFile)
+			# Check connection reuse
+			with pool.connection() as dbCon:
+				con1 = dbCon
+				with pool.connection() as dbCon2:
+					self.assertIsNot(dbCon2, con1)
+			with pool.connection() as dbCon:
+				self.assertIs(dbCon, con1)
+			self.assertIs(getDbPool(dbFile), pool)
+			# Check read-only access
+			with pool.connection() as dbCon:
+				with self.assertRaises(sqlite3.OperationalError):
+					dbCon.execute('DELETE FROM nodes_t')
+			# Check replacement after db file change
+			os.remove(dbFile)
+			initTestDb(dbFile)
+			createTestDbTable(dbFile, 'CREATE TABLE extra (x INT)', 'INSERT INTO extra VALUES (?)', {(1,)})
+			newPool = getDbPool(dbFile)
+			self.assertIsNot(newPool, pool)
+			self.assertTrue(pool.closed)
+			self.assertEqual(pool.numCons, 0)
+			newPool.close()
+
+class TestEncodeResponse(unittest.TestCase):
+	def test_encode(self):
+		responses = [
+			None,
+			{
+				'one': TolNode('ott1', ['two'], None, 1, False, 'turtle', ('ott2.jpg', None), 'vulnerable'),
+				'two': TolNode('ott2', [], 'one', 1, True, None, 'ott2.jpg', None),
+			},
+			SearchSuggResponse([SearchSugg('t\u00e9', 'one', 10), SearchSugg('two', None, 0)], True),
+			InfoResponse(
+				NodeInfo(
+					TolNode('ott1', [], None, 1, False, None, None, None),
+					DescInfo('one is 1', 100, True),
+					ImgInfo(1, 'eol', 'url1', 'license1', 'artist1', 'credit1')),
+				[None, NodeInfo(TolNode('ott2', [], None, 1, False, None, None, None), None, None)]),
+		]
+		expected = [
+			b'null',
+			b'{"one":{"otolId":"ott1","children":["two"],"parent":null,"tips":1,"pSupport":false,'
+				b'"commonName":"turtle","imgName":["ott2.jpg",null],"iucn":"vulnerable"},'
+				b'"two":{"otolId":"ott2","children":[],"parent":"one","tips":1,"pSupport":true,'
+				b'"commonName":null,"imgName":"ott2.jpg","iucn":null}}',
+			'{"suggs":[{"name":"t\u00e9","canonicalName":"one","pop":10},'
+				'{"name":"two","canonicalName":null,"pop":0}],"hasMore":true}'.encode(),
+			b'{"nodeInfo":{"tolNode":{"otolId":"ott1","children":[],"parent":null,"tips":1,'
+				b'"pSupport":false,"commonName":null,"imgName":null,"iucn":null},'
+				b'"descInfo":{"text":"one is 1","wikiId":100,"fromDbp":true},'
+				b'"imgInfo":{"id":1,"src":"eol","url":"url1","license":"license1",'
+				b'"artist":"artist1","credit":"credit1"}},'
+				b'"subNodesInfo":[null,{"tolNode":{"otolId":"ott2","children":[],"parent":null,"tips":1,'
+				b'"pSupport":false,"commonName":null,"imgName":null,"iucn":null},'
+				b'"descInfo":null,"imgInfo":null}]}',
+		]
+		# Check output without orjson
+		orjson = tilo.orjson
+		tilo.orjson = None
+		try:
+			for response, data in zip(responses, expected):
+				self.assertEqual(encodeResponse(response), data)
+		finally:
+			tilo.orjson = orjson
+		# Check that output with orjson is identical
+		if orjson is not None:
+			for response, data in zip(responses, expected):
+				self.assertEqual(encodeResponse(response), data)
+
+class TestResponseCache(unittest.TestCase):
+	def test_lru(self):
+		cache = ResponseCache(2, 10)
+		fileId = (1, 1, 1)
+		self.assertIsNone(cache.get(('a',), fileId))
+		cache.put(('a',), fileId, CachedResponse(b'aaa'))
+		cache.put(('b',), fileId, CachedResponse(b'bbb'))
+		self.assertEqual(cache.get(('a',), fileId).data, b'aaa')
+		cache.put(('c',), fileId, CachedResponse(b'ccc')) # Evicts 'b', as 'a' was used more recently
+		self.assertIsNone(cache.get(('b',), fileId))
+		cache.put(('d',), fileId, CachedResponse(b'ddddddd', b'd')) # Evicts 'a' and 'c', due to the byte limit
+		self.assertIsNone(cache.get(('a',), fileId))
+		self.assertIsNone(cache.get(('c',), fileId))
+		self.assertEqual(cache.get(('d',), fileId).gzipData, b'd')
+		self.assertEqual(cache.numBytes, 8)
+		self.assertEqual((cache.hits, cache.misses), (2, 4))
+		# Check invalidation
+		self.assertIsNone(cache.get(('d',), (1, 1, 2)))
+		self.assertEqual(cache.numBytes, 0)
+
+	def test_response_data(self):
+		with tempfile.TemporaryDirectory() as tempDir:
+			dbFile = os.path.join(tempDir, 'data.db')
+			initTestDb(dbFile)
+			hits = tilo.responseCache.hits
+			# Check that normalized queries share entries
+			query = parseQuery('name=two&type=node&tree=trimmed')
+			data, encoding = getResponseData(dbFile, query, None)
+			self.assertIsNone(encoding)
+			self.assertEqual(data, encodeResponse(handleReq(dbFile, {'QUERY_STRING': 'name=two&type=node&tree=trimmed'})))
+			query = parseQuery('tree=trimmed&type=node&name=two&excl=one')
+			self.assertEqual(getResponseData(dbFile, query, None), (data, None))
+			self.assertEqual(tilo.responseCache.hits, hits + 1)
+			gzipData, encoding = getResponseData(dbFile, query, 'gzip')
+			self.assertEqual(encoding, 'gzip')
+			self.assertEqual(gzip.decompress(gzipData), data)
+			# Check use of stored responses
+			createTestDbTable(
+				dbFile,
+				'CREATE TABLE response_cache (tree TEXT, name TEXT, data BLOB, gzip_data BLOB, PRIMARY KEY (tree, name))',
+				'INSERT INTO response_cache VALUES (?, ?, ?, ?)',
+				{('trimmed', 'one', b'{}', None)}
+			)
+			self.assertEqual(getResponseData(dbFile, parseQuery('type=node&name=one&tree=trimmed'), 'gzip'), (b'{}', None))
+			# Check invalidation upon db change
+			createTestDbTable(dbFile, None, 'INSERT INTO node_iucn VALUES (?, ?)', {('two', 'endangered')})
+			newData, _ = getResponseData(dbFile, query, None)
+			self.assertNotEqual(newData, data)
+			self.assertIn(b'endangered', newData)
+
+class TestSingleFlight(unittest.TestCase):
+	def test_do(self):
+		flights: SingleFlight[int] = SingleFlight()
+		started = threading.Event()
+		release = threading.Event()
+		numCalls = 0
+		def compute() -> int:
+			nonlocal numCalls
+			numCalls += 1
+			started.set()
+			release.wait()
+			return 7
+		results: list[int] = []
+		leader = threading.Thread(target=lambda: results.append(flights.do(('a',), compute)))
+		leader.start()
+		started.wait()
+		followers = [threading.Thread(target=lambda: results.append(flights.do(('a',), compute))) for _ in range(3)]
+		for thread in followers:
+			thread.start()
+		while flights.numCoalesced < 3:
+			time.sleep(0.001)
+		release.set()
+		for thread in [leader, *followers]:
+			thread.join()
+		self.assertEqual(results, [7, 7, 7, 7])
+		self.assertEqual(numCalls, 1)
+		self.assertEqual(flights.calls, {})
+		# Check that later calls, and errors, aren't shared
+		self.assertEqual(flights.do(('a',), lambda: 8), 8)
+		with self.assertRaises(ValueError):
+			flights.do(('b',), lambda: int('x'))
+		self.assertEqual(flights.calls, {})
+
+	def test_response_data(self):
+		with tempfile.TemporaryDirectory() as tempDir:
+			dbFile = os.path.join(tempDir, 'data.db')
+			initTestDb(dbFile)
+			handleQuery = tilo.handleQuery
+			def slowHandleQuery(*args):
+				time.sleep(0.1)
+				return handleQuery(*args)
+			flights: SingleFlight = SingleFlight()
+			with unittest.mock.patch.object(tilo, 'handleQuery', side_effect=slowHandleQuery) as mock, \
+					unittest.mock.patch.object(tilo, 'responseFlights', flights):
+				query = parseQuery('name=three&type=node&tree=trimmed&toroot=1')
+				results: list[tuple[bytes, str | None]] = []
+				threads = [threading.Thread(target=lambda: results.append(getResponseData(dbFile, query, 'gzip')))
+					for _ in range(4)]
+				for thread in threads:
+					thread.start()
+				for thread in threads:
+					thread.join()
+				self.assertEqual(mock.call_count, 1)
+				self.assertEqual(flights.numCoalesced, 3)
+				self.assertEqual(len(set(results)), 1)
+
+class TestCompression(unittest.TestCase):
+	def test_negotiate_encoding(self):
+		with unittest.mock.patch.object(tilo, 'brotli', None), unittest.mock.patch.object(tilo, 'zstandard', None):
+			self.assertEqual(negotiateEncoding('gzip, deflate, br'), 'gzip')
+			self.assertIsNone(negotiateEncoding('br, identity'))
+		fakeBrotli = unittest.mock.Mock()
+		with unittest.mock.patch.object(tilo, 'brotli', fakeBrotli), unittest.mock.patch.object(tilo, 'zstandard', None):
+			self.assertEqual(negotiateEncoding('gzip, deflate, br'), 'br')
+			self.assertEqual(negotiateEncoding('gzip;q=1.0, br;q=0.5'), 'gzip')
+			self.assertEqual(negotiateEncoding('br;q=0, *'), 'gzip')
+			self.assertEqual(negotiateEncoding('*;q=0.1'), 'br')
+			self.assertIsNone(negotiateEncoding('gzip;q=0, br;q=0'))
+			self.assertIsNone(negotiateEncoding(''))
+
+	def test_compression_cache(self):
+		cache = CompressionCache(10)
+		cache.put((b'a', 'gzip'), 5, b'aaaa')
+		self.assertEqual(cache.get((b'a', 'gzip'), 5), b'aaaa')
+		self.assertEqual(cache.get((b'a', 'gzip'), 1), b'aaaa')
+		self.assertIsNone(cache.get((b'a', 'gzip'), 9))
+		self.assertIsNone(cache.get((b'a', 'br'), 1))
+		cache.put((b'a', 'gzip'), 9, b'aaa')
+		cache.put((b'b', 'gzip'), 5, b'bbbb')
+		cache.put((b'c', 'gzip'), 5, b'cccc')
+		self.assertIsNone(cache.get((b'a', 'gzip'), 1))
+		self.assertEqual(cache.numBytes, 8)
+		cache.put((b'd', 'gzip'), 5, b'd' * 11)
+		self.assertEqual(cache.numBytes, 8)
+
+	def test_compress_response(self):
+		data = b'{"a": "' + b'x' * 1000 + b'"}'
+		with unittest.mock.patch.object(tilo, 'compressionCache', CompressionCache(2**20)) as cache:
+			compressed = compressResponse(data, 'gzip', False)
+			self.assertEqual(gzip.decompress(compressed), data)
+			self.assertEqual(compressResponse(data, 'gzip', False), compressed)
+			self.assertEqual((cache.hits, cache.misses), (1, 1))
+			# Check recompression at a higher level for hot responses
+			self.assertEqual(gzip.decompress(compressResponse(data, 'gzip', True)), data)
+			self.assertEqual(cache.misses, 2)
+			compressResponse(data, 'gzip', False)
+			self.assertEqual(cache.hits, 2)
+
+class TestApplication(unittest.TestCase):
+	def test_conditional_req(self):
+		with tempfile.TemporaryDirectory() as tempDir:
+			dbFile = os.path.join(tempDir, 'data.db')
+			initTestDb(dbFile)
+			with unittest.mock.patch.object(tilo, 'DB_FILE', dbFile):
+				environ = {'QUERY_STRING': 'name=two&type=node&tree=trimmed', 'REQUEST_METHOD': 'GET'}
+				status, headers, data = runApplication(environ)
+				self.assertEqual(status, '200 OK')
+				self.assertEqual(headers['Cache-Control'], tilo.CACHE_CONTROL['node'])
+				etag = headers['ETag']
+				self.assertEqual(runApplication(environ)[1]['ETag'], etag)
+				self.assertNotEqual(runApplication(environ | {'HTTP_ACCEPT_ENCODING': 'gzip'})[1]['ETag'], etag)
+				otherEnviron = environ | {'QUERY_STRING': 'name=one&type=node&tree=trimmed'}
+				self.assertNotEqual(runApplication(otherEnviron)[1]['ETag'], etag)
+				# Check 304 responses, which shouldn't involve lookups
+				with unittest.mock.patch.object(tilo, 'getResponseData') as getResponseDataMock:
+					for conditionalHeaders in [
+							{'HTTP_IF_NONE_MATCH': etag},
+							{'HTTP_IF_NONE_MATCH': f'"abc", W/{etag}'},
+							{'HTTP_IF_MODIFIED_SINCE': headers['Last-Modified']}]:
+						status, notModifiedHeaders, notModifiedData = runApplication(environ | conditionalHeaders)
+						self.assertEqual(status, '304 Not Modified')
+						self.assertEqual(notModifiedData, b'')
+						self.assertEqual(notModifiedHeaders['ETag'], etag)
+						self.assertNotIn('Content-type', notModifiedHeaders)
+					getResponseDataMock.assert_not_called()
+				self.assertEqual(runApplication(environ | {'HTTP_IF_NONE_MATCH': '"abc"'})[2], data)
+				# Check HEAD requests
+				status, headHeaders, headData = runApplication(environ | {'REQUEST_METHOD': 'HEAD'})
+				self.assertEqual((status, headData), ('200 OK', b''))
+				self.assertEqual(headHeaders['Content-Length'], str(len(data)))
+				self.assertEqual(headHeaders['ETag'], etag)
+				oldDate = 'Mon, 01 Jan 2001 00:00:00 GMT'
+				self.assertEqual(runApplication(environ | {'HTTP_IF_MODIFIED_SINCE': oldDate})[2], data)
+				# Check invalidation upon db change
+				createTestDbTable(dbFile, None, 'INSERT INTO node_iucn VALUES (?, ?)', {('two', 'endangered')})
+				status, headers, _ = runApplication(environ | {'HTTP_IF_NONE_MATCH': etag})
+				self.assertEqual(status, '200 OK')
+				self.assertNotEqual(headers['ETag'], etag)
+				# Check that invalid and POST requests lack ETags
+				self.assertNotIn('ETag', runApplication(environ | {'QUERY_STRING': 'type=x'})[1])
+				body = b'["two"]'
+				postEnviron = {'QUERY_STRING': 'type=nodes&tree=trimmed', 'REQUEST_METHOD': 'POST',
+					'CONTENT_LENGTH': str(len(body)), 'wsgi.input': io.BytesIO(body)}
+				self.assertNotIn('ETag', runApplication(postEnviron)[1])
+
+	def test_response_headers_db(self):
+		with tempfile.TemporaryDirectory() as tempDir:
+			dbFile = os.path.join(tempDir, 'data.db')
+			initTestDb(dbFile)
+			environ = {'QUERY_STRING': 'name=two&type=node&tree=trimmed', 'REQUEST_METHOD': 'GET'}
+			with unittest.mock.patch.object(tilo, 'DB_FILE', dbFile):
+				etag = runApplication(environ)[1]['ETag']
+			# Check that headers use the given db, rather than DB_FILE
+			with unittest.mock.patch.object(tilo, 'DB_FILE', os.path.join(tempDir, 'missing.db')):
+				headers, notModified = tilo.getResponseHeaders(dbFile, environ, parseQuery(environ['QUERY_STRING']), None)
+			self.assertFalse(notModified)
+			self.assertEqual(dict(headers)['ETag'], etag)
+
+class TestAsgiApplication(unittest.TestCase):
+	def test_requests(self):
+		with tempfile.TemporaryDirectory() as tempDir:
+			dbFile = os.path.join(tempDir, 'data.db')
+			initTestDb(dbFile)
+			with unittest.mock.patch.object(tilo, 'DB_FILE', dbFile), \
+					unittest.mock.patch.object(tilo, 'asgiState', tilo.AsgiState(2)):
+				environ = {'QUERY_STRING': 'name=two&type=node&tree=trimmed', 'REQUEST_METHOD': 'GET'}
+				status, headers, data = runApplication(environ)
+				scope = {'type': 'http', 'method': 'GET', 'query_string': b'name=two&type=node&tree=trimmed', 'headers': []}
+				asgiStatus, asgiHeaders, asgiData = asyncio.run(runAsgiApplication(scope))
+				self.assertEqual((asgiStatus, asgiData), (200, data))
+				self.assertEqual(asgiHeaders['etag'], headers['ETag'])
+				self.assertEqual(asgiHeaders['content-length'], str(len(data)))
+				# Check conditional and POST requests
+				notModifiedScope = scope | {'headers': [(b'if-none-match', headers['ETag'].encode())]}
+				self.assertEqual(asyncio.run(runAsgiApplication(notModifiedScope))[0], 304)
+				postScope = {'type': 'http', 'method': 'POST', 'query_string': b'type=nodes&tree=trimmed', 'headers': []}
+				_, _, postData = asyncio.run(runAsgiApplication(postScope, [b'["tw', b'o"]']))
+				self.assertEqual(postData, runApplication({'QUERY_STRING': 'type=nodes&nodes=["two"]&tree=trimmed'})[2])
+				tilo.asgiState.shutdown()
+
+	def test_coalescing(self):
+		with tempfile.TemporaryDirectory() as tempDir:
+			dbFile = os.path.join(tempDir, 'data.db')
+			initTestDb(dbFile)
+			getResponseData = tilo.getResponseData
+			def slowGetResponseData(*args):
+				time.sleep(0.1)
+				return getResponseData(*args)
+			state = tilo.AsgiState(4)
+			with unittest.mock.patch.object(tilo, 'DB_FILE', dbFile), \
+					unittest.mock.patch.object(tilo, 'asgiState', state), \
+					unittest.mock.patch.object(tilo, 'getResponseData', side_effect=slowGetResponseData) as mock:
+				async def runRequests():
+					scope = {'type': 'http', 'method': 'GET', 'query_string': b'name=one&type=node&tree=trimmed', 'headers': []}
+					otherScope = scope | {'query_string': b'name=two&type=node&tree=trimmed'}
+					return await asyncio.gather(*[runAsgiApplication(scope) for _ in range(5)], runAsgiApplication(otherScope))
+				results = asyncio.run(runRequests())
+				self.assertEqual(mock.call_count, 2)
+				self.assertEqual(state.numCoalesced, 4)
+				self.assertEqual(len({data for _, _, data in results[:5]}), 1)
+				self.assertNotEqual(results[0][2], results[5][2])
+				self.assertEqual(state.inProgress, {})
+				state.shutdown()
+
+async def runAsgiApplication(scope: dict, bodyChunks: list[bytes] = []) -> tuple[int, dict[str, str], bytes]:
+	""" Runs the ASGI application, and returns the status, headers, and data """
+	messages = [{'type': 'http.request', 'body': chunk, 'more_body': i < len(bodyChunks) - 1}
+		for i, chunk in enumerate(bodyChunks)]
+	sent: list[dict] = []
+	async def receive():
+		return messages.pop(0) if messages else {'type': 'http.disconnect'}
+	async def send(message):
+		sent.append(message)
+	await tilo.asgiApplication(scope, receive, send)
+	headers = {name.decode(): value.decode() for name, value in sent[0]['headers']}
+	return sent[0]['status'], headers, sent[1]['body']
+
+def runApplication(environ: dict) -> tuple[str, dict[str, str], bytes]:
+	""" Runs the WSGI application, and returns the status, headers, and data """
+	result: list = []
+	def startResponse(status: str, headers: list[tuple[str, str]]) -> None:
+		result.extend([status, dict(headers)])
+	data = b''.join(tilo.application(environ, startResponse))
+	return result[0], result[1], data
@@ -1,5 +1,6 @@
 """
 WSGI script that serves tree-of-life data, in JSON form.
+Also provides an ASGI entry point, 'asgiApplication', which shares the same lookup code.
 
 Expected HTTP query parameters:
 - name: Provides a name, or partial name, of a tree-of-life node. If absent, the root node is used.
@@ -7,28 +8,97 @@ Expected HTTP query parameters:
     If 'node', reply with a name-to-TolNode map, describing the named node and it's children.
     If 'sugg', reply with a SearchSuggResponse, describing search suggestions for the possibly-partial name.
     If 'info', reply with an InfoResponse, describing the named node.
+    If 'atlas', reply with an AtlasResponse, describing image atlases for the named node's children.
+    If 'nodes', reply with a name-to-TolNode map, merging the responses for a list of 'node' requests.
+    The list is provided as JSON in a POST request body, or in a 'nodes' parameter. It holds
+    objects with a 'name' string, and optional 'toroot', 'excl', and 'depth' values (eg: [{"name": "x", "toroot": 1}]).
+    A name string may be used instead of an object.
 - toroot: Used with type=node, and causes inclusion of ancestors, and their children.
     A value of 1 indicates true, and other indicate false
 - excl: Used with toroot, and names a node whose ancestors need not be included.
+- depth: Used with type=node without toroot, and specifies how many levels of descendants to include.
+    The default is 1. Beyond the first level, the children of larger subtrees are included first,
+    while keeping the number of nodes within MAX_DEPTH_NODES.
+- tolnode: Used with type=info, and a value of 0 causes omission of the node's TolNode,
+    for when the client already has it.
 - limit: Used with type=sugg to specify the max number of suggestions.
+- paged: Used with type=sugg, and a value of 1 causes the response to include a 'cursor' value,
+    if there are more suggestions. Results are ordered differently than for non-paged requests.
+- cursor: Used with type=sugg, and provides a 'cursor' value from a paged response, to get the next page.
+- fuzzy: Used with type=sugg, and a value of 1 causes inclusion of names within a small edit distance,
+    when there are insufficient prefix and substring matches. Only used for trees in SUGG_INDEX_TREES.
 - tree: Specifies which tree should be used.
     May be 'trimmed', 'images', or 'picked', corresponding to the
     weakly-trimmed, images-only, and picked-nodes trees. The default
     is 'images'.
 """
 
-from typing import Iterable, cast
+from typing import Callable, Iterable, Iterator, Sequence, TypeVar, Generic, cast
 import sys
+import os
 import re
+import abc
 import urllib.parse
 import sqlite3
 import gzip
-import jsonpickle
+import threading
+import queue
+import contextlib
+import atexit
+import array
+import mmap
+import struct
+import json
+import base64
+import hashlib
+import email.utils
+import collections
+import bisect
+import asyncio
+import concurrent.futures
+try:
+	import orjson # Optional, for faster encoding of responses
+except ImportError:
+	orjson = None
+try:
+	import brotli # Optional, for 'br' response compression
+except ImportError:
+	brotli = None
+try:
+	import zstandard # Optional, for 'zstd' response compression
+except ImportError:
+	zstandard = None
 
 DB_FILE = 'tol_data/data.db'
+DB_POOL_SIZE = 8 # Max number of db connections kept per process (a typical value is the mod_wsgi thread count)
+SNAPSHOT_TREES: set[str] = set() # Trees to hold in memory for 'node' requests (eg: {'images', 'picked'})
+SUGG_INDEX_TREES: set[str] = set() # Trees to index in memory for 'sugg' requests (eg: {'images'})
+RESPONSE_CACHE_ENTRIES = 1000 # Max number of encoded responses to cache per process (0 disables caching)
+RESPONSE_CACHE_BYTES = 50 * 2**20 # Max total size of cached responses
+COMPRESSION_CACHE_BYTES = 20 * 2**20 # Max total size of cached compressed responses
+MIN_COMPRESS_SIZE = 100 # Responses smaller than this are sent uncompressed
+COMPRESSION_LEVELS = { # Maps content-codings to levels used for new responses, and for responses served from cache
+	'br': (4, 9),
+	'zstd': (3, 12),
+	'gzip': (5, 9),
+}
+CACHE_CONTROL = { # Maps request types to Cache-Control header values (responses only change when the db does)
+	'node': 'public, max-age=86400',
+	'nodes': 'public, max-age=86400',
+	'sugg': 'public, max-age=3600',
+	'info': 'public, max-age=86400',
+	'atlas': 'public, max-age=86400',
+}
 DEFAULT_SUGG_LIM = 5
 MAX_SUGG_LIM = 50
+MAX_BATCH_NODES = 100 # Max number of node requests in a 'nodes' request
+MAX_NODE_DEPTH = 5 # Max 'depth' value for 'node' requests
+MAX_DEPTH_NODES = 1000 # Max number of nodes in a response to a 'node' request with a depth above 1
 ROOT_NAME = 'cellular organisms'
+ASGI_THREADS = DB_POOL_SIZE # Number of threads used for lookups when running as an ASGI app
+
+ImgName = None | str | tuple[str, str] | tuple[None, str] | tuple[str, None] # An image name, or pair for compound nodes
+AtlasPos = list[int] | list[list[int] | None] # An atlas cell's column and row, or a pair like with ImgName
 
 # ========== Classes for values sent as responses ==========
 
@@ -42,8 +112,9 @@ class TolNode:
 			tips=0,
 			pSupport=False,
 			commonName: str | None = None,
-			imgName: None | str | tuple[str, str] | tuple[None, str] | tuple[str, None] = None,
-			iucn: str | None = None):
+			imgName: ImgName = None,
+			iucn: str | None = None,
+			atlas: 'AtlasRef | None' = None):
 		self.otolId = otolId
 		self.children = children
 		self.parent = parent
@@ -52,17 +123,55 @@ class TolNode:
 		self.commonName = commonName
 		self.imgName = imgName
 		self.iucn = iucn
+		self.atlas = atlas
+
+	def toJsonObj(self) -> dict:
+		obj = {
+			'otolId': self.otolId,
+			'children': self.children,
+			'parent': self.parent,
+			'tips': self.tips,
+			'pSupport': self.pSupport,
+			'commonName': self.commonName,
+			'imgName': self.imgName,
+			'iucn': self.iucn,
+		}
+		if self.atlas is not None:
+			obj['atlas'] = self.atlas.toJsonObj()
+		return obj
 
 	def __eq__(self, other): # Used in unit testing
 		return isinstance(other, TolNode) and \
 			(self.otolId, set(self.children), self.parent, self.tips, \
-				self.pSupport, self.commonName, self.imgName, self.iucn) == \
+				self.pSupport, self.commonName, self.imgName, self.iucn, self.atlas) == \
 			(other.otolId, set(other.children), other.parent, other.tips, \
-				other.pSupport, other.commonName, other.imgName, other.iucn)
+				other.pSupport, other.commonName, other.imgName, other.iucn, other.atlas)
 
 	def __repr__(self):  # Used in unit testing
 		return str(self.__dict__)
 
+class AtlasRef:
+	""" Locates a node's image (or image pair) within an image atlas holding it's parent's children's images """
+	def __init__(self, file: str, cols: int, rows: int, pos: AtlasPos):
+		self.file = file
+		self.cols = cols
+		self.rows = rows
+		self.pos = pos
+
+	def toJsonObj(self) -> dict:
+		return {
+			'file': self.file,
+			'size': [self.cols, self.rows],
+			'pos': self.pos,
+		}
+
+	def __eq__(self, other): # Used in unit testing
+		return isinstance(other, AtlasRef) and \
+			(self.file, self.cols, self.rows, self.pos) == (other.file, other.cols, other.rows, other.pos)
+
+	def __repr__(self): # Used in unit testing
+		return str(self.__dict__)
+
 class SearchSugg:
 	""" Represents a search suggestion """
 	def __init__(self, name: str, canonicalName: str | None = None, pop=0):
@@ -70,6 +179,9 @@ class SearchSugg:
 		self.canonicalName = canonicalName
 		self.pop = pop if pop is not None else 0
 
+	def toJsonObj(self) -> dict:
+		return {'name': self.name, 'canonicalName': self.canonicalName, 'pop': self.pop}
+
 	def __eq__(self, other): # Used in unit testing
 		return isinstance(other, SearchSugg) and \
 			(self.name, self.canonicalName, self.pop) == (other.name, other.canonicalName, other.pop)
@@ -81,14 +193,21 @@ class SearchSugg:
 		return (self.name, self.canonicalName, self.pop).__hash__()
 
 class SearchSuggResponse:
-	""" Sent as responses to 'sugg' requests """
-	def __init__(self, searchSuggs: list[SearchSugg], hasMore: bool):
+	""" Sent as responses to 'sugg' requests. For paged requests, has a cursor for getting the next page. """
+	def __init__(self, searchSuggs: list[SearchSugg], hasMore: bool, cursor: str | None = None):
 		self.suggs = searchSuggs
 		self.hasMore = hasMore
+		self.cursor = cursor
+
+	def toJsonObj(self) -> dict:
+		obj = {'suggs': [sugg.toJsonObj() for sugg in self.suggs], 'hasMore': self.hasMore}
+		if self.cursor is not None:
+			obj['cursor'] = self.cursor
+		return obj
 
 	def __eq__(self, other): # Used in unit testing
 		return isinstance(other, SearchSuggResponse) and \
-			(set(self.suggs), self.hasMore) == (set(other.suggs), other.hasMore)
+			(set(self.suggs), self.hasMore, self.cursor) == (set(other.suggs), other.hasMore, other.cursor)
 
 	def __repr__(self): # Used in unit testing
 		return str(self.__dict__)
@@ -100,6 +219,9 @@ class DescInfo:
 		self.wikiId = wikiId
 		self.fromDbp = fromDbp
 
+	def toJsonObj(self) -> dict:
+		return {'text': self.text, 'wikiId': self.wikiId, 'fromDbp': self.fromDbp}
+
 	def __eq__(self, other): # Used in unit testing
 		return isinstance(other, DescInfo) and \
 			(self.text, self.wikiId, self.fromDbp) == (other.text, other.wikiId, other.fromDbp)
@@ -117,6 +239,16 @@ class ImgInfo:
 		self.artist = artist
 		self.credit = credit
 
+	def toJsonObj(self) -> dict:
+		return {
+			'id': self.id,
+			'src': self.src,
+			'url': self.url,
+			'license': self.license,
+			'artist': self.artist,
+			'credit': self.credit,
+		}
+
 	def __eq__(self, other): # Used in unit testing
 		return isinstance(other, ImgInfo) and \
 			(self.id, self.src, self.url, self.license, self.artist, self.credit) == \
@@ -126,12 +258,19 @@ class ImgInfo:
 		return str(self.__dict__)
 
 class NodeInfo:
-	""" Represents info about a node """
-	def __init__(self, tolNode: TolNode, descInfo: DescInfo | None, imgInfo: ImgInfo | None):
+	""" Represents info about a node (the TolNode is omitted if the client indicated it has it) """
+	def __init__(self, tolNode: TolNode | None, descInfo: DescInfo | None, imgInfo: ImgInfo | None):
 		self.tolNode = tolNode
 		self.descInfo = descInfo
 		self.imgInfo = imgInfo
 
+	def toJsonObj(self) -> dict:
+		return {
+			'tolNode': self.tolNode.toJsonObj() if self.tolNode is not None else None,
+			'descInfo': self.descInfo.toJsonObj() if self.descInfo is not None else None,
+			'imgInfo': self.imgInfo.toJsonObj() if self.imgInfo is not None else None,
+		}
+
 	def __eq__(self, other): # Used in unit testing
 		return isinstance(other, NodeInfo) and \
 			(self.tolNode, self.descInfo, self.imgInfo) == (other.tolNode, other.descInfo, other.imgInfo)
@@ -145,6 +284,12 @@ class InfoResponse:
 		self.nodeInfo = nodeInfo
 		self.subNodesInfo = subNodesInfo
 
+	def toJsonObj(self) -> dict:
+		return {
+			'nodeInfo': self.nodeInfo.toJsonObj(),
+			'subNodesInfo': [info.toJsonObj() if info is not None else None for info in self.subNodesInfo],
+		}
+
 	def __eq__(self, other): # Used in unit testing
 		return isinstance(other, InfoResponse) and \
 			(self.nodeInfo, self.subNodesInfo) == (other.nodeInfo, other.subNodesInfo)
@@ -152,6 +297,182 @@ class InfoResponse:
 	def __repr__(self): # Used in unit testing
 		return str(self.__dict__)
 
+class AtlasInfo:
+	""" Describes an image atlas, which holds square images in a grid of cells """
+	def __init__(self, file: str, cols: int, rows: int, cellSize: int, offsets: dict[str, list[int]]):
+		self.file = file
+		self.cols = cols
+		self.rows = rows
+		self.cellSize = cellSize # Cell width and height, in pixels
+		self.offsets = offsets # Maps image names to cell columns and rows
+
+	def toJsonObj(self) -> dict:
+		return {
+			'file': self.file,
+			'size': [self.cols, self.rows],
+			'cellSize': self.cellSize,
+			'offsets': self.offsets,
+		}
+
+	def __eq__(self, other): # Used in unit testing
+		return isinstance(other, AtlasInfo) and \
+			(self.file, self.cols, self.rows, self.cellSize, self.offsets) == \
+			(other.file, other.cols, other.rows, other.cellSize, other.offsets)
+
+	def __repr__(self): # Used in unit testing
+		return str(self.__dict__)
+
+class AtlasResponse:
+	""" Sent as responses to 'atlas' requests """
+	def __init__(self, atlases: list[AtlasInfo]):
+		self.atlases = atlases
+
+	def toJsonObj(self) -> dict:
+		return {'atlases': [atlas.toJsonObj() for atlas in self.atlases]}
+
+	def __eq__(self, other): # Used in unit testing
+		return isinstance(other, AtlasResponse) and self.atlases == other.atlases
+
+	def __repr__(self): # Used in unit testing
+		return str(self.__dict__)
+
+# ========== For database access ==========
+
+class DbConnection(sqlite3.Connection):
+	""" A db connection that can cache the db's table and column names (the db is assumed to be unchanging) """
+	tableNames: set[str] | None = None
+	columnNames: dict[str, set[str]] | None = None
+
+def hasTable(dbCur: sqlite3.Cursor, tableName: str) -> bool:
+	""" Returns True if the db has a table with the given name (used to make use of optional tables) """
+	dbCon = dbCur.connection
+	tableNames = getattr(dbCon, 'tableNames', None)
+	if tableNames is None:
+		tableNames = {n for (n,) in dbCon.execute('SELECT name FROM sqlite_master WHERE type = "table"')}
+		if isinstance(dbCon, DbConnection):
+			dbCon.tableNames = tableNames
+	return tableName in tableNames
+
+def hasColumn(dbCur: sqlite3.Cursor, tableName: str, columnName: str) -> bool:
+	""" Returns True if a db table has a column with the given name (used to make use of optional columns) """
+	dbCon = dbCur.connection
+	columnNames = getattr(dbCon, 'columnNames', None)
+	if columnNames is None:
+		columnNames = {}
+		if isinstance(dbCon, DbConnection):
+			dbCon.columnNames = columnNames
+	if tableName not in columnNames:
+		columnNames[tableName] = {row[1] for row in dbCon.execute(f'PRAGMA table_info({tableName})')}
+	return columnName in columnNames[tableName]
+
+def getDbIdentity(dbFile: str) -> tuple[int, int]:
+	""" Returns values that identify a version of a db file, for detecting files generated from other versions.
+		Holds the file's size, and SQLite's file change counter, which each write transaction increments.
+		Unlike a modification time, these are unchanged when the file is copied. """
+	with open(dbFile, 'rb') as file:
+		header = file.read(28)
+	return os.path.getsize(dbFile), struct.unpack_from('>I', header, 24)[0]
+
+def getEdgesQuery(columns: str, edgesTable: str, nodesTable: str, dbCur: sqlite3.Cursor, condition='') -> str:
+	""" Returns a query that selects edge columns, with a parent's children ordered by tips, then name.
+		Uses the edges table's 'ord' column, or for dbs without it, joins the nodes table for tips. """
+	if hasColumn(dbCur, edgesTable, 'ord'):
+		return f'SELECT {columns} FROM {edgesTable}{condition} ORDER BY parent, ord'
+	return f'SELECT {columns} FROM {edgesTable} INNER JOIN {nodesTable} ON {edgesTable}.child = {nodesTable}.name' \
+		f'{condition} ORDER BY parent, {nodesTable}.tips DESC, child'
+
+class DbConnPool:
+	""" Holds reusable read-only connections to a database file, for sharing between worker threads """
+	def __init__(self, dbFile: str, size: int, fileId: tuple[int, int, int]):
+		self.dbFile = dbFile
+		self.size = size
+		self.fileId = fileId # Used to detect replacement of the database file
+		self.idleCons: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+		self.numCons = 0 # Number of open connections, including those in use
+		self.closed = False
+		self.lock = threading.Lock()
+		# Holds in-memory trees loaded from the db
+		self.snapshots: dict[str, TreeSnapshot] = {}
+		self.snapshotLocks: dict[str, threading.Lock] = {}
+		self.suggIndexes: dict[str, SuggIndex] = {}
+		self.suggIndexLocks: dict[str, threading.Lock] = {}
+
+	def acquire(self) -> sqlite3.Connection:
+		""" Returns an idle connection, opening a new one if under the size limit, or waiting otherwise """
+		while True:
+			try:
+				return self.idleCons.get_nowait()
+			except queue.Empty:
+				pass
+			with self.lock:
+				if self.numCons < self.size:
+					self.numCons += 1
+					break
+			try: # Periodically re-check, as connections released after close() don't get queued
+				return self.idleCons.get(timeout=0.1)
+			except queue.Empty:
+				pass
+		try:
+			# The 'immutable' flag avoids file locking and change detection, as the db is never written to
+			uri = 'file:' + urllib.parse.quote(os.path.abspath(self.dbFile)) + '?mode=ro&immutable=1'
+			return sqlite3.connect(uri, uri=True, check_same_thread=False, factory=DbConnection)
+		except sqlite3.Error:
+			with self.lock:
+				self.numCons -= 1
+			raise
+
+	def release(self, dbCon: sqlite3.Connection) -> None:
+		""" Returns a connection to the pool, or closes it if the pool has been closed """
+		with self.lock:
+			if self.closed:
+				self.numCons -= 1
+				dbCon.close()
+				return
+		self.idleCons.put(dbCon)
+
+	@contextlib.contextmanager
+	def connection(self) -> Iterator[sqlite3.Connection]:
+		dbCon = self.acquire()
+		try:
+			yield dbCon
+		finally:
+			self.release(dbCon)
+
+	def close(self) -> None:
+		""" Closes idle connections, and causes in-use ones to be closed when released """
+		with self.lock:
+			self.closed = True
+			while True:
+				try:
+					dbCon = self.idleCons.get_nowait()
+				except queue.Empty:
+					break
+				self.numCons -= 1
+				dbCon.close()
+
+dbPools: dict[str, DbConnPool] = {} # Maps db filenames to pools
+dbPoolsLock = threading.Lock()
+
+def getDbPool(dbFile: str) -> DbConnPool:
+	""" Returns a connection pool for a db file, replacing the old pool if the file has changed """
+	stat = os.stat(dbFile)
+	fileId = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+	with dbPoolsLock:
+		pool = dbPools.get(dbFile)
+		if pool is None or pool.fileId != fileId:
+			if pool is not None:
+				pool.close()
+			pool = DbConnPool(dbFile, DB_POOL_SIZE, fileId)
+			dbPools[dbFile] = pool
+		return pool
+
+@atexit.register
+def closeDbPools() -> None:
+	with dbPoolsLock:
+		for pool in dbPools.values():
+			pool.close()
+		dbPools.clear()
+
 # ========== For data lookup ==========
 
 def lookupNodes(names: list[str], tree: str, dbCur: sqlite3.Cursor) -> dict[str, TolNode]:
@@ -161,23 +482,28 @@ def lookupNodes(names: list[str], tree: str, dbCur: sqlite3.Cursor) -> dict[str,
 	tblSuffix = getTableSuffix(tree)
 	nodesTable = f'nodes_{tblSuffix}'
 	edgesTable = f'edges_{tblSuffix}'
+	viewTable = f'node_view_{tblSuffix}'
 	queryParamStr = ','.join(['?'] * len(names))
+
+	# Use the denormalized node table if present
+	if hasTable(dbCur, viewTable):
+		query = f'SELECT name, id, tips, parent, p_support, children, img_name, img_name2, img_pair,' \
+			f' common_name, iucn FROM {viewTable} WHERE name IN ({queryParamStr})'
+		for nodeName, otolId, tips, parent, pSupport, children, imgName1, imgName2, imgPair, commonName, iucn \
+				in dbCur.execute(query, names):
+			imgName: ImgName = cast(ImgName, (imgName1, imgName2)) if imgPair == 1 else imgName1
+			nameToNodes[nodeName] = TolNode(
+				otolId, json.loads(children), parent, tips, pSupport == 1, commonName, imgName, iucn)
+		addAtlasRefs(nameToNodes, tree, dbCur)
+		return nameToNodes
 	query = f'SELECT name, id, tips FROM {nodesTable} WHERE name IN ({queryParamStr})'
 	for nodeName, otolId, tips in dbCur.execute(query, names):
 		nameToNodes[nodeName] = TolNode(otolId, [], tips=tips)
 
 	# Get child info
-	query = f'SELECT parent, child FROM {edgesTable} WHERE parent IN ({queryParamStr})'
+	query = getEdgesQuery('parent, child', edgesTable, nodesTable, dbCur, f' WHERE parent IN ({queryParamStr})')
 	for nodeName, childName in dbCur.execute(query, names):
 		nameToNodes[nodeName].children.append(childName)
-	# Order children by tips
-	for nodeName, node in nameToNodes.items():
-		childToTips: dict[str, int] = {}
-		query = 'SELECT name, tips FROM {} WHERE name IN ({})'
-		query = query.format(nodesTable, ','.join(['?'] * len(node.children)))
-		for n, tips in dbCur.execute(query, node.children):
-			childToTips[n] = tips
-		node.children.sort(key=lambda n: childToTips[n], reverse=True)
 
 	# Get parent info
 	query = f'SELECT parent, child, p_support FROM {edgesTable} WHERE child IN ({queryParamStr})'
@@ -198,14 +524,7 @@ def lookupNodes(names: list[str], tree: str, dbCur: sqlite3.Cursor) -> dict[str,
 	query = 'SELECT name, otol_ids from linked_imgs WHERE name IN ({})'
 	query = query.format(','.join(['?'] * len(unresolvedNames)))
 	for name, otolIds in dbCur.execute(query, unresolvedNames):
-		if ',' not in otolIds:
-			nameToNodes[name].imgName = otolIds + '.jpg'
-		else:
-			id1, id2 = otolIds.split(',')
-			nameToNodes[name].imgName = (
-				id1 + '.jpg' if id1 != '' else None,
-				id2 + '.jpg' if id2 != '' else None,
-			)
+		nameToNodes[name].imgName = getLinkedImgName(otolIds)
 
 	# Get preferred-name info
 	query = f'SELECT name, alt_name FROM names WHERE pref_alt = 1 AND name IN ({queryParamStr})'
@@ -219,34 +538,235 @@ def lookupNodes(names: list[str], tree: str, dbCur: sqlite3.Cursor) -> dict[str,
 		if name in nameToNodes:
 			nameToNodes[name].iucn = iucn
 
+	addAtlasRefs(nameToNodes, tree, dbCur)
+	return nameToNodes
+
+def addAtlasRefs(nameToNodes: dict[str, TolNode], tree: str, dbCur: sqlite3.Cursor) -> None:
+	""" Adds atlas references to TolNodes, if atlas tables are present """
+	if nameToNodes:
+		for name, atlasRef in lookupAtlasRefs(list(nameToNodes.keys()), tree, dbCur).items():
+			nameToNodes[name].atlas = atlasRef
+
+def lookupAtlasRefs(names: list[str] | None, tree: str, dbCur: sqlite3.Cursor) -> dict[str, AtlasRef]:
+	""" Returns a name-to-AtlasRef map for nodes with the given names (or all nodes, if None) that are in atlases """
+	tblSuffix = getTableSuffix(tree)
+	atlasesTable = f'atlases_{tblSuffix}'
+	atlasNodesTable = f'atlas_nodes_{tblSuffix}'
+	if not hasTable(dbCur, atlasNodesTable):
+		return {}
+	query = f'SELECT name, file, cols, rows, pos FROM {atlasNodesTable} INNER JOIN {atlasesTable}' \
+		f' ON {atlasNodesTable}.parent = {atlasesTable}.parent AND {atlasNodesTable}.page = {atlasesTable}.page'
+	if names is not None:
+		query += f' WHERE name IN ({",".join(["?"] * len(names))})'
+	return {name: AtlasRef(file, cols, rows, json.loads(pos))
+		for name, file, cols, rows, pos in dbCur.execute(query, names or [])}
+
+def lookupAtlases(name: str, tree: str, dbCur: sqlite3.Cursor) -> AtlasResponse | None:
+	""" For a node name, returns an AtlasResponse describing atlases of it's children's images, or None """
+	atlasesTable = f'atlases_{getTableSuffix(tree)}'
+	if not hasTable(dbCur, atlasesTable):
+		return None
+	query = f'SELECT file, cols, rows, cell_size, offsets FROM {atlasesTable} WHERE parent = ? ORDER BY page'
+	atlases = [AtlasInfo(file, cols, rows, cellSize, json.loads(offsets))
+		for file, cols, rows, cellSize, offsets in dbCur.execute(query, (name,))]
+	return AtlasResponse(atlases) if atlases else None
+
+def lookupNodeAndChildren(name: str, tree: str, dbCur: sqlite3.Cursor) -> dict[str, TolNode] | None:
+	""" For a node name, returns a name-to-TolNode map describing the node and it's children, or None """
+	tolNodes = lookupNodes([name], tree, dbCur)
+	if not tolNodes:
+		return None
+	tolNode = tolNodes[name]
+	childNodeObjs = lookupNodes(tolNode.children, tree, dbCur)
+	childNodeObjs[name] = tolNode
+	return childNodeObjs
+
+def lookupSubtree(name: str, depth: int, tree: str, dbCur: sqlite3.Cursor) -> dict[str, TolNode] | None:
+	""" For a node name, returns a name-to-TolNode map describing the node and 'depth' levels
+		of descendants (as limited by getSubtree()), or None """
+	return getSubtree(name, depth, lambda names: lookupNodes(names, tree, dbCur))
+
+def getSubtree(
+		name: str, depth: int, lookupFn: Callable[[list[str]], dict[str, TolNode]]) -> dict[str, TolNode] | None:
+	""" Returns a name-to-TolNode map describing a node and 'depth' levels of descendants,
+		using a function like lookupNodes() to get a level's nodes at a time.
+		All children of the node are included. For lower levels, nodes are included in sets of
+		siblings, taking larger subtrees first, while keeping within MAX_DEPTH_NODES nodes. """
+	results = lookupFn([name])
+	if not results:
+		return None
+	level = [name]
+	numLeft = MAX_DEPTH_NODES - 1
+	for levelNum in range(depth):
+		childNames: list[str] = []
+		for parentName in sorted(level, key=lambda n: results[n].tips, reverse=True):
+			children = results[parentName].children
+			if levelNum == 0 or len(children) <= numLeft:
+				childNames.extend(children)
+				numLeft -= len(children)
+		if not childNames:
+			break
+		childNodes = lookupFn(childNames)
+		level = [n for n in childNames if n in childNodes]
+		results.update((n, childNodes[n]) for n in level)
+	return results
+
+def lookupAncestry(name: str, exclName: str | None, tree: str, dbCur: sqlite3.Cursor) -> dict[str, TolNode]:
+	""" For a node name, returns a name-to-TolNode map describing the node, it's ancestors,
+		and their children. If 'exclName' is given, ancestors of that node are omitted. """
+	tblSuffix = getTableSuffix(tree)
+	edgesTable = f'edges_{tblSuffix}'
+	rangesTable = f'node_ranges_{tblSuffix}'
+	chainQuery = f'WITH RECURSIVE chain (name, depth) AS (' \
+		'VALUES (?, 0)' \
+		f' UNION ALL SELECT parent, depth + 1 FROM {edgesTable} INNER JOIN chain ON child = chain.name' \
+		')'
+	chain: list[str] = []
+	if hasTable(dbCur, rangesTable):
+		# Get ancestor chain, using preorder-index ranges to check for ancestors of the excluded node
+		exclIdx: int | None = None
+		if exclName is not None:
+			row = dbCur.execute(f'SELECT pre_idx FROM {rangesTable} WHERE name = ?', (exclName,)).fetchone()
+			exclIdx = row[0] if row is not None else None
+		query = chainQuery + f' SELECT chain.name, pre_idx, end_idx FROM chain' \
+			f' LEFT JOIN {rangesTable} ON chain.name = {rangesTable}.name ORDER BY chain.depth'
+		for nodeName, preIdx, endIdx in dbCur.execute(query, (name,)):
+			if chain and exclIdx is not None and preIdx is not None and preIdx < exclIdx <= endIdx:
+				break
+			chain.append(nodeName)
+	else:
+		# Get ancestors to skip inclusion of
+		nodesToSkip: set[str] = set()
+		if exclName is not None:
+			query = f'WITH RECURSIVE ancestors (name) AS (' \
+				f'SELECT parent FROM {edgesTable} WHERE child = ?' \
+				f' UNION ALL SELECT parent FROM {edgesTable} INNER JOIN ancestors ON child = ancestors.name' \
+				') SELECT name FROM ancestors'
+			for (nodeName,) in dbCur.execute(query, (exclName,)):
+				nodesToSkip.add(nodeName)
+		# Get ancestor chain
+		for (nodeName,) in dbCur.execute(chainQuery + ' SELECT name FROM chain ORDER BY depth', (name,)):
+			if chain and nodeName in nodesToSkip:
+				break
+			chain.append(nodeName)
+
+	# Get nodes, and the children of ancestors
+	chainNodes = lookupNodes(chain, tree, dbCur)
+	childNames = [n for ancestor in chain[1:] if ancestor in chainNodes
+		for n in chainNodes[ancestor].children if n not in chainNodes]
+	childNodes = lookupNodes(childNames, tree, dbCur)
+
+	# Construct response
+	results: dict[str, TolNode] = {}
+	for i, nodeName in enumerate(chain):
+		if nodeName not in chainNodes:
+			if i > 0:
+				print(f'ERROR: Parent-chain node {nodeName} not found', file=sys.stderr)
+			break
+		results[nodeName] = chainNodes[nodeName]
+		if i > 0:
+			for childName in chainNodes[nodeName].children:
+				if childName not in results and childName in childNodes:
+					results[childName] = childNodes[childName]
+	return results
+
+NodeReq = tuple[str, bool, str | None, int] # Holds a node name, and 'toroot', 'excl', and 'depth' values
+
+def lookupNodeBatch(nodeReqs: Sequence[NodeReq], tree: str, dbCur: sqlite3.Cursor) -> dict[str, TolNode]:
+	""" For a set of 'node' requests, returns a name-to-TolNode map holding the nodes that would be in the
+		responses for each (as from lookupNodeAndChildren() or lookupAncestry()). Ancestor chains are
+		obtained with one query, and node data with two lookupNodes() calls. """
+	edgesTable = f'edges_{getTableSuffix(tree)}'
+	# Get parents of requested nodes, excluded nodes, and their ancestors
+	childToParent: dict[str, str] = {}
+	seedNames = list({n for name, toroot, exclName, _ in nodeReqs if toroot for n in (name, exclName) if n is not None})
+	if seedNames:
+		query = f'WITH RECURSIVE chain (name, parent) AS (' \
+			f'SELECT child, parent FROM {edgesTable} WHERE child IN ({",".join(["?"] * len(seedNames))})' \
+			f' UNION SELECT child, {edgesTable}.parent FROM {edgesTable} INNER JOIN chain ON child = chain.parent' \
+			') SELECT name, parent FROM chain'
+		for nodeName, parent in dbCur.execute(query, seedNames):
+			childToParent[nodeName] = parent
+	# Get ancestor chains, omitting ancestors of excluded nodes
+	names: dict[str, None] = {} # Holds names of nodes whose data is needed, in order of inclusion
+	expandedNames: dict[str, None] = {} # Holds names of nodes whose children are needed
+	for name, toroot, exclName, depth in nodeReqs:
+		names[name] = None
+		if depth > 1: # Handled below
+			continue
+		if not toroot:
+			expandedNames[name] = None
+			continue
+		nodesToSkip: set[str] = set()
+		ancestor = childToParent.get(exclName) if exclName is not None else None
+		while ancestor is not None:
+			nodesToSkip.add(ancestor)
+			ancestor = childToParent.get(ancestor)
+		ancestor = childToParent.get(name)
+		while ancestor is not None and ancestor not in nodesToSkip:
+			names[ancestor] = None
+			expandedNames[ancestor] = None
+			ancestor = childToParent.get(ancestor)
+
+	# Get nodes, and the children of expanded nodes
+	nameToNodes = lookupNodes(list(names), tree, dbCur)
+	childNames = [n for name in expandedNames if name in nameToNodes
+		for n in nameToNodes[name].children if n not in nameToNodes]
+	nameToNodes.update(lookupNodes(childNames, tree, dbCur))
+	# Get subtrees
+	for name, _, _, depth in nodeReqs:
+		if depth > 1 and name in nameToNodes:
+			nameToNodes.update(lookupSubtree(name, depth, tree, dbCur) or {})
 	return nameToNodes
 
 def lookupSuggs(searchStr: str, suggLimit: int, tree: str, dbCur: sqlite3.Cursor) -> SearchSuggResponse:
 	""" For a search string, returns a SearchSuggResponse describing search suggestions """
 	hasMore = False
 
-	# Get node names and alt-names, ordering by popularity
-	nodesTable = f'nodes_{getTableSuffix(tree)}'
-	nameQuery = f'SELECT {nodesTable}.name, node_pop.pop FROM {nodesTable}' \
-		f' LEFT JOIN node_pop ON {nodesTable}.name = node_pop.name' \
-		f' WHERE {nodesTable}.name LIKE ? AND {nodesTable}.name NOT LIKE "[%"' \
-		f' ORDER BY node_pop.pop DESC'
-	altNameQuery = f'SELECT alt_name, names.name, pref_alt, node_pop.pop FROM' \
-		f' names INNER JOIN {nodesTable} ON names.name = {nodesTable}.name' \
-		f' LEFT JOIN node_pop ON {nodesTable}.name = node_pop.name' \
-		f' WHERE alt_name LIKE ? ORDER BY node_pop.pop DESC'
+	# Get queries for node names and alt-names, ordering by popularity
+	tblSuffix = getTableSuffix(tree)
+	searchTable = f'search_{tblSuffix}'
+	if hasTable(dbCur, searchTable):
+		# Use search tables, with an index for prefix search, and a trigram index for substring search
+		lowerStr = searchStr.lower()
+		rangeArgs = (lowerStr, getPrefixEnd(lowerStr) if lowerStr != '' else chr(0x10ffff))
+		prefixCond = f'{searchTable}.search_name >= ? AND {searchTable}.search_name < ?'
+		substrFrom = f'{searchTable}_fts INNER JOIN {searchTable} ON {searchTable}_fts.rowid = {searchTable}.id' \
+			f' WHERE {searchTable}_fts.search_name LIKE ?'
+		substrArgs = ('%' + lowerStr + '%',)
+		altNamePrefixQuery = (f'SELECT alt_name, name, pref_alt, pop FROM {searchTable}' \
+			f' WHERE {prefixCond} AND alt_name IS NOT NULL ORDER BY pop DESC', rangeArgs)
+		namePrefixQuery = (f'SELECT name, pop FROM {searchTable}' \
+			f' WHERE {prefixCond} AND alt_name IS NULL ORDER BY pop DESC', rangeArgs)
+		altNameSubstrQuery = (f'SELECT alt_name, name, pref_alt, pop FROM {substrFrom}' \
+			' AND alt_name IS NOT NULL ORDER BY pop DESC', substrArgs)
+		nameSubstrQuery = (f'SELECT name, pop FROM {substrFrom} AND alt_name IS NULL ORDER BY pop DESC', substrArgs)
+	else:
+		nodesTable = f'nodes_{tblSuffix}'
+		nameQuery = f'SELECT {nodesTable}.name, node_pop.pop FROM {nodesTable}' \
+			f' LEFT JOIN node_pop ON {nodesTable}.name = node_pop.name' \
+			f' WHERE {nodesTable}.name LIKE ? AND {nodesTable}.name NOT LIKE "[%"' \
+			f' ORDER BY node_pop.pop DESC'
+		altNameQuery = f'SELECT alt_name, names.name, pref_alt, node_pop.pop FROM' \
+			f' names INNER JOIN {nodesTable} ON names.name = {nodesTable}.name' \
+			f' LEFT JOIN node_pop ON {nodesTable}.name = node_pop.name' \
+			f' WHERE alt_name LIKE ? ORDER BY node_pop.pop DESC'
+		altNamePrefixQuery = (altNameQuery, (searchStr + '%',))
+		namePrefixQuery = (nameQuery, (searchStr + '%',))
+		altNameSubstrQuery = (altNameQuery, ('%' + searchStr + '%',))
+		nameSubstrQuery = (nameQuery, ('%' + searchStr + '%',))
 	suggs: dict[str, SearchSugg] = {}
 	tempLimit = suggLimit + 1 # For determining if 'more suggestions exist'
 
 	# Prefix search
-	for altName, nodeName, prefAlt, pop in dbCur.execute(altNameQuery, (searchStr + '%',)):
+	for altName, nodeName, prefAlt, pop in dbCur.execute(*altNamePrefixQuery):
 		if nodeName not in suggs or prefAlt == 1 and suggs[nodeName].canonicalName is not None:
 			suggs[nodeName] = SearchSugg(altName, nodeName, pop)
 			if len(suggs) == tempLimit:
 				break
 	if len(suggs) < tempLimit:
 		# Prefix search of canonical names
-		for nodeName, pop in dbCur.execute(nameQuery, (searchStr + '%',)):
+		for nodeName, pop in dbCur.execute(*namePrefixQuery):
 			if nodeName not in suggs:
 				suggs[nodeName] = SearchSugg(nodeName, pop=pop)
 				if len(suggs) == tempLimit:
@@ -257,7 +777,7 @@ def lookupSuggs(searchStr: str, suggLimit: int, tree: str, dbCur: sqlite3.Cursor
 	if len(suggs) < tempLimit:
 		newNames: set[str] = set()
 		oldNames = suggs.keys()
-		for altName, nodeName, prefAlt, pop in dbCur.execute(altNameQuery, ('%' + searchStr + '%',)):
+		for altName, nodeName, prefAlt, pop in dbCur.execute(*altNameSubstrQuery):
 			if nodeName not in suggs or \
 				nodeName not in oldNames and prefAlt == 1 and suggs[nodeName].canonicalName is not None:
 				suggs[nodeName] = SearchSugg(altName, nodeName, pop)
@@ -265,7 +785,7 @@ def lookupSuggs(searchStr: str, suggLimit: int, tree: str, dbCur: sqlite3.Cursor
 				if len(suggs) == tempLimit:
 					break
 		if len(suggs) < tempLimit:
-			for nodeName, pop in dbCur.execute(nameQuery, ('%' + searchStr + '%',)):
+			for nodeName, pop in dbCur.execute(*nameSubstrQuery):
 				if nodeName not in suggs:
 					suggs[nodeName] = SearchSugg(nodeName, pop=pop)
 					newNames.add(nodeName)
@@ -277,72 +797,989 @@ def lookupSuggs(searchStr: str, suggLimit: int, tree: str, dbCur: sqlite3.Cursor
 		hasMore = True
 	return SearchSuggResponse(suggList[:suggLimit], hasMore)
 
-def lookupInfo(name: str, tree: str, dbCur: sqlite3.Cursor) -> InfoResponse | None:
-	""" For a node name, returns a descriptive InfoResponse, or None """
-	nodesTable = f'nodes_{getTableSuffix(tree)}'
+SuggCursor = tuple[int, int, str] # Holds a suggestion phase, and the popularity and node name of a page's last suggestion
 
-	# Get node info
-	nameToNodes = lookupNodes([name], tree, dbCur)
-	tolNode = nameToNodes[name] if name in nameToNodes else None
-	if tolNode is None:
+def lookupSuggPage(
+		searchStr: str, suggLimit: int, cursor: SuggCursor | None, tree: str, dbCur: sqlite3.Cursor) -> SearchSuggResponse:
+	""" For a search string, returns a SearchSuggResponse with a page of search suggestions, starting
+		after the cursor's position, and with a cursor for the next page if there are more.
+		Suggestions come from 4 phases: alt-name prefix matches, name prefix matches, alt-name substring
+		matches, and name substring matches. Each node is suggested in the first phase it matches in,
+		and within a phase, suggestions are ordered by popularity and name, enabling keyset pagination. """
+	tblSuffix = getTableSuffix(tree)
+	searchTable = f'search_{tblSuffix}'
+	useSearchTable = hasTable(dbCur, searchTable)
+	phases: list[tuple[str, str, list[str]]] # Holds (query, node-name column, args) tuples
+	if useSearchTable:
+		# Use search tables, with an index for prefix search, a trigram index for substring search,
+		# and an index in (pop, name) order, for scanning from a cursor. As a node's rows share a
+		# pop value, the latter index also finds a node's other rows.
+		lowerStr = searchStr.lower()
+		prefixArgs = [lowerStr, getPrefixEnd(lowerStr) if lowerStr != '' else chr(0x10ffff)]
+		substrArgs = ['%' + lowerStr + '%']
+		popExpr = 'pop'
+		altNamePrefix = 'alt_name IS NOT NULL AND search_name >= ? AND search_name < ?'
+		namePrefix = 'alt_name IS NULL AND search_name >= ? AND search_name < ?'
+		altNameSubstr = 'alt_name IS NOT NULL AND search_name LIKE ?'
+		substrMatch = f'{searchTable}.id IN (SELECT rowid FROM {searchTable}_fts WHERE search_name LIKE ?)'
+		def nodeHasRow(cond: str) -> str:
+			""" Returns a condition that holds if a row's node has a row satisfying 'cond' (whose
+				unqualified columns refer to that row) """
+			return f'EXISTS (SELECT 1 FROM {searchTable} AS rows2' \
+				f' WHERE rows2.pop = {searchTable}.pop AND rows2.name = {searchTable}.name AND {cond})'
+		def bestAltName(cond: str) -> str:
+			""" Returns a condition that picks one matching alt-name per node, preferring preferred alt-names """
+			return ' AND NOT ' + nodeHasRow(f'{cond} AND (rows2.pref_alt > {searchTable}.pref_alt' \
+				f' OR rows2.pref_alt = {searchTable}.pref_alt AND rows2.id < {searchTable}.id)')
+		select = f'SELECT name, alt_name, pref_alt, pop FROM {searchTable} WHERE '
+		phases = [
+			(select + altNamePrefix + bestAltName(altNamePrefix), 'name', prefixArgs * 2),
+			(select + namePrefix + f' AND NOT {nodeHasRow(altNamePrefix)}', 'name', prefixArgs * 2),
+			(select + f'alt_name IS NOT NULL AND {substrMatch} AND NOT {nodeHasRow(altNamePrefix)}' \
+				f' AND NOT {nodeHasRow(namePrefix)}' + bestAltName(altNameSubstr), 'name',
+				substrArgs + prefixArgs * 2 + substrArgs),
+			(select + f'alt_name IS NULL AND {substrMatch} AND NOT (search_name >= ? AND search_name < ?)' \
+				f' AND NOT {nodeHasRow(altNameSubstr)}', 'name', substrArgs + prefixArgs + substrArgs),
+		]
+	else:
+		nodesTable = f'nodes_{tblSuffix}'
+		prefixArg, substrArg = searchStr + '%', '%' + searchStr + '%'
+		popExpr = 'COALESCE(node_pop.pop, 0)'
+		altNameQuery = f'SELECT names.name, alt_name, MAX(pref_alt), {popExpr} FROM' \
+			f' names INNER JOIN {nodesTable} ON names.name = {nodesTable}.name' \
+			f' LEFT JOIN node_pop ON names.name = node_pop.name WHERE alt_name LIKE ?'
+		nameQuery = f'SELECT {nodesTable}.name, NULL, NULL, {popExpr} FROM {nodesTable}' \
+			f' LEFT JOIN node_pop ON {nodesTable}.name = node_pop.name' \
+			f' WHERE {nodesTable}.name LIKE ? AND {nodesTable}.name NOT LIKE "[%"'
+		# Conditions for excluding nodes matched by earlier phases
+		def altNameExcl(nameCol: str) -> str:
+			return f' AND NOT EXISTS (SELECT 1 FROM names AS names2 WHERE names2.name = {nameCol} AND names2.alt_name LIKE ?)'
+		nameExcl = f' AND ({nodesTable}.name NOT LIKE ? OR {nodesTable}.name LIKE "[%")'
+		phases = [
+			(altNameQuery, 'names.name', [prefixArg]),
+			(nameQuery + altNameExcl(f'{nodesTable}.name'), f'{nodesTable}.name', [prefixArg, prefixArg]),
+			(altNameQuery + altNameExcl('names.name') + nameExcl, 'names.name', [substrArg, prefixArg, prefixArg]),
+			(nameQuery + altNameExcl(f'{nodesTable}.name') + nameExcl, f'{nodesTable}.name',
+				[substrArg, substrArg, prefixArg]),
+		]
+
+	suggs: list[tuple[int, SearchSugg]] = [] # Holds (phase, suggestion) pairs
+	tempLimit = suggLimit + 1 # For determining if 'more suggestions exist'
+	startPhase = cursor[0] if cursor is not None else 0
+	for phase in range(startPhase, len(phases)):
+		query, nameCol, args = phases[phase]
+		if cursor is not None and phase == startPhase:
+			# The first condition bounds an indexed scan in (pop, name) order
+			query += f' AND {popExpr} <= ? AND ({popExpr} < ? OR {nameCol} > ?)'
+			args = args + [cursor[1], cursor[1], cursor[2]]
+		if not useSearchTable and phase in (0, 2):
+			query += f' GROUP BY names.name' # Picks one alt-name per node, preferring preferred alt-names
+		query += f' ORDER BY {popExpr} DESC, {nameCol} LIMIT ?'
+		for nodeName, altName, _, pop in dbCur.execute(query, args + [tempLimit - len(suggs)]):
+			sugg = SearchSugg(altName, nodeName, pop) if altName is not None else SearchSugg(nodeName, pop=pop)
+			suggs.append((phase, sugg))
+		if len(suggs) == tempLimit:
+			break
+
+	if len(suggs) < tempLimit:
+		return SearchSuggResponse([sugg for _, sugg in suggs], False)
+	lastPhase, lastSugg = suggs[suggLimit - 1]
+	nextCursor: SuggCursor = (lastPhase, lastSugg.pop,
+		lastSugg.canonicalName if lastSugg.canonicalName is not None else lastSugg.name)
+	return SearchSuggResponse([sugg for _, sugg in suggs[:suggLimit]], True, encodeSuggCursor(nextCursor))
+
+def encodeSuggCursor(cursor: SuggCursor) -> str:
+	return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+def decodeSuggCursor(cursorStr: str) -> SuggCursor | None:
+	""" Converts a cursor string from a 'sugg' response back into a cursor, or returns None if invalid """
+	try:
+		cursor = json.loads(base64.urlsafe_b64decode(cursorStr.encode()))
+	except ValueError:
 		return None
+	if not isinstance(cursor, list) or len(cursor) != 3 or not isinstance(cursor[0], int) or \
+			not 0 <= cursor[0] < 4 or not isinstance(cursor[1], int) or not isinstance(cursor[2], str):
+		return None
+	return (cursor[0], cursor[1], cursor[2])
+
+def lookupInfo(name: str, tree: str, dbCur: sqlite3.Cursor, withTolNode=True) -> InfoResponse | None:
+	""" For a node name, returns a descriptive InfoResponse, or None.
+		If 'withTolNode' is False, the node's TolNode is omitted (sub-nodes' TolNodes are still included). """
+	nodesTable = f'nodes_{getTableSuffix(tree)}'
 
 	# Check for compound node
 	match = re.fullmatch(r'\[(.+) \+ (.+)]', name)
-	subNames = [match.group(1), match.group(2)] if match is not None else []
-	if subNames:
-		nameToSubNodes = lookupNodes(subNames, tree, dbCur)
-		if len(nameToSubNodes) < 2: # Possible when a subname-denoted node has been trimmed away
-			subNames = [n if n in nameToSubNodes else None for n in subNames]
-		nameToNodes.update(nameToSubNodes)
-	namesToLookup = [name] if not subNames else [n for n in subNames if n is not None]
-
-	# Get desc info
-	nameToDescInfo: dict[str, DescInfo] = {}
-	query = 'SELECT name, desc, wiki_id, from_dbp FROM' \
-		' wiki_ids INNER JOIN descs ON wiki_ids.id = descs.wiki_id' \
-		' WHERE wiki_ids.name IN ({})'.format(','.join(['?'] * len(namesToLookup)))
-	for nodeName, desc, wikiId, fromDbp in dbCur.execute(query, namesToLookup):
-		nameToDescInfo[nodeName] = DescInfo(desc, wikiId, fromDbp == 1)
+	subNames: list[str | None] = [match.group(1), match.group(2)] if match is not None else []
 
-	# Get image info
+	# Get desc and image info, along with which nodes exist (a linked image is used if a node has no image)
+	infoNames = [name] + cast(list[str], subNames)
+	nameToDescInfo: dict[str, DescInfo] = {}
 	nameToImgInfo: dict[str, ImgInfo] = {}
-	idsToNames = {cast(str, nameToNodes[n].imgName)[:-4]: n
-		for n in namesToLookup if nameToNodes[n].imgName is not None}
-	idsToLookup = list(idsToNames.keys()) # Lookup using IDs avoids having to check linked_imgs
-	query = f'SELECT {nodesTable}.id, images.id, images.src, url, license, artist, credit FROM' \
-		f' {nodesTable} INNER JOIN node_imgs ON {nodesTable}.name = node_imgs.name' \
-		f' INNER JOIN images ON node_imgs.img_id = images.id AND node_imgs.src = images.src' \
-		f' WHERE {nodesTable}.id IN ' '({})'.format(','.join(['?'] * len(idsToLookup)))
-	for id, imgId, imgSrc, url, license, artist, credit in dbCur.execute(query, idsToLookup):
-		nameToImgInfo[idsToNames[id]] = ImgInfo(imgId, imgSrc, url, license, artist, credit)
+	query = f'SELECT {nodesTable}.name, desc, wiki_id, from_dbp,' \
+		' images.id, images.src, url, license, artist, credit' \
+		f' FROM {nodesTable} LEFT JOIN wiki_ids ON {nodesTable}.name = wiki_ids.name' \
+		' LEFT JOIN descs ON wiki_ids.id = descs.wiki_id' \
+		f' LEFT JOIN linked_imgs ON {nodesTable}.name = linked_imgs.name' \
+		f' LEFT JOIN {nodesTable} AS linked_nodes ON linked_imgs.otol_ids = linked_nodes.id' \
+		' LEFT JOIN node_imgs ON node_imgs.name = CASE' \
+			f' WHEN EXISTS (SELECT 1 FROM node_imgs WHERE name = {nodesTable}.name) THEN {nodesTable}.name' \
+			' ELSE linked_nodes.name END' \
+		' LEFT JOIN images ON node_imgs.img_id = images.id AND node_imgs.src = images.src' \
+		f' WHERE {nodesTable}.name IN ({",".join(["?"] * len(infoNames))})'
+	foundNames: set[str] = set()
+	for nodeName, desc, wikiId, fromDbp, imgId, imgSrc, url, license, artist, credit in dbCur.execute(query, infoNames):
+		foundNames.add(nodeName)
+		if desc is not None:
+			nameToDescInfo[nodeName] = DescInfo(desc, wikiId, fromDbp == 1)
+		if imgId is not None:
+			nameToImgInfo[nodeName] = ImgInfo(imgId, imgSrc, url, license, artist, credit)
+	if name not in foundNames:
+		return None
+	subNames = [n if n in foundNames else None for n in subNames] # A subname-denoted node may have been trimmed away
+	if subNames: # Info for compound nodes is provided via sub-nodes
+		nameToDescInfo.pop(name, None)
+		nameToImgInfo.pop(name, None)
+
+	# Get node info
+	nodeNames = ([name] if withTolNode else []) + [n for n in subNames if n is not None]
+	nameToNodes = lookupNodes(nodeNames, tree, dbCur)
+	if withTolNode and name not in nameToNodes:
+		return None
 
 	# Construct response
 	nodeInfoObjs = [
 		NodeInfo(
-			nameToNodes[n],
-			nameToDescInfo[n] if n in nameToDescInfo else None,
-			nameToImgInfo[n] if n in nameToImgInfo else None
+			nameToNodes.get(n),
+			nameToDescInfo.get(n),
+			nameToImgInfo.get(n)
 		) if n is not None else None for n in [name] + subNames
 	]
 	return InfoResponse(
-		nodeInfoObjs[0],
+		cast(NodeInfo, nodeInfoObjs[0]),
 		cast(tuple[()] | tuple[NodeInfo | None, NodeInfo | None], nodeInfoObjs[1:]))
 
+def getLinkedImgName(otolIds: str) -> ImgName:
+	""" Converts a linked_imgs 'otol_ids' value into an image name, or a pair for compound nodes """
+	if ',' not in otolIds:
+		return otolIds + '.jpg'
+	else:
+		id1, id2 = otolIds.split(',')
+		return cast(ImgName, (
+			id1 + '.jpg' if id1 != '' else None,
+			id2 + '.jpg' if id2 != '' else None,
+		))
+
 def getTableSuffix(tree: str) -> str:
 	""" Converts a reduced-tree descriptor into a sql-table-suffix """
 	return 't' if tree == 'trimmed' else 'i' if tree == 'images' else 'p'
 
+# ========== For in-memory tree snapshots ==========
+
+class TreeSnapshot(abc.ABC):
+	""" Holds a reduced tree's data, for answering 'node' requests without database access.
+		Nodes are identified by indices. Subclasses provide parallel per-node columns, and
+		children in 'compressed sparse row' form: node i's children are
+		childIdxs[childStarts[i]:childStarts[i+1]]. """
+	tips: Sequence[int]
+	parents: Sequence[int] # Holds -1 for the root
+	pSupport: Sequence[int]
+	childStarts: Sequence[int]
+	childIdxs: Sequence[int]
+	atlasRefs: dict[str, AtlasRef] = {} # Maps node names to atlas references
+
+	@abc.abstractmethod
+	def getIdx(self, name: str) -> int | None:
+		...
+
+	@abc.abstractmethod
+	def getName(self, idx: int) -> str:
+		...
+
+	@abc.abstractmethod
+	def getNodeStrs(self, idx: int) -> tuple[str, str | None, ImgName, str | None]:
+		""" Returns a node's otol ID, preferred common name, image name, and IUCN status """
+
+	def getNode(self, idx: int) -> TolNode:
+		otolId, commonName, imgName, iucn = self.getNodeStrs(idx)
+		parentIdx = self.parents[idx]
+		return TolNode(
+			otolId,
+			[self.getName(i) for i in self.childIdxs[self.childStarts[idx]:self.childStarts[idx + 1]]],
+			self.getName(parentIdx) if parentIdx >= 0 else None,
+			self.tips[idx],
+			self.pSupport[idx] == 1,
+			commonName,
+			imgName,
+			iucn,
+			self.atlasRefs.get(self.getName(idx)) if self.atlasRefs else None)
+
+	def lookupNodes(self, names: list[str]) -> dict[str, TolNode]:
+		""" Like the lookupNodes() function """
+		nameToNodes: dict[str, TolNode] = {}
+		for name in names:
+			idx = self.getIdx(name)
+			if idx is not None:
+				nameToNodes[name] = self.getNode(idx)
+		return nameToNodes
+
+	def lookupNodeAndChildren(self, name: str) -> dict[str, TolNode] | None:
+		""" Like the lookupNodeAndChildren() function """
+		idx = self.getIdx(name)
+		if idx is None:
+			return None
+		tolNode = self.getNode(idx)
+		childNodeObjs = self.lookupNodes(tolNode.children)
+		childNodeObjs[name] = tolNode
+		return childNodeObjs
+
+	def lookupSubtree(self, name: str, depth: int) -> dict[str, TolNode] | None:
+		""" Like the lookupSubtree() function """
+		return getSubtree(name, depth, self.lookupNodes)
+
+	def lookupAncestry(self, name: str, exclName: str | None) -> dict[str, TolNode]:
+		""" Like the lookupAncestry() function """
+		results: dict[str, TolNode] = {}
+		idx = self.getIdx(name)
+		if idx is None:
+			return results
+		# Get ancestors to skip inclusion of
+		idxsToSkip: set[int] = set()
+		exclIdx = self.getIdx(exclName) if exclName is not None else None
+		if exclIdx is not None:
+			ancestorIdx = self.parents[exclIdx]
+			while ancestorIdx >= 0:
+				idxsToSkip.add(ancestorIdx)
+				ancestorIdx = self.parents[ancestorIdx]
+		# Add node, ancestors, and their children
+		results[name] = self.getNode(idx)
+		idx = self.parents[idx]
+		while idx >= 0 and idx not in idxsToSkip:
+			results[self.getName(idx)] = self.getNode(idx)
+			for i in self.childIdxs[self.childStarts[idx]:self.childStarts[idx + 1]]:
+				childName = self.getName(i)
+				if childName not in results:
+					results[childName] = self.getNode(i)
+			idx = self.parents[idx]
+		return results
+
+	def lookupNodeBatch(self, nodeReqs: Sequence[NodeReq]) -> dict[str, TolNode]:
+		""" Like the lookupNodeBatch() function """
+		results: dict[str, TolNode] = {}
+		for name, toroot, exclName, depth in nodeReqs:
+			if depth > 1:
+				results.update(self.lookupSubtree(name, depth) or {})
+			elif not toroot:
+				results.update(self.lookupNodeAndChildren(name) or {})
+			else:
+				results.update(self.lookupAncestry(name, exclName))
+		return results
+
+class DbTreeSnapshot(TreeSnapshot):
+	""" A tree snapshot loaded from the database into arrays and lists """
+	def __init__(self, tree: str, dbCur: sqlite3.Cursor):
+		tblSuffix = getTableSuffix(tree)
+		nodesTable = f'nodes_{tblSuffix}'
+		edgesTable = f'edges_{tblSuffix}'
+
+		# Get node info
+		self.names: list[str] = []
+		self.nameToIdx: dict[str, int] = {}
+		self.otolIds: list[str] = []
+		self.tips = array.array('l')
+		for name, otolId, tips in dbCur.execute(f'SELECT name, id, tips FROM {nodesTable}'):
+			self.nameToIdx[name] = len(self.names)
+			self.names.append(name)
+			self.otolIds.append(otolId)
+			self.tips.append(tips)
+		numNodes = len(self.names)
+
+		# Get parent and child info
+		self.parents = array.array('l', [-1]) * numNodes
+		self.pSupport = bytearray(numNodes)
+		self.childStarts = array.array('l', [0]) * (numNodes + 1)
+		edges = dbCur.execute(getEdgesQuery('parent, child, p_support', edgesTable, nodesTable, dbCur)).fetchall()
+		self.childIdxs = array.array('l', [0]) * len(edges)
+		for parent, _, _ in edges:
+			self.childStarts[self.nameToIdx[parent] + 1] += 1
+		for i in range(numNodes):
+			self.childStarts[i + 1] += self.childStarts[i]
+		nextChildPos = self.childStarts[:-1]
+		for parent, child, pSupport in edges:
+			parentIdx = self.nameToIdx[parent]
+			childIdx = self.nameToIdx[child]
+			self.childIdxs[nextChildPos[parentIdx]] = childIdx
+			nextChildPos[parentIdx] += 1
+			self.parents[childIdx] = parentIdx
+			self.pSupport[childIdx] = pSupport == 1
+
+		# Get image names
+		self.imgNames: list[ImgName] = [None] * numNodes
+		query = f'SELECT {nodesTable}.name FROM {nodesTable}' \
+			f' INNER JOIN node_imgs ON {nodesTable}.name = node_imgs.name'
+		for (name,) in dbCur.execute(query):
+			idx = self.nameToIdx[name]
+			self.imgNames[idx] = self.otolIds[idx] + '.jpg'
+		query = f'SELECT {nodesTable}.name, otol_ids FROM {nodesTable}' \
+			f' INNER JOIN linked_imgs ON {nodesTable}.name = linked_imgs.name'
+		for name, otolIds in dbCur.execute(query):
+			idx = self.nameToIdx[name]
+			if self.imgNames[idx] is None:
+				self.imgNames[idx] = getLinkedImgName(otolIds)
+
+		# Get preferred names and IUCN status
+		self.commonNames: list[str | None] = [None] * numNodes
+		query = f'SELECT {nodesTable}.name, alt_name FROM {nodesTable}' \
+			f' INNER JOIN names ON {nodesTable}.name = names.name WHERE pref_alt = 1'
+		for name, altName in dbCur.execute(query):
+			self.commonNames[self.nameToIdx[name]] = altName
+		self.iucns: list[str | None] = [None] * numNodes
+		query = f'SELECT {nodesTable}.name, iucn FROM {nodesTable}' \
+			f' INNER JOIN node_iucn ON {nodesTable}.name = node_iucn.name'
+		for name, iucn in dbCur.execute(query):
+			self.iucns[self.nameToIdx[name]] = iucn
+
+	def getIdx(self, name: str) -> int | None:
+		return self.nameToIdx.get(name)
+
+	def getName(self, idx: int) -> str:
+		return self.names[idx]
+
+	def getNodeStrs(self, idx: int) -> tuple[str, str | None, ImgName, str | None]:
+		return self.otolIds[idx], self.commonNames[idx], self.imgNames[idx], self.iucns[idx]
+
+class MappedTreeSnapshot(TreeSnapshot):
+	""" A tree snapshot backed by a memory-mapped file generated by tol_data/gen_tree_files.py.
+		As the mapping is read-only and shared, processes using the same file share it's memory. """
+	MAGIC = b'TILOTREE'
+	VERSION = 2
+	HEADER_FORMAT = '<8sIIIIIIQ'
+	NO_STR = 0xFFFFFFFF # Represents a null string index
+
+	def __init__(self, filename: str):
+		if sys.byteorder != 'little':
+			raise Exception('Tree files are only supported on little-endian systems')
+		with open(filename, 'rb') as file:
+			self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+		magic, version = struct.unpack_from('<8sI', self.mmap)
+		if magic != self.MAGIC or version != self.VERSION:
+			raise Exception(f'Unrecognised tree file format for {filename}')
+		_, _, self.numNodes, numEdges, numStrs, numSections, dbChangeCounter, dbSize = \
+			struct.unpack_from(self.HEADER_FORMAT, self.mmap)
+		self.dbIdentity = (dbSize, dbChangeCounter) # Identifies the db the file was generated from
+		headerSize = struct.calcsize(self.HEADER_FORMAT)
+		sections = [struct.unpack_from('<QQ', self.mmap, headerSize + i * 16) for i in range(numSections)]
+		view = memoryview(self.mmap)
+		def getSection(sectionIdx: int, fmt: str) -> memoryview:
+			offset, length = sections[sectionIdx]
+			return view[offset:offset + length].cast(fmt)
+		# Node i's name is string i, and nodes are ordered by UTF-8-encoded name, for binary search
+		self.strOffsets = getSection(0, 'I')
+		self.otolIds = getSection(1, 'I')
+		self.tips = getSection(2, 'i')
+		self.parents = getSection(3, 'i')
+		self.pSupport = getSection(4, 'B')
+		self.childStarts = getSection(5, 'I')
+		self.childIdxs = getSection(6, 'I')
+		self.commonNames = getSection(7, 'I')
+		self.iucns = getSection(8, 'I')
+		self.imgNames1 = getSection(9, 'I') # Holds image name string indices
+		self.imgNames2 = getSection(10, 'I') # For compound nodes, holds the second image, or NO_STR for non-pairs
+		self.imgPairs = getSection(11, 'B') # Holds 1 for compound-node image pairs
+		self.strDataStart = sections[12][0]
+
+	def getStr(self, strIdx: int) -> str:
+		return self.mmap[self.strDataStart + self.strOffsets[strIdx]:
+			self.strDataStart + self.strOffsets[strIdx + 1]].decode()
+
+	def getIdx(self, name: str) -> int | None:
+		key = name.encode()
+		lo, hi = 0, self.numNodes
+		while lo < hi:
+			mid = (lo + hi) // 2
+			midKey = self.mmap[self.strDataStart + self.strOffsets[mid]:self.strDataStart + self.strOffsets[mid + 1]]
+			if midKey < key:
+				lo = mid + 1
+			elif midKey > key:
+				hi = mid
+			else:
+				return mid
+		return None
+
+	def getName(self, idx: int) -> str:
+		return self.getStr(idx)
+
+	def getOptionalStr(self, strIdx: int) -> str | None:
+		return self.getStr(strIdx) if strIdx != self.NO_STR else None
+
+	def getNodeStrs(self, idx: int) -> tuple[str, str | None, ImgName, str | None]:
+		imgName: ImgName = self.getOptionalStr(self.imgNames1[idx])
+		if self.imgPairs[idx] == 1:
+			imgName = cast(ImgName, (imgName, self.getOptionalStr(self.imgNames2[idx])))
+		return (self.getStr(self.otolIds[idx]), self.getOptionalStr(self.commonNames[idx]),
+			imgName, self.getOptionalStr(self.iucns[idx]))
+
+def getTreeSnapshot(pool: DbConnPool, tree: str) -> TreeSnapshot:
+	""" Returns a snapshot of a reduced tree, loading it on first use.
+		Uses a tree file beside the db file if one exists (eg: tree_i.bin for the 'images' tree),
+		and was generated from the same version of the db. """
+	with pool.lock:
+		if tree not in pool.snapshotLocks:
+			pool.snapshotLocks[tree] = threading.Lock()
+		snapshotLock = pool.snapshotLocks[tree]
+	with snapshotLock: # Avoids having multiple threads load the same snapshot
+		if tree not in pool.snapshots:
+			treeFile = os.path.join(os.path.dirname(pool.dbFile), f'tree_{getTableSuffix(tree)}.bin')
+			with pool.connection() as dbCon:
+				dbCur = dbCon.cursor()
+				snapshot: TreeSnapshot | None = None
+				if os.path.exists(treeFile):
+					snapshot = MappedTreeSnapshot(treeFile)
+					if snapshot.dbIdentity != getDbIdentity(pool.dbFile):
+						print(f'WARNING: Ignoring {treeFile}, as it was generated from a different db', file=sys.stderr)
+						snapshot = None
+				if snapshot is None:
+					snapshot = DbTreeSnapshot(tree, dbCur)
+				snapshot.atlasRefs = lookupAtlasRefs(None, tree, dbCur)
+			pool.snapshots[tree] = snapshot
+		return pool.snapshots[tree]
+
+# ========== For in-memory search suggestions ==========
+
+class PrefixIndex:
+	""" Holds lowercased names in sorted order, for finding the entries with a given prefix.
+		For prefixes that match many entries, holds precomputed lists of top-ranked entries.
+		Entry lists are ordered by popularity, and hold at most one entry per node. """
+	def __init__(self, keys: list[str], entryIds: list[int], suggIndex: 'SuggIndex', scanLimit: int,
+			topEntries: dict[str, list[int]] | None = None):
+		""" Computes top-ranked entry lists, unless given ones (eg: from a saved index) """
+		self.keys = keys # Sorted lowercased names
+		self.entryIds = array.array('l', entryIds) # Maps key positions to SuggIndex entries
+		self.suggIndex = suggIndex
+		self.scanLimit = scanLimit # Prefixes matching more keys than this get precomputed entry lists
+		self.topEntries: dict[str, array.array] = {} # Maps prefixes to top-ranked entry IDs
+		if topEntries is None:
+			self.addTopEntries('', 0, len(keys))
+		else:
+			self.topEntries = {prefix: array.array('l', entryIds) for prefix, entryIds in topEntries.items()}
+
+	def addTopEntries(self, prefix: str, lo: int, hi: int) -> list[int]:
+		""" Returns the top-ranked entries for a prefix matching keys in [lo, hi), recording them
+			if the range is large. Large ranges are handled by merging the lists of longer prefixes. """
+		if hi - lo <= self.scanLimit:
+			return self.suggIndex.rankEntries(self.entryIds[lo:hi])
+		pos = lo
+		while pos < hi and len(self.keys[pos]) == len(prefix): # Skip exact matches
+			pos += 1
+		candidates = list(self.entryIds[lo:pos])
+		while pos < hi:
+			subPrefix = self.keys[pos][:len(prefix) + 1]
+			subHi = bisect.bisect_left(self.keys, getPrefixEnd(subPrefix), pos, hi)
+			candidates.extend(self.addTopEntries(subPrefix, pos, subHi))
+			pos = subHi
+		results = self.suggIndex.rankEntries(candidates)
+		self.topEntries[prefix] = array.array('l', results)
+		return results
+
+	def lookup(self, prefix: str) -> Sequence[int]:
+		""" Returns the top-ranked entries for keys with a given prefix """
+		entries = self.topEntries.get(prefix)
+		if entries is not None:
+			return entries
+		if prefix == '':
+			return self.suggIndex.rankEntries(self.entryIds)
+		lo = bisect.bisect_left(self.keys, prefix)
+		hi = bisect.bisect_left(self.keys, getPrefixEnd(prefix), lo)
+		return self.suggIndex.rankEntries(self.entryIds[lo:hi])
+
+	def toJsonObj(self) -> dict:
+		return {
+			'keys': self.keys,
+			'entryIds': self.entryIds.tolist(),
+			'topEntries': {prefix: entryIds.tolist() for prefix, entryIds in self.topEntries.items()},
+		}
+
+def getPrefixEnd(prefix: str) -> str:
+	""" Returns the smallest string greater than all strings with a given non-empty prefix """
+	return prefix[:-1] + chr(ord(prefix[-1]) + 1) if ord(prefix[-1]) < 0x10ffff else prefix + chr(0x10ffff)
+
+class SuggIndex:
+	""" Holds a reduced tree's node names and alt-names, for answering 'sugg' requests
+		that are satisfied by prefix matches, without database access """
+	MAX_RESULTS = MAX_SUGG_LIM + 1 # Enough entries to fill any suggestion limit, and determine 'hasMore'
+	SCAN_LIMIT = 1000
+	FUZZY_MIN_LEN = 3 # Min search string length for fuzzy matching
+	FUZZY_MAX_POSTINGS = 20000 # Max number of trigram-index entries to count, beyond those required, per fuzzy lookup
+	FILE_VERSION = 1 # Format version of files written by save()
+
+	def __init__(self, rows: Iterable[tuple[str, str | None, int | None, int | None]]):
+		""" Takes (name, altName, prefAlt, pop) rows, with a None altName for canonical-name rows """
+		self.names: list[str] = [] # Node names of entries
+		self.altNames: list[str | None] = []
+		self.prefAlts = bytearray()
+		self.pops = array.array('l')
+		nameKeys: list[tuple[str, int]] = []
+		altNameKeys: list[tuple[str, int]] = []
+		for name, altName, prefAlt, pop in rows:
+			if altName is None:
+				nameKeys.append((name.lower(), len(self.names)))
+			else:
+				altNameKeys.append((altName.lower(), len(self.names)))
+			self.names.append(name)
+			self.altNames.append(altName)
+			self.prefAlts.append(prefAlt == 1)
+			self.pops.append(pop if pop is not None else 0)
+		nameKeys.sort()
+		altNameKeys.sort()
+		self.nameIndex = PrefixIndex(
+			[k for k, _ in nameKeys], [i for _, i in nameKeys], self, self.SCAN_LIMIT)
+		self.altNameIndex = PrefixIndex(
+			[k for k, _ in altNameKeys], [i for _, i in altNameKeys], self, self.SCAN_LIMIT)
+		self.gramIndex: dict[str, array.array] | None = None # Maps trigrams to entries, built on first fuzzy lookup
+
+	@staticmethod
+	def fromDb(tree: str, dbCur: sqlite3.Cursor) -> 'SuggIndex':
+		tblSuffix = getTableSuffix(tree)
+		searchTable = f'search_{tblSuffix}'
+		if hasTable(dbCur, searchTable):
+			return SuggIndex(dbCur.execute(f'SELECT name, alt_name, pref_alt, pop FROM {searchTable}'))
+		nodesTable = f'nodes_{tblSuffix}'
+		nameQuery = f'SELECT {nodesTable}.name, NULL, NULL, node_pop.pop FROM {nodesTable}' \
+			f' LEFT JOIN node_pop ON {nodesTable}.name = node_pop.name WHERE {nodesTable}.name NOT LIKE "[%"'
+		altNameQuery = f'SELECT names.name, alt_name, pref_alt, node_pop.pop FROM' \
+			f' names INNER JOIN {nodesTable} ON names.name = {nodesTable}.name' \
+			f' LEFT JOIN node_pop ON {nodesTable}.name = node_pop.name'
+		return SuggIndex(dbCur.execute(f'{nameQuery} UNION ALL {altNameQuery}'))
+
+	def rankEntries(self, entryIds: Iterable[int]) -> list[int]:
+		""" Orders entries by popularity, keeps one entry per node (preferring preferred alt-names),
+			and returns the first MAX_RESULTS """
+		nodeToEntry: dict[str, int] = {}
+		for entryId in entryIds:
+			name = self.names[entryId]
+			if name not in nodeToEntry or self.prefAlts[entryId] and not self.prefAlts[nodeToEntry[name]]:
+				nodeToEntry[name] = entryId
+		return sorted(nodeToEntry.values(),
+			key=lambda i: (-self.pops[i], self.names[i]))[:self.MAX_RESULTS]
+
+	def lookupSuggs(self, searchStr: str, suggLimit: int) -> SearchSuggResponse | None:
+		""" Like the lookupSuggs() function, but returns None if there are insufficient
+			prefix matches, in which case substring matches would be needed """
+		prefix = searchStr.lower()
+		suggs: dict[str, SearchSugg] = {}
+		tempLimit = suggLimit + 1 # For determining if 'more suggestions exist'
+		for entryId in self.altNameIndex.lookup(prefix):
+			if len(suggs) == tempLimit:
+				break
+			suggs[self.names[entryId]] = SearchSugg(
+				cast(str, self.altNames[entryId]), self.names[entryId], self.pops[entryId])
+		for entryId in self.nameIndex.lookup(prefix):
+			if len(suggs) == tempLimit:
+				break
+			name = self.names[entryId]
+			if name not in suggs:
+				suggs[name] = SearchSugg(name, pop=self.pops[entryId])
+		if len(suggs) < tempLimit:
+			return None
+		suggList = sorted(suggs.values(), key=lambda x: x.pop, reverse=True)
+		return SearchSuggResponse(suggList[:suggLimit], True)
+
+	def getEntryKey(self, entryId: int) -> str:
+		altName = self.altNames[entryId]
+		return (altName if altName is not None else self.names[entryId]).lower()
+
+	def getGramIndex(self) -> dict[str, array.array]:
+		""" Returns a map from trigrams to entries whose lowercased names contain them, building it if needed """
+		with gramIndexLock:
+			if self.gramIndex is None:
+				gramToEntries: dict[str, list[int]] = {}
+				for entryId in range(len(self.names)):
+					if self.altNames[entryId] is None and self.names[entryId].startswith('['):
+						continue
+					for gram in getTrigrams(self.getEntryKey(entryId)):
+						if gram not in gramToEntries:
+							gramToEntries[gram] = []
+						gramToEntries[gram].append(entryId)
+				self.gramIndex = {gram: array.array('l', entryIds) for gram, entryIds in gramToEntries.items()}
+			return self.gramIndex
+
+	def lookupFuzzySuggs(self, searchStr: str, numSuggs: int, exclNames: set[str]) -> list[SearchSugg]:
+		""" Returns up to numSuggs suggestions for names within a small edit distance of a search string,
+			ordered by popularity, and excluding the nodes in exclNames """
+		searchKey = searchStr.lower()
+		if len(searchKey) < self.FUZZY_MIN_LEN or numSuggs <= 0:
+			return []
+		maxDist = 1 if len(searchKey) <= 6 else 2
+		# A name within distance maxDist keeps all but 3*maxDist of the search string's trigrams,
+		# so of any k of them, it must contain at least k-3*maxDist. The rarest ones are used,
+		# with k at least 3*maxDist+1, and increased while within FUZZY_MAX_POSTINGS, which
+		# allows more names to be skipped without missing any.
+		gramIndex = self.getGramIndex()
+		searchGrams = getTrigrams(searchKey)
+		minSharedGrams = len(searchGrams) - maxDist * 3
+		gramEntries = sorted((gramIndex.get(gram, array.array('l')) for gram in searchGrams), key=len)
+		numGrams = maxDist * 3 + 1
+		numPostings = 0
+		while numGrams < len(gramEntries) and numPostings + len(gramEntries[numGrams]) <= self.FUZZY_MAX_POSTINGS:
+			numPostings += len(gramEntries[numGrams])
+			numGrams += 1
+		gramCounts: collections.Counter[int] = collections.Counter()
+		for entryIds in gramEntries[:numGrams]:
+			gramCounts.update(entryIds)
+		minCount = numGrams - maxDist * 3
+		candidates = [entryId for entryId, count in gramCounts.items() if count >= minCount]
+		# Check candidates, using the length difference and shared trigram count as quicker bounds
+		nodeToEntry: dict[str, tuple[int, int]] = {} # Maps node names to (entry, distance) pairs
+		searchLen = len(searchKey)
+		for entryId in candidates:
+			key = self.getEntryKey(entryId)
+			if abs(len(key) - searchLen) > maxDist or len(getTrigrams(key) & searchGrams) < minSharedGrams:
+				continue
+			name = self.names[entryId]
+			if name in exclNames:
+				continue
+			dist = getEditDistance(searchKey, key, maxDist)
+			if dist is None:
+				continue
+			if name not in nodeToEntry or (dist, not self.prefAlts[entryId]) < \
+					(nodeToEntry[name][1], not self.prefAlts[nodeToEntry[name][0]]):
+				nodeToEntry[name] = (entryId, dist)
+		entryIds = sorted((entryId for entryId, _ in nodeToEntry.values()),
+			key=lambda i: (-self.pops[i], self.names[i]))[:numSuggs]
+		return [SearchSugg(cast(str, self.altNames[i]), self.names[i], self.pops[i])
+			if self.altNames[i] is not None else SearchSugg(self.names[i], pop=self.pops[i]) for i in entryIds]
+
+	def addFuzzySuggs(self, suggResponse: SearchSuggResponse, searchStr: str, suggLimit: int) -> None:
+		""" Adds fuzzy-match suggestions to a response that has fewer than suggLimit suggestions """
+		if suggResponse.hasMore:
+			return
+		exclNames = {sugg.canonicalName if sugg.canonicalName is not None else sugg.name
+			for sugg in suggResponse.suggs}
+		fuzzySuggs = self.lookupFuzzySuggs(searchStr, suggLimit + 1 - len(suggResponse.suggs), exclNames)
+		suggResponse.suggs.extend(fuzzySuggs)
+		if len(suggResponse.suggs) > suggLimit:
+			suggResponse.suggs = suggResponse.suggs[:suggLimit]
+			suggResponse.hasMore = True
+
+	def save(self, filename: str, dbIdentity: tuple[int, int]) -> None:
+		""" Writes the index into a JSON file, with the identity of the db it was generated from.
+			The trigram index is omitted, as it's relatively large. """
+		obj = {
+			'version': self.FILE_VERSION,
+			'dbIdentity': list(dbIdentity),
+			'names': self.names,
+			'altNames': self.altNames,
+			'prefAlts': list(self.prefAlts),
+			'pops': self.pops.tolist(),
+			'nameIndex': self.nameIndex.toJsonObj(),
+			'altNameIndex': self.altNameIndex.toJsonObj(),
+		}
+		with open(filename, 'wb') as file:
+			file.write(orjson.dumps(obj) if orjson is not None else json.dumps(obj, ensure_ascii=False).encode())
+
+	@staticmethod
+	def load(filename: str, dbIdentity: tuple[int, int]) -> 'SuggIndex | None':
+		""" Reads an index written by save(), returning None if it was generated from a different db """
+		with open(filename, 'rb') as file:
+			data = file.read()
+		obj = orjson.loads(data) if orjson is not None else json.loads(data)
+		if not isinstance(obj, dict) or obj.get('version') != SuggIndex.FILE_VERSION:
+			raise Exception(f'Unrecognised suggestion index file {filename}')
+		if tuple(obj['dbIdentity']) != dbIdentity:
+			return None
+		suggIndex = SuggIndex([])
+		suggIndex.names = obj['names']
+		suggIndex.altNames = obj['altNames']
+		suggIndex.prefAlts = bytearray(obj['prefAlts'])
+		suggIndex.pops = array.array('l', obj['pops'])
+		for attr in ['nameIndex', 'altNameIndex']:
+			indexObj = obj[attr]
+			setattr(suggIndex, attr, PrefixIndex(indexObj['keys'], indexObj['entryIds'],
+				suggIndex, SuggIndex.SCAN_LIMIT, indexObj['topEntries']))
+		return suggIndex
+
+gramIndexLock = threading.Lock() # Avoids having multiple threads build the same trigram index
+
+def getTrigrams(s: str) -> set[str]:
+	""" Returns the trigrams of a string, padded at each end to give boundary trigrams """
+	s = '\0\0' + s + '\0\0'
+	return {s[i:i + 3] for i in range(len(s) - 2)}
+
+def getEditDistance(s1: str, s2: str, maxDist: int) -> int | None:
+	""" Returns the Levenshtein distance between two strings, or None if it exceeds maxDist """
+	if abs(len(s1) - len(s2)) > maxDist:
+		return None
+	prevRow = list(range(len(s2) + 1))
+	for i, c1 in enumerate(s1, 1):
+		row = [i]
+		for j, c2 in enumerate(s2, 1):
+			row.append(min(prevRow[j] + 1, row[j - 1] + 1, prevRow[j - 1] + (c1 != c2)))
+		if min(row) > maxDist:
+			return None
+		prevRow = row
+	return prevRow[-1] if prevRow[-1] <= maxDist else None
+
+def getSuggIndex(pool: DbConnPool, tree: str) -> SuggIndex:
+	""" Returns a suggestion index for a reduced tree, building it on first use.
+		Uses an index file beside the db file if one exists (eg: sugg_i.json for the 'images' tree),
+		and was generated from the same version of the db. """
+	with pool.lock:
+		if tree not in pool.suggIndexLocks:
+			pool.suggIndexLocks[tree] = threading.Lock()
+		suggIndexLock = pool.suggIndexLocks[tree]
+	with suggIndexLock:
+		if tree not in pool.suggIndexes:
+			indexFile = os.path.join(os.path.dirname(pool.dbFile), f'sugg_{getTableSuffix(tree)}.json')
+			suggIndex: SuggIndex | None = None
+			if os.path.exists(indexFile):
+				suggIndex = SuggIndex.load(indexFile, getDbIdentity(pool.dbFile))
+				if suggIndex is None:
+					print(f'WARNING: Ignoring {indexFile}, as it was generated from a different db', file=sys.stderr)
+			if suggIndex is None:
+				with pool.connection() as dbCon:
+					suggIndex = SuggIndex.fromDb(tree, dbCon.cursor())
+			pool.suggIndexes[tree] = suggIndex
+		return pool.suggIndexes[tree]
+
+# ========== For response encoding ==========
+
+def encodeResponse(val: None | dict[str, TolNode] | SearchSuggResponse | InfoResponse | AtlasResponse) -> bytes:
+	""" Converts a response object into JSON, without whitespace, and with unescaped unicode characters.
+		The output is the same with or without orjson, so stored responses (eg: from
+		tol_data/gen_response_cache.py) match those that the server encodes. """
+	obj: None | dict
+	if val is None:
+		obj = None
+	elif isinstance(val, dict):
+		obj = {name: tolNode.toJsonObj() for name, tolNode in val.items()}
+	else:
+		obj = val.toJsonObj()
+	if orjson is not None:
+		return orjson.dumps(obj)
+	return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode()
+
+# ========== For response caching ==========
+
+class CachedResponse:
+	""" Holds an encoded response, and possibly a precompressed gzip version """
+	def __init__(self, data: bytes, gzipData: bytes | None = None):
+		self.data = data
+		self.gzipData = gzipData
+
+	def size(self) -> int:
+		return len(self.data) + (len(self.gzipData) if self.gzipData is not None else 0)
+
+class ResponseCache:
+	""" A thread-safe LRU cache of encoded responses, keyed by normalized query.
+		Entries are discarded when the db file changes. """
+	def __init__(self, maxEntries: int, maxBytes: int):
+		self.maxEntries = maxEntries
+		self.maxBytes = maxBytes
+		self.entries: collections.OrderedDict[tuple, CachedResponse] = collections.OrderedDict()
+		self.numBytes = 0
+		self.fileId: tuple[int, int, int] | None = None # Identifies the db file version that entries came from
+		self.hits = 0
+		self.misses = 0
+		self.lock = threading.Lock()
+
+	def get(self, key: tuple, fileId: tuple[int, int, int]) -> CachedResponse | None:
+		with self.lock:
+			if fileId != self.fileId:
+				self.entries.clear()
+				self.numBytes = 0
+				self.fileId = fileId
+			entry = self.entries.get(key)
+			if entry is None:
+				self.misses += 1
+				return None
+			self.hits += 1
+			self.entries.move_to_end(key)
+			return entry
+
+	def put(self, key: tuple, fileId: tuple[int, int, int], entry: CachedResponse) -> None:
+		size = entry.size()
+		if size > self.maxBytes or self.maxEntries <= 0:
+			return
+		with self.lock:
+			if fileId != self.fileId:
+				return
+			if key in self.entries:
+				self.numBytes -= self.entries.pop(key).size()
+			self.entries[key] = entry
+			self.numBytes += size
+			while len(self.entries) > self.maxEntries or self.numBytes > self.maxBytes:
+				_, oldEntry = self.entries.popitem(last=False)
+				self.numBytes -= oldEntry.size()
+
+responseCache = ResponseCache(RESPONSE_CACHE_ENTRIES, RESPONSE_CACHE_BYTES)
+
+T = TypeVar('T')
+
+class FlightCall(Generic[T]):
+	""" Holds the result of an in-progress computation, for threads waiting on it """
+	def __init__(self):
+		self.done = threading.Event()
+		self.result: T | None = None
+		self.error: BaseException | None = None
+
+class SingleFlight(Generic[T]):
+	""" Makes concurrent calls with the same key, from different threads, share one computation """
+	def __init__(self):
+		self.calls: dict[tuple, FlightCall[T]] = {}
+		self.numCoalesced = 0 # Number of calls that used another call's computation
+		self.lock = threading.Lock()
+
+	def do(self, key: tuple, fn: Callable[[], T]) -> T:
+		""" Returns fn(), or the result of an in-progress call with the same key """
+		with self.lock:
+			call = self.calls.get(key)
+			isLeader = call is None
+			if call is None:
+				call = self.calls[key] = FlightCall()
+			else:
+				self.numCoalesced += 1
+		if not isLeader:
+			call.done.wait()
+			if call.error is not None:
+				raise call.error
+			return cast(T, call.result)
+		try:
+			call.result = fn()
+			return call.result
+		except BaseException as e:
+			call.error = e
+			raise
+		finally:
+			with self.lock:
+				del self.calls[key]
+			call.done.set()
+
+responseFlights: SingleFlight[CachedResponse] = SingleFlight()
+
+# ========== For response compression ==========
+
+class CompressionCache:
+	""" A thread-safe LRU cache of compressed responses, keyed by a hash of the uncompressed data
+		and the content-coding. Entries hold the compression level used. """
+	def __init__(self, maxBytes: int):
+		self.maxBytes = maxBytes
+		self.entries: collections.OrderedDict[tuple[bytes, str], tuple[int, bytes]] = collections.OrderedDict()
+		self.numBytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.lock = threading.Lock()
+
+	def get(self, key: tuple[bytes, str], minLevel: int) -> bytes | None:
+		""" Returns compressed data, if present with at least the given compression level """
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry is None or entry[0] < minLevel:
+				self.misses += 1
+				return None
+			self.hits += 1
+			self.entries.move_to_end(key)
+			return entry[1]
+
+	def put(self, key: tuple[bytes, str], level: int, data: bytes) -> None:
+		if len(data) > self.maxBytes:
+			return
+		with self.lock:
+			if key in self.entries:
+				self.numBytes -= len(self.entries.pop(key)[1])
+			self.entries[key] = (level, data)
+			self.numBytes += len(data)
+			while self.numBytes > self.maxBytes:
+				_, (_, oldData) = self.entries.popitem(last=False)
+				self.numBytes -= len(oldData)
+
+compressionCache = CompressionCache(COMPRESSION_CACHE_BYTES)
+
+def getAvailableEncodings() -> list[str]:
+	""" Returns the content-codings that responses can be compressed with, in order of preference """
+	return [encoding for encoding, module in [('br', brotli), ('zstd', zstandard), ('gzip', gzip)]
+		if module is not None]
+
+def negotiateEncoding(acceptEncoding: str) -> str | None:
+	""" Returns a content-coding to use for a response, given an Accept-Encoding header value, or None """
+	qValues: dict[str, float] = {}
+	for item in acceptEncoding.split(','):
+		coding, *params = [part.strip() for part in item.split(';')]
+		qValue = 1.0
+		for param in params:
+			if param.startswith('q='):
+				try:
+					qValue = float(param[2:])
+				except ValueError:
+					qValue = 0
+		if coding != '':
+			qValues[coding.lower()] = qValue
+	bestEncoding: str | None = None
+	bestQValue = 0.0
+	for encoding in getAvailableEncodings():
+		qValue = qValues.get(encoding, qValues.get('*', 0))
+		if qValue > bestQValue:
+			bestEncoding, bestQValue = encoding, qValue
+	return bestEncoding
+
+def compressData(data: bytes, encoding: str, level: int) -> bytes:
+	if encoding == 'br':
+		return brotli.compress(data, quality=level)
+	elif encoding == 'zstd':
+		return zstandard.ZstdCompressor(level=level).compress(data)
+	return gzip.compress(data, compresslevel=level)
+
+def compressResponse(data: bytes, encoding: str, isHot: bool) -> bytes:
+	""" Compresses response data, using the compression cache, and a higher level for 'hot' responses """
+	level = COMPRESSION_LEVELS[encoding][1 if isHot else 0]
+	key = (hashlib.blake2b(data, digest_size=16).digest(), encoding)
+	compressed = compressionCache.get(key, level)
+	if compressed is None:
+		def compress() -> bytes:
+			compressed = compressData(data, encoding, level)
+			compressionCache.put(key, level, compressed)
+			return compressed
+		compressed = compressionFlights.do((*key, level), compress)
+	return compressed
+
+compressionFlights: SingleFlight[bytes] = SingleFlight()
+
 # ========== Entry point ==========
 
-def handleReq(dbFile: str, environ: dict[str, str]) -> None | dict[str, TolNode] | SearchSuggResponse | InfoResponse:
-	""" Queries the database, and constructs a response object """
-	# Open db
-	dbCon = sqlite3.connect(dbFile)
-	dbCur = dbCon.cursor()
+class Query:
+	""" Holds normalized request parameters """
+	def __init__(
+			self,
+			reqType: str,
+			name: str,
+			tree: str,
+			toroot=False,
+			excl: str | None = None,
+			depth=1,
+			withTolNode=True,
+			limit=DEFAULT_SUGG_LIM,
+			fuzzy=False,
+			paged=False,
+			cursor: SuggCursor | None = None,
+			nodeReqs: tuple[NodeReq, ...] = ()):
+		self.reqType = reqType
+		self.name = name
+		self.tree = tree
+		self.toroot = toroot
+		self.excl = excl
+		self.depth = depth
+		self.withTolNode = withTolNode
+		self.limit = limit
+		self.fuzzy = fuzzy
+		self.paged = paged
+		self.cursor = cursor
+		self.nodeReqs = nodeReqs
 
-	# Get query params
-	queryStr = environ['QUERY_STRING'] if 'QUERY_STRING' in environ else ''
+	def key(self) -> tuple:
+		return (self.reqType, self.name, self.tree, self.toroot, self.excl, self.depth, self.withTolNode, self.limit,
+			self.fuzzy, self.paged, self.cursor, self.nodeReqs)
+
+def parseQuery(queryStr: str, body: bytes | None = None) -> Query | None:
+	""" Converts a URL query string, and possibly a POST request body, into a Query,
+		or returns None if the parameters are invalid """
 	queryDict = urllib.parse.parse_qs(queryStr)
 	# Set vars from params
 	name = queryDict['name'][0] if 'name' in queryDict else None
@@ -354,95 +1791,346 @@ def handleReq(dbFile: str, environ: dict[str, str]) -> None | dict[str, TolNode]
 	tree = queryDict['tree'][0] if 'tree' in queryDict else 'images'
 
 	# Check for valid 'tree'
-	if tree is not None and re.fullmatch(r'trimmed|images|picked', tree) is None:
+	if re.fullmatch(r'trimmed|images|picked', tree) is None:
 		return None
-	# Get data of requested type
+	# Get type-specific params, leaving others at default values
 	if reqType == 'node':
 		toroot = queryDict['toroot'][0] == '1' if 'toroot' in queryDict else False
-		if not toroot:
-			tolNodes = lookupNodes([name], tree, dbCur)
-			if tolNodes:
-				tolNode = tolNodes[name]
-				childNodeObjs = lookupNodes(tolNode.children, tree, dbCur)
-				childNodeObjs[name] = tolNode
-				return childNodeObjs
-		else:
-			# Get ancestors to skip inclusion of
-			nodesToSkip: set[str] = set()
-			nodeName = queryDict['excl'][0] if 'excl' in queryDict else None
-			if nodeName is not None:
-				edgesTable = f'edges_{getTableSuffix(tree)}'
-				while True:
-					row = dbCur.execute(f'SELECT parent FROM {edgesTable} WHERE child = ?', (nodeName,)).fetchone()
-					if row is None:
-						break
-					parent = row[0]
-					nodesToSkip.add(parent)
-					nodeName = parent
-
-			results: dict[str, TolNode] = {}
-			ranOnce = False
-			while True:
-				# Get node
-				tolNodes = lookupNodes([name], tree, dbCur)
-				if not tolNodes:
-					if not ranOnce:
-						return results
-					print(f'ERROR: Parent-chain node {name} not found', file=sys.stderr)
-					break
-				tolNode = tolNodes[name]
-				results[name] = tolNode
-				# Potentially add children
-				if not ranOnce:
-					ranOnce = True
-				else:
-					childNamesToAdd = []
-					for childName in tolNode.children:
-						if childName not in results:
-							childNamesToAdd.append(childName)
-					childNodeObjs = lookupNodes(childNamesToAdd, tree, dbCur)
-					results.update(childNodeObjs)
-				# Check if root
-				if tolNode.parent is None or tolNode.parent in nodesToSkip:
-					return results
-				else:
-					name = tolNode.parent
+		excl = queryDict['excl'][0] if 'excl' in queryDict and toroot else None
+		# Check for depth
+		try:
+			depth = int(queryDict['depth'][0]) if 'depth' in queryDict and not toroot else 1
+		except ValueError:
+			print(f'INFO: Invalid depth {queryDict["depth"][0]}', file=sys.stderr)
+			return None
+		if depth < 1 or depth > MAX_NODE_DEPTH:
+			return None
+		return Query(reqType, name, tree, toroot=toroot, excl=excl, depth=depth)
 	elif reqType == 'sugg':
 		# Check for suggestion-limit
-		suggLimit: int
-		invalidLimit = False
 		try:
 			suggLimit = int(queryDict['limit'][0]) if 'limit' in queryDict else DEFAULT_SUGG_LIM
-			if suggLimit <= 0 or suggLimit > MAX_SUGG_LIM:
-				invalidLimit = True
 		except ValueError:
-			invalidLimit = True
-			print(f'INFO: Invalid limit {suggLimit}', file=sys.stderr)
-
-		# Get search suggestions
-		if not invalidLimit:
-			return lookupSuggs(name, suggLimit, tree, dbCur)
+			print(f'INFO: Invalid limit {queryDict["limit"][0]}', file=sys.stderr)
+			return None
+		if suggLimit <= 0 or suggLimit > MAX_SUGG_LIM:
+			return None
+		fuzzy = queryDict['fuzzy'][0] == '1' if 'fuzzy' in queryDict else False
+		# Check for paging
+		cursor = None
+		if 'cursor' in queryDict:
+			cursor = decodeSuggCursor(queryDict['cursor'][0])
+			if cursor is None:
+				print(f'INFO: Invalid cursor {queryDict["cursor"][0]}', file=sys.stderr)
+				return None
+		paged = cursor is not None or 'paged' in queryDict and queryDict['paged'][0] == '1'
+		return Query(reqType, name, tree, limit=suggLimit, fuzzy=fuzzy and not paged, paged=paged, cursor=cursor)
 	elif reqType == 'info':
-		infoResponse = lookupInfo(name, tree, dbCur)
+		withTolNode = queryDict['tolnode'][0] != '0' if 'tolnode' in queryDict else True
+		return Query(reqType, name, tree, withTolNode=withTolNode)
+	elif reqType == 'atlas':
+		return Query(reqType, name, tree)
+	elif reqType == 'nodes':
+		nodesStr = body if body else queryDict['nodes'][0] if 'nodes' in queryDict else None
+		nodeReqs = parseNodeReqs(nodesStr) if nodesStr is not None else None
+		if nodeReqs is None:
+			print('INFO: Invalid node request list', file=sys.stderr)
+			return None
+		return Query(reqType, '', tree, nodeReqs=nodeReqs)
+	return None
+
+def parseNodeReqs(nodesStr: str | bytes) -> tuple[NodeReq, ...] | None:
+	""" Converts a JSON list of node requests, for a 'nodes' request, into a tuple, or returns None if invalid """
+	try:
+		items = json.loads(nodesStr)
+	except ValueError:
+		return None
+	if not isinstance(items, list) or len(items) > MAX_BATCH_NODES:
+		return None
+	nodeReqs: dict[NodeReq, None] = {} # Used to remove duplicates, while keeping order
+	for item in items:
+		if isinstance(item, str):
+			item = {'name': item}
+		if not isinstance(item, dict) or not isinstance(item.get('name'), str):
+			return None
+		toroot = item.get('toroot', False) in (True, 1, '1')
+		exclName = item.get('excl') if toroot else None
+		if exclName is not None and not isinstance(exclName, str):
+			return None
+		depth = item.get('depth', 1) if not toroot else 1
+		if not isinstance(depth, int) or depth < 1 or depth > MAX_NODE_DEPTH:
+			return None
+		nodeReqs[(item['name'], toroot, exclName, depth)] = None
+	return tuple(nodeReqs)
+
+def handleQuery(dbFile: str, query: Query | None) -> None | dict[str, TolNode] | SearchSuggResponse | InfoResponse | AtlasResponse:
+	""" Queries the database, and constructs a response object """
+	if query is None:
+		return None
+	name, tree = query.name, query.tree
+	pool = getDbPool(dbFile)
+	# Get data of requested type
+	if query.reqType == 'node':
+		if tree in SNAPSHOT_TREES:
+			snapshot = getTreeSnapshot(pool, tree)
+			if query.depth > 1:
+				return snapshot.lookupSubtree(name, query.depth)
+			elif not query.toroot:
+				return snapshot.lookupNodeAndChildren(name)
+			else:
+				return snapshot.lookupAncestry(name, query.excl)
+		else:
+			with pool.connection() as dbCon:
+				dbCur = dbCon.cursor()
+				if query.depth > 1:
+					return lookupSubtree(name, query.depth, tree, dbCur)
+				elif not query.toroot:
+					return lookupNodeAndChildren(name, tree, dbCur)
+				else:
+					return lookupAncestry(name, query.excl, tree, dbCur)
+	elif query.reqType == 'nodes':
+		if tree in SNAPSHOT_TREES:
+			return getTreeSnapshot(pool, tree).lookupNodeBatch(query.nodeReqs)
+		with pool.connection() as dbCon:
+			return lookupNodeBatch(query.nodeReqs, tree, dbCon.cursor())
+	elif query.reqType == 'sugg':
+		if query.paged:
+			with pool.connection() as dbCon:
+				return lookupSuggPage(name, query.limit, query.cursor, tree, dbCon.cursor())
+		suggIndex = getSuggIndex(pool, tree) if tree in SUGG_INDEX_TREES else None
+		suggResponse = suggIndex.lookupSuggs(name, query.limit) if suggIndex is not None else None
+		if suggResponse is None:
+			with pool.connection() as dbCon:
+				suggResponse = lookupSuggs(name, query.limit, tree, dbCon.cursor())
+		if query.fuzzy and suggIndex is not None:
+			suggIndex.addFuzzySuggs(suggResponse, name, query.limit)
+		return suggResponse
+	elif query.reqType == 'info':
+		with pool.connection() as dbCon:
+			infoResponse = lookupInfo(name, tree, dbCon.cursor(), query.withTolNode)
 		if infoResponse is not None:
 			return infoResponse
+	elif query.reqType == 'atlas':
+		with pool.connection() as dbCon:
+			return lookupAtlases(name, tree, dbCon.cursor())
 
 	# On failure, provide empty response
 	return None
 
+def handleReq(dbFile: str, environ: dict[str, str]) -> None | dict[str, TolNode] | SearchSuggResponse | InfoResponse | AtlasResponse:
+	""" Queries the database using a request's query string, and constructs a response object """
+	queryStr = environ['QUERY_STRING'] if 'QUERY_STRING' in environ else ''
+	return handleQuery(dbFile, parseQuery(queryStr, getRequestBody(environ)))
+
+def getRequestBody(environ: dict) -> bytes | None:
+	""" Returns the body of a POST request, or None """
+	if environ.get('REQUEST_METHOD') != 'POST':
+		return None
+	try:
+		length = int(environ.get('CONTENT_LENGTH') or 0)
+	except ValueError:
+		return None
+	return environ['wsgi.input'].read(min(length, MAX_BATCH_NODES * 1000)) if length > 0 else None
+
+def lookupStoredResponse(pool: DbConnPool, query: Query) -> CachedResponse | None:
+	""" Returns a response for a query from the db's response_cache table, if present """
+	if query.reqType != 'node' or query.toroot or query.depth > 1:
+		return None
+	with pool.connection() as dbCon:
+		dbCur = dbCon.cursor()
+		if not hasTable(dbCur, 'response_cache'):
+			return None
+		row = dbCur.execute('SELECT data, gzip_data FROM response_cache WHERE tree = ? AND name = ?',
+			(query.tree, query.name)).fetchone()
+	return CachedResponse(row[0], row[1]) if row is not None else None
+
+def getResponseData(dbFile: str, query: Query | None, encoding: str | None) -> tuple[bytes, str | None]:
+	""" Returns encoded response data for a query, and the content-coding it was compressed with (if any).
+		Uses the response cache, and compresses data that was served from it at a higher level.
+		Concurrent calls for the same query share one lookup, and one compression. """
+	if query is None:
+		return encodeResponse(None), None
+	key = query.key()
+	pool = getDbPool(dbFile)
+	fileId = pool.fileId
+	entry = responseCache.get(key, fileId)
+	isHot = entry is not None
+	if entry is None: # Do a lookup, sharing it with concurrent identical requests
+		def lookup() -> CachedResponse:
+			entry = lookupStoredResponse(pool, query)
+			if entry is None:
+				entry = CachedResponse(encodeResponse(handleQuery(dbFile, query)))
+			responseCache.put(key, fileId, entry)
+			return entry
+		entry = responseFlights.do((dbFile, fileId, key), lookup)
+	if encoding is None or len(entry.data) < MIN_COMPRESS_SIZE:
+		return entry.data, None
+	if encoding == 'gzip' and entry.gzipData is not None:
+		return entry.gzipData, encoding
+	return compressResponse(entry.data, encoding, isHot), encoding
+
+def getETag(fileId: tuple[int, int, int], query: Query, encoding: str | None) -> str:
+	""" Returns a strong ETag for a query's response, which only changes when the db file does """
+	digest = hashlib.blake2b(repr((fileId, query.key(), encoding)).encode(), digest_size=12).hexdigest()
+	return f'"{digest}"'
+
+def isNotModified(environ: dict[str, str], etag: str, lastModified: int) -> bool:
+	""" Returns True if a request's conditional headers indicate that the client's cached response is current """
+	if 'HTTP_IF_NONE_MATCH' in environ:
+		tags = [tag.strip() for tag in environ['HTTP_IF_NONE_MATCH'].split(',')]
+		return '*' in tags or etag in tags or 'W/' + etag in tags
+	if 'HTTP_IF_MODIFIED_SINCE' in environ:
+		try:
+			return lastModified <= email.utils.parsedate_to_datetime(environ['HTTP_IF_MODIFIED_SINCE']).timestamp()
+		except (TypeError, ValueError):
+			return False
+	return False
+
+def getResponseHeaders(dbFile: str, environ: dict[str, str], query: Query | None,
+		encoding: str | None) -> tuple[list[tuple[str, str]], bool]:
+	""" Returns headers for a response to a request using a db file, without Content-encoding and
+		Content-Length, and a boolean that is True if a '304 Not Modified' response should be sent """
+	headers = [('Content-type', 'application/json')]
+	# Check for a conditional request, using the db file's version and the query
+	if query is not None and environ.get('REQUEST_METHOD', 'GET') in ('GET', 'HEAD'):
+		fileId = getDbPool(dbFile).fileId
+		lastModified = fileId[1] // 10**9
+		etag = getETag(fileId, query, encoding)
+		headers.append(('ETag', etag))
+		headers.append(('Last-Modified', email.utils.formatdate(lastModified, usegmt=True)))
+		headers.append(('Vary', 'Accept-Encoding'))
+		if query.reqType in CACHE_CONTROL:
+			headers.append(('Cache-Control', CACHE_CONTROL[query.reqType]))
+		if isNotModified(environ, etag, lastModified):
+			return headers[1:], True
+	return headers, False
+
 def application(environ: dict[str, str], start_response) -> Iterable[bytes]:
 	""" Entry point for the WSGI script """
-	# Get response object
-	val = handleReq(DB_FILE, environ)
+	query = parseQuery(environ['QUERY_STRING'] if 'QUERY_STRING' in environ else '', getRequestBody(environ))
+	encoding = negotiateEncoding(environ['HTTP_ACCEPT_ENCODING']) if 'HTTP_ACCEPT_ENCODING' in environ else None
+	dbFile = DB_FILE
+	headers, notModified = getResponseHeaders(dbFile, environ, query, encoding)
+	if notModified:
+		start_response('304 Not Modified', headers)
+		return []
+
+	# Get response data
+	data, usedEncoding = getResponseData(dbFile, query, encoding)
 
 	# Construct response
-	data = jsonpickle.encode(val, unpicklable=False).encode()
-	headers = [('Content-type', 'application/json')]
-	if 'HTTP_ACCEPT_ENCODING' in environ and 'gzip' in environ['HTTP_ACCEPT_ENCODING']:
-		if len(data) > 100:
-			data = gzip.compress(data, compresslevel=5)
-			headers.append(('Content-encoding', 'gzip'))
+	if usedEncoding is not None:
+		headers.append(('Content-encoding', usedEncoding))
 	headers.append(('Content-Length', str(len(data))))
 	start_response('200 OK', headers)
 
-	return [data]
+	return [data] if environ.get('REQUEST_METHOD') != 'HEAD' else []
+
+# ========== For running as an ASGI app ==========
+
+class AsgiState:
+	""" Holds a thread pool for running lookups, and futures for in-progress lookups, used to
+		make concurrent identical requests share one lookup. Only used from the event loop's thread. """
+	def __init__(self, numThreads: int):
+		self.numThreads = numThreads
+		self.executor: concurrent.futures.ThreadPoolExecutor | None = None
+		self.inProgress: dict[tuple, asyncio.Future[tuple[bytes, str | None]]] = {}
+		self.numCoalesced = 0
+
+	def getExecutor(self) -> concurrent.futures.ThreadPoolExecutor:
+		if self.executor is None:
+			self.executor = concurrent.futures.ThreadPoolExecutor(self.numThreads, thread_name_prefix='tilo')
+		return self.executor
+
+	def shutdown(self) -> None:
+		if self.executor is not None:
+			self.executor.shutdown(wait=False, cancel_futures=True)
+			self.executor = None
+
+	async def getResponseData(
+			self, dbFile: str, query: Query | None, encoding: str | None) -> tuple[bytes, str | None]:
+		""" Like getResponseData(), but runs in the thread pool, and shares results between identical requests """
+		loop = asyncio.get_running_loop()
+		if query is None:
+			return await loop.run_in_executor(self.getExecutor(), getResponseData, dbFile, query, encoding)
+		key = (dbFile, query.key(), encoding)
+		if key in self.inProgress:
+			self.numCoalesced += 1
+			return await asyncio.shield(self.inProgress[key])
+		future = loop.run_in_executor(self.getExecutor(), getResponseData, dbFile, query, encoding)
+		self.inProgress[key] = future
+		try:
+			return await asyncio.shield(future)
+		finally:
+			if future.done():
+				del self.inProgress[key]
+			else: # If cancelled (eg: upon client disconnect), let others await the lookup
+				future.add_done_callback(lambda _: self.inProgress.pop(key, None))
+
+asgiState = AsgiState(ASGI_THREADS)
+
+async def asgiApplication(scope: dict, receive: Callable, send: Callable) -> None:
+	""" Entry point for running as an ASGI app (eg: using 'uvicorn tilo:asgiApplication') """
+	if scope['type'] == 'lifespan':
+		while True:
+			message = await receive()
+			if message['type'] == 'lifespan.startup':
+				await send({'type': 'lifespan.startup.complete'})
+			elif message['type'] == 'lifespan.shutdown':
+				asgiState.shutdown()
+				await send({'type': 'lifespan.shutdown.complete'})
+				return
+	if scope['type'] != 'http':
+		return
+	environ = getAsgiEnviron(scope)
+	body = await readAsgiBody(receive) if environ['REQUEST_METHOD'] == 'POST' else None
+	query = parseQuery(environ['QUERY_STRING'], body)
+	encoding = negotiateEncoding(environ['HTTP_ACCEPT_ENCODING']) if 'HTTP_ACCEPT_ENCODING' in environ else None
+	dbFile = DB_FILE
+	headers, notModified = getResponseHeaders(dbFile, environ, query, encoding)
+	if notModified:
+		await sendAsgiResponse(send, 304, headers, b'')
+		return
+	data, usedEncoding = await asgiState.getResponseData(dbFile, query, encoding)
+	if usedEncoding is not None:
+		headers.append(('Content-encoding', usedEncoding))
+	headers.append(('Content-Length', str(len(data))))
+	await sendAsgiResponse(send, 200, headers, data if environ['REQUEST_METHOD'] != 'HEAD' else b'')
+
+def getAsgiEnviron(scope: dict) -> dict[str, str]:
+	""" Returns a WSGI-style environ dict with the parts of an ASGI 'http' scope used by this script """
+	environ = {
+		'REQUEST_METHOD': scope['method'],
+		'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+		'PATH_INFO': scope.get('path', '/'),
+	}
+	for name, value in scope.get('headers', []):
+		key = 'HTTP_' + name.decode('latin-1').upper().replace('-', '_')
+		value = value.decode('latin-1')
+		environ[key] = environ[key] + ',' + value if key in environ else value
+	return environ
+
+async def readAsgiBody(receive: Callable) -> bytes | None:
+	""" Reads a request body, up to the size allowed for POST requests """
+	maxSize = MAX_BATCH_NODES * 1000
+	chunks: list[bytes] = []
+	size = 0
+	while True:
+		message = await receive()
+		if message['type'] == 'http.disconnect':
+			break
+		chunk = message.get('body', b'')
+		if size < maxSize:
+			chunks.append(chunk[:maxSize - size])
+		size += len(chunk)
+		if not message.get('more_body', False):
+			break
+	return b''.join(chunks) if size > 0 else None
+
+async def sendAsgiResponse(send: Callable, status: int, headers: list[tuple[str, str]], data: bytes) -> None:
+	await send({
+		'type': 'http.response.start',
+		'status': status,
+		'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+	})
+	await send({'type': 'http.response.body', 'body': data})
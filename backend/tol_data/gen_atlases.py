@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+
+"""
+Generates image atlases, which each combine the images of some children of a
+reduced-tree node into one JPEG, allowing a client to get a node's children's
+images with few requests. Atlases are written into the image directory, with
+names like 'atlas_i_12.jpg', and are described by database tables.
+
+For each parent with enough children with images, the children's images are
+placed in cells of a grid, with children ordered like in 'node' responses.
+Parents with many children get multiple atlases ('pages'). The atlases_X
+table holds each atlas's grid size, and a JSON map from image names to cell
+columns and rows. The atlas_nodes_X table holds, for each child, the cell
+position of it's image, or image pair, as a JSON value.
+
+Should be run after the image and reduced-tree data is generated, and before
+generating response cache data.
+"""
+
+import argparse
+import os
+import sys
+import math
+import json
+import sqlite3
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # For importing tilo.py
+from tilo import lookupNodes, getTableSuffix
+
+DB_FILE = 'data.db'
+IMG_DIR = 'img'
+CELL_SZ = 200 # Matches the size of images produced by gen_imgs.py
+MIN_IMGS = 4 # Min number of images to put in an atlas
+MAX_IMGS = 64 # Max number of images to put in an atlas
+JPEG_QUALITY = 85
+TREES = ['trimmed', 'images', 'picked']
+
+def genData(trees: list[str], dbFile: str, imgDir: str, minImgs: int, maxImgs: int) -> None:
+	print('Opening database')
+	dbCon = sqlite3.connect(dbFile)
+	dbCur = dbCon.cursor()
+
+	for tree in trees:
+		suffix = getTableSuffix(tree)
+		print(f'=== Generating atlases for tree \'{tree}\' ===')
+		if dbCur.execute('SELECT name FROM sqlite_master WHERE type = "table" AND name = ?',
+				(f'nodes_{suffix}',)).fetchone() is None:
+			print('Skipping, as tree tables are absent')
+			continue
+		genTreeAtlases(dbCur, tree, imgDir, minImgs, maxImgs)
+
+	print('Closing database')
+	dbCon.commit()
+	dbCon.close()
+
+def genTreeAtlases(dbCur: sqlite3.Cursor, tree: str, imgDir: str, minImgs: int, maxImgs: int) -> None:
+	suffix = getTableSuffix(tree)
+	atlasesTbl = f'atlases_{suffix}'
+	atlasNodesTbl = f'atlas_nodes_{suffix}'
+	dbCur.execute(f'CREATE TABLE {atlasesTbl} (parent TEXT, page INT, file TEXT,' \
+		' cols INT, rows INT, cell_size INT, offsets TEXT, PRIMARY KEY (parent, page))')
+	dbCur.execute(f'CREATE TABLE {atlasNodesTbl} (name TEXT PRIMARY KEY, parent TEXT, page INT, pos TEXT)')
+
+	print('Finding parents with enough children')
+	query = f'SELECT parent FROM edges_{suffix} GROUP BY parent HAVING COUNT(*) >= ?'
+	parents = [name for (name,) in dbCur.execute(query, (minImgs,)).fetchall()]
+	print(f'Found {len(parents)}')
+
+	print('Generating atlases')
+	numAtlases = 0
+	for iterNum, parent in enumerate(parents, 1):
+		if iterNum % 1000 == 0:
+			print(f'At iteration {iterNum}')
+		#
+		children = lookupNodes([parent], tree, dbCur)[parent].children
+		childNodes = lookupNodes(children, tree, dbCur)
+		# Get pages of children and their images
+		pages: list[list[tuple[str, list[str]]]] = [[]] # Holds (child name, image names) lists
+		pageImgs: list[dict[str, None]] = [{}] # Holds each page's image names, in order
+		for child in children:
+			if child not in childNodes:
+				continue
+			imgName = childNodes[child].imgName
+			imgNames = [imgName] if isinstance(imgName, str) else [n for n in imgName or [] if n is not None]
+			if not imgNames or not all(os.path.exists(os.path.join(imgDir, n)) for n in imgNames):
+				continue
+			newImgs = [n for n in imgNames if n not in pageImgs[-1]]
+			if len(pageImgs[-1]) + len(newImgs) > maxImgs:
+				pages.append([])
+				pageImgs.append({})
+			pages[-1].append((child, imgNames))
+			pageImgs[-1].update((n, None) for n in imgNames)
+		if sum(len(imgs) for imgs in pageImgs) < minImgs:
+			continue
+		# Write atlases
+		for page, (childImgs, imgs) in enumerate(zip(pages, pageImgs)):
+			file = f'atlas_{suffix}_{numAtlases}.jpg'
+			numAtlases += 1
+			cols, rows, offsets = writeAtlas(list(imgs.keys()), imgDir, os.path.join(imgDir, file))
+			dbCur.execute(f'INSERT INTO {atlasesTbl} VALUES (?, ?, ?, ?, ?, ?, ?)',
+				(parent, page, file, cols, rows, CELL_SZ, json.dumps(offsets)))
+			for child, imgNames in childImgs:
+				imgName = childNodes[child].imgName
+				if isinstance(imgName, str):
+					pos: list = offsets[imgName]
+				else:
+					pos = [offsets[n] if n is not None else None for n in imgName] # type: ignore
+				dbCur.execute(f'INSERT INTO {atlasNodesTbl} VALUES (?, ?, ?, ?)', (child, parent, page, json.dumps(pos)))
+	print(f'Wrote {numAtlases} atlases')
+
+def writeAtlas(imgNames: list[str], imgDir: str, outPath: str) -> tuple[int, int, dict[str, list[int]]]:
+	""" Writes images into a grid in an atlas file, and returns the grid's column and row
+		counts, and a map from image names to cell columns and rows """
+	cols = math.ceil(math.sqrt(len(imgNames)))
+	rows = math.ceil(len(imgNames) / cols)
+	offsets: dict[str, list[int]] = {}
+	with Image.new('RGB', (cols * CELL_SZ, rows * CELL_SZ)) as atlas:
+		for idx, imgName in enumerate(imgNames):
+			col, row = idx % cols, idx // cols
+			with Image.open(os.path.join(imgDir, imgName)) as img:
+				img = img.convert('RGB')
+				if img.size != (CELL_SZ, CELL_SZ):
+					img = img.resize((CELL_SZ, CELL_SZ))
+				atlas.paste(img, (col * CELL_SZ, row * CELL_SZ))
+			offsets[imgName] = [col, row]
+		atlas.save(outPath, quality=JPEG_QUALITY)
+	return cols, rows, offsets
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--tree', choices=TREES, help='Only generate atlases for the specified tree')
+	parser.add_argument('--min', type=int, default=MIN_IMGS, help='Min number of images per atlas')
+	parser.add_argument('--max', type=int, default=MAX_IMGS, help='Max number of images per atlas')
+	args = parser.parse_args()
+
+	genData([args.tree] if args.tree is not None else TREES, DB_FILE, IMG_DIR, args.min, args.max)
@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+
+"""
+Adds 'nested set' intervals for the nodes of the full and reduced trees.
+
+Each node gets a preorder-traversal index, the largest preorder index
+within it's subtree, and a depth. This allows checking if a node is an
+ancestor of another, and getting a node's descendants, without walking
+the tree one edge at a time.
+"""
+
+import argparse
+import sqlite3
+
+DB_FILE = 'data.db'
+
+TREE_TO_SUFFIX = {'full': '', 'trimmed': '_t', 'images': '_i', 'picked': '_p'}
+
+def genData(trees: list[str], dbFile: str) -> None:
+	print('Opening database')
+	dbCon = sqlite3.connect(dbFile)
+	dbCur = dbCon.cursor()
+
+	for tree in trees:
+		suffix = TREE_TO_SUFFIX[tree]
+		print(f'=== Generating ranges for tree \'{tree}\' ===')
+		if dbCur.execute('SELECT name FROM sqlite_master WHERE type = "table" AND name = ?',
+				(f'nodes{suffix}',)).fetchone() is None:
+			print('Skipping, as tree tables are absent')
+			continue
+		genTreeRanges(dbCur, suffix)
+
+	print('Closing database')
+	dbCon.commit()
+	dbCon.close()
+
+def genTreeRanges(dbCur: sqlite3.Cursor, suffix: str) -> None:
+	""" Adds a node_ranges table for the tree with nodes/edges tables that have the given suffix """
+	nodesTbl = f'nodes{suffix}'
+	edgesTbl = f'edges{suffix}'
+	rangesTbl = f'node_ranges{suffix}'
+
+	print('Reading edges')
+	parentToChildren: dict[str, list[str]] = {}
+	childNames: set[str] = set()
+	hasOrd = any(row[1] == 'ord' for row in dbCur.execute(f'PRAGMA table_info({edgesTbl})'))
+	query = f'SELECT parent, child FROM {edgesTbl} ORDER BY parent, ' + ('ord' if hasOrd else 'child')
+	iterNum = 0
+	for parent, child in dbCur.execute(query):
+		iterNum += 1
+		if iterNum % 1e5 == 0:
+			print(f'At iteration {iterNum}')
+		#
+		if parent not in parentToChildren:
+			parentToChildren[parent] = []
+		parentToChildren[parent].append(child)
+		childNames.add(child)
+
+	print('Finding root node')
+	rootName: str | None = None
+	for (name,) in dbCur.execute(f'SELECT name FROM {nodesTbl}'):
+		if name not in childNames:
+			rootName = name
+			break
+	if rootName is None:
+		raise Exception('ERROR: No root node found')
+	print(f'Found \'{rootName}\'')
+
+	print('Assigning ranges')
+	nodeToRange: dict[str, tuple[int, int, int]] = {} # Maps node names to (preorder index, end index, depth)
+	nextIdx = 0
+	stack: list[tuple[str, int, bool]] = [(rootName, 0, False)] # Holds (name, depth, is-exit-marker) tuples
+	while stack:
+		name, depth, isExit = stack.pop()
+		if isExit:
+			preIdx = nodeToRange[name][0]
+			nodeToRange[name] = (preIdx, nextIdx - 1, depth)
+			continue
+		nodeToRange[name] = (nextIdx, nextIdx, depth)
+		nextIdx += 1
+		if nextIdx % 1e5 == 0:
+			print(f'At node {nextIdx}')
+		stack.append((name, depth, True))
+		if name in parentToChildren:
+			for child in reversed(parentToChildren[name]):
+				stack.append((child, depth + 1, False))
+
+	print(f'Writing {len(nodeToRange)} rows')
+	dbCur.execute(f'CREATE TABLE {rangesTbl} (name TEXT PRIMARY KEY, pre_idx INT UNIQUE, end_idx INT, depth INT)')
+	for name, (preIdx, endIdx, depth) in nodeToRange.items():
+		dbCur.execute(f'INSERT INTO {rangesTbl} VALUES (?, ?, ?, ?)', (name, preIdx, endIdx, depth))
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--tree', choices=list(TREE_TO_SUFFIX.keys()), help='Only generate ranges for the specified tree')
+	args = parser.parse_args()
+
+	genData([args.tree] if args.tree is not None else list(TREE_TO_SUFFIX.keys()), DB_FILE)
@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+
+"""
+Adds a denormalized table for each reduced tree (eg: node_view_i for the
+'images' tree), holding a row for each node with all the data needed for
+a TolNode, so the server can look up nodes with a single indexed query.
+Rows are generated using the node lookup code in ../tilo.py, so this
+should be run after the tables it uses are complete.
+"""
+
+import argparse
+import os
+import sys
+import json
+import sqlite3
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # For importing tilo.py
+from tilo import lookupNodes, hasTable, getTableSuffix
+
+DB_FILE = 'data.db'
+TREES = ['trimmed', 'images', 'picked']
+BATCH_SIZE = 1000 # Number of nodes to look up at a time
+
+def genData(trees: list[str], dbFile: str) -> None:
+	print('Opening database')
+	dbCon = sqlite3.connect(dbFile)
+	dbCur = dbCon.cursor()
+
+	for tree in trees:
+		suffix = getTableSuffix(tree)
+		nodesTbl = f'nodes_{suffix}'
+		viewTbl = f'node_view_{suffix}'
+		print(f'=== Generating node view for tree \'{tree}\' ===')
+		if not hasTable(dbCur, nodesTbl):
+			print('Skipping, as tree tables are absent')
+			continue
+		# Uses a temporary name, so node lookups don't use the table while it's being generated
+		dbCur.execute(f'CREATE TABLE {viewTbl}_tmp (name TEXT PRIMARY KEY, id TEXT, tips INT,' \
+			' parent TEXT, p_support INT, children TEXT, img_name TEXT, img_name2 TEXT, img_pair INT,' \
+			' common_name TEXT, iucn TEXT)')
+		names = [name for (name,) in dbCur.execute(f'SELECT name FROM {nodesTbl}')]
+		for batchStart in range(0, len(names), BATCH_SIZE):
+			if batchStart % (BATCH_SIZE * 100) == 0:
+				print(f'At node {batchStart}')
+			#
+			for name, tolNode in lookupNodes(names[batchStart:batchStart + BATCH_SIZE], tree, dbCur).items():
+				imgName = tolNode.imgName
+				imgNames = imgName if isinstance(imgName, tuple) else (imgName, None)
+				dbCur.execute(f'INSERT INTO {viewTbl}_tmp VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+					name, tolNode.otolId, tolNode.tips, tolNode.parent, 1 if tolNode.pSupport else 0,
+					json.dumps(tolNode.children), imgNames[0], imgNames[1], 1 if isinstance(imgName, tuple) else 0,
+					tolNode.commonName, tolNode.iucn))
+		dbCur.execute(f'ALTER TABLE {viewTbl}_tmp RENAME TO {viewTbl}')
+		print(f'Added {len(names)} rows')
+
+	print('Closing database')
+	dbCon.commit()
+	dbCon.close()
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--tree', choices=TREES, help='Only generate a view for the specified tree')
+	args = parser.parse_args()
+
+	genData([args.tree] if args.tree is not None else TREES, DB_FILE)
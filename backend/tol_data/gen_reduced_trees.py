@@ -357,13 +357,17 @@ def addTreeTables(nodeMap: dict[str, Node], dbCur: sqlite3.Cursor, suffix: str):
 	edgesTbl = f'edges_{suffix}'
 	dbCur.execute(f'CREATE TABLE {nodesTbl} (name TEXT PRIMARY KEY, id TEXT UNIQUE, tips INT)')
 	dbCur.execute(f'CREATE INDEX {nodesTbl}_idx_nc ON {nodesTbl}(name COLLATE NOCASE)')
-	dbCur.execute(f'CREATE TABLE {edgesTbl} (parent TEXT, child TEXT, p_support INT, PRIMARY KEY (parent, child))')
+	dbCur.execute(f'CREATE TABLE {edgesTbl}' \
+		' (parent TEXT, child TEXT, p_support INT, ord INT, PRIMARY KEY (parent, child))')
 	dbCur.execute(f'CREATE INDEX {edgesTbl}_child_idx ON {edgesTbl}(child)')
+	dbCur.execute(f'CREATE INDEX {edgesTbl}_ord_idx ON {edgesTbl}(parent, ord, child)')
 	for name, node in nodeMap.items():
 		dbCur.execute(f'INSERT INTO {nodesTbl} VALUES (?, ?, ?)', (name, node.id, node.tips))
-		for childName in node.children:
+		# Rank children by tips, as the server sends them in that order
+		children = sorted(node.children, key=lambda n: (-nodeMap[n].tips, n))
+		for childRank, childName in enumerate(children):
 			pSupport = 1 if nodeMap[childName].pSupport else 0
-			dbCur.execute(f'INSERT INTO {edgesTbl} VALUES (?, ?, ?)', (name, childName, pSupport))
+			dbCur.execute(f'INSERT INTO {edgesTbl} VALUES (?, ?, ?, ?)', (name, childName, pSupport, childRank))
 
 # ========== Main block ==========
 
@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+
+"""
+Precomputes server responses for frequently-made 'node' requests, and stores
+them in the database, for the server to send without doing node lookups.
+For each reduced tree, covers nodes in the first few levels of the tree,
+and the most popular nodes.
+"""
+
+import argparse
+import os
+import sys
+import gzip
+import sqlite3
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # For importing tilo.py
+from tilo import lookupNodeAndChildren, encodeResponse, getTableSuffix
+
+DB_FILE = 'data.db'
+NUM_LEVELS = 3 # Number of levels to cover, starting from the root
+NUM_POPULAR = 1000 # Number of most-popular nodes to cover, per tree
+
+def genData(dbFile: str, numLevels: int, numPopular: int) -> None:
+	print('Opening database')
+	dbCon = sqlite3.connect(dbFile)
+	dbCur = dbCon.cursor()
+	dbCur.execute('CREATE TABLE response_cache' \
+		' (tree TEXT, name TEXT, data BLOB, gzip_data BLOB, PRIMARY KEY (tree, name))')
+	hasPopData = dbCur.execute(
+		'SELECT name FROM sqlite_master WHERE type = "table" AND name = "node_pop"').fetchone() is not None
+
+	for tree in ['trimmed', 'images', 'picked']:
+		print(f'=== Generating responses for tree \'{tree}\' ===')
+		nodesTbl = f'nodes_{getTableSuffix(tree)}'
+		edgesTbl = f'edges_{getTableSuffix(tree)}'
+		if dbCur.execute('SELECT name FROM sqlite_master WHERE type = "table" AND name = ?',
+				(nodesTbl,)).fetchone() is None:
+			print('Skipping, as tree tables are absent')
+			continue
+
+		print('Finding top-level nodes')
+		query = f'SELECT name FROM {nodesTbl} LEFT JOIN {edgesTbl} ON {nodesTbl}.name = {edgesTbl}.child' \
+			f' WHERE {edgesTbl}.parent IS NULL LIMIT 1'
+		(rootName,) = dbCur.execute(query).fetchone()
+		names: list[str] = []
+		level = [rootName]
+		for _ in range(numLevels):
+			names.extend(level)
+			query = f'SELECT child FROM {edgesTbl} WHERE parent IN ({",".join(["?"] * len(level))})'
+			level = [n for (n,) in dbCur.execute(query, level)]
+		print(f'Found {len(names)}')
+
+		if hasPopData:
+			print('Finding popular nodes')
+			nameSet = set(names)
+			query = f'SELECT {nodesTbl}.name FROM {nodesTbl} INNER JOIN node_pop ON {nodesTbl}.name = node_pop.name' \
+				' ORDER BY pop DESC LIMIT ?'
+			for (name,) in dbCur.execute(query, (numPopular,)).fetchall():
+				if name not in nameSet:
+					names.append(name)
+
+		print(f'Storing responses for {len(names)} nodes')
+		for iterNum, name in enumerate(names, 1):
+			if iterNum % 100 == 0:
+				print(f'At iteration {iterNum}')
+			#
+			data = encodeResponse(lookupNodeAndChildren(name, tree, dbCur))
+			gzipData = gzip.compress(data, compresslevel=9) if len(data) > 100 else None
+			dbCur.execute('INSERT INTO response_cache VALUES (?, ?, ?, ?)', (tree, name, data, gzipData))
+
+	print('Closing database')
+	dbCon.commit()
+	dbCon.close()
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--levels', type=int, default=NUM_LEVELS, help='Number of top levels to cover')
+	parser.add_argument('--popular', type=int, default=NUM_POPULAR, help='Number of popular nodes to cover')
+	args = parser.parse_args()
+
+	genData(DB_FILE, args.levels, args.popular)
@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+
+"""
+Adds tables used by the server for finding search suggestions. For each
+reduced tree, holds the tree's node names and alt-names, along with
+lowercased versions for searching, and popularity values. An index
+enables prefix search, an FTS5 trigram index enables substring search,
+and an index in (pop, name) order enables paging through suggestions.
+"""
+
+import argparse
+import sqlite3
+
+DB_FILE = 'data.db'
+
+TREE_TO_SUFFIX = {'trimmed': 't', 'images': 'i', 'picked': 'p'}
+
+def genData(dbFile: str) -> None:
+	print('Opening database')
+	dbCon = sqlite3.connect(dbFile)
+	dbCur = dbCon.cursor()
+
+	for tree, suffix in TREE_TO_SUFFIX.items():
+		nodesTbl = f'nodes_{suffix}'
+		searchTbl = f'search_{suffix}'
+		print(f'=== Generating search data for tree \'{tree}\' ===')
+		if dbCur.execute('SELECT name FROM sqlite_master WHERE type = "table" AND name = ?',
+				(nodesTbl,)).fetchone() is None:
+			print('Skipping, as tree tables are absent')
+			continue
+		dbCur.execute(f'CREATE TABLE {searchTbl}' \
+			' (id INTEGER PRIMARY KEY, search_name TEXT, name TEXT, alt_name TEXT, pref_alt INT, pop INT)')
+
+		print('Adding node names')
+		query = f'SELECT {nodesTbl}.name, COALESCE(node_pop.pop, 0) FROM {nodesTbl}' \
+			f' LEFT JOIN node_pop ON {nodesTbl}.name = node_pop.name WHERE {nodesTbl}.name NOT LIKE "[%"'
+		for name, pop in dbCur.execute(query).fetchall():
+			dbCur.execute(f'INSERT INTO {searchTbl} VALUES (NULL, ?, ?, NULL, NULL, ?)', (name.lower(), name, pop))
+
+		print('Adding alt-names')
+		query = f'SELECT names.name, alt_name, pref_alt, COALESCE(node_pop.pop, 0) FROM' \
+			f' names INNER JOIN {nodesTbl} ON names.name = {nodesTbl}.name' \
+			f' LEFT JOIN node_pop ON {nodesTbl}.name = node_pop.name'
+		for name, altName, prefAlt, pop in dbCur.execute(query).fetchall():
+			dbCur.execute(f'INSERT INTO {searchTbl} VALUES (NULL, ?, ?, ?, ?, ?)',
+				(altName.lower(), name, altName, prefAlt, pop))
+
+		print('Creating indices')
+		dbCur.execute(f'CREATE INDEX {searchTbl}_idx ON {searchTbl}(search_name)')
+		dbCur.execute(f'CREATE INDEX {searchTbl}_pop_idx ON {searchTbl}(pop DESC, name)')
+		dbCur.execute(f'CREATE VIRTUAL TABLE {searchTbl}_fts USING fts5' \
+			f'(search_name, content="{searchTbl}", content_rowid="id", tokenize="trigram")')
+		dbCur.execute(f'INSERT INTO {searchTbl}_fts({searchTbl}_fts) VALUES ("rebuild")')
+
+	print('Closing database')
+	dbCon.commit()
+	dbCon.close()
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.parse_args()
+
+	genData(DB_FILE)
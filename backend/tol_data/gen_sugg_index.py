@@ -0,0 +1,50 @@
+#!/usr/bin/python3
+
+"""
+Writes in-memory search suggestion indices for the reduced trees into JSON files
+(eg: sugg_i.json for the 'images' tree). If the server is configured to use
+such an index, and the file is placed beside the database, the server loads
+it, instead of building the index from the database on first use. Each file
+records the version of the database it was generated from, and the server
+ignores files generated from other versions.
+"""
+
+import argparse
+import os
+import sys
+import sqlite3
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # For importing tilo.py
+from tilo import SuggIndex, hasTable, getTableSuffix, getDbIdentity
+
+DB_FILE = 'data.db'
+OUT_DIR = '.'
+TREES = ['trimmed', 'images', 'picked']
+
+def genData(trees: list[str], dbFile: str, outDir: str) -> None:
+	print('Opening database')
+	dbCon = sqlite3.connect(dbFile)
+	dbCur = dbCon.cursor()
+	dbIdentity = getDbIdentity(dbFile)
+
+	for tree in trees:
+		suffix = getTableSuffix(tree)
+		outFile = os.path.join(outDir, f'sugg_{suffix}.json')
+		print(f'=== Writing index for tree \'{tree}\' to {outFile} ===')
+		if not hasTable(dbCur, f'nodes_{suffix}'):
+			print('Skipping, as tree tables are absent')
+			continue
+		suggIndex = SuggIndex.fromDb(tree, dbCur)
+		print(f'Indexed {len(suggIndex.names)} names, with {len(suggIndex.nameIndex.topEntries)}'
+			f' and {len(suggIndex.altNameIndex.topEntries)} precomputed prefixes')
+		suggIndex.save(outFile, dbIdentity)
+
+	print('Closing database')
+	dbCon.close()
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--tree', choices=TREES, help='Only write the specified tree\'s index')
+	args = parser.parse_args()
+
+	genData([args.tree] if args.tree is not None else TREES, DB_FILE, OUT_DIR)
@@ -0,0 +1,186 @@
+#!/usr/bin/python3
+
+"""
+Writes each reduced tree into a binary file (eg: tree_i.bin for the 'images' tree),
+which the server can memory-map to answer 'node' requests without database access.
+
+A file holds a header, a section table, and sections holding arrays of
+little-endian integers, laid out as follows:
+- Header: The bytes 'TILOTREE', then a format version, node count, edge count,
+    string count, section count, and the db's SQLite file change counter, all as 32-bit
+    unsigned ints, then the db's file size, as a 64-bit unsigned int. The db values let
+    the server detect a file generated from a different version of the db.
+- Section table: Holds an offset and length, as 64-bit unsigned ints, for each section.
+- Sections, each 8-byte aligned:
+    0:  String offsets (u32, one per string, plus an end offset), relative to section 12
+    1:  Node otol ID string indices (u32)
+    2:  Node tips values (i32)
+    3:  Node parent indices (i32, -1 for the root)
+    4:  Node p_support values (u8)
+    5:  Node child-list starts (u32, one per node, plus an end offset)
+    6:  Child node indices (u32, ordered like the 'ord' column of edges_X)
+    7:  Node preferred-common-name string indices (u32)
+    8:  Node IUCN status string indices (u32)
+    9:  Node image name string indices (u32)
+    10: For compound-node image pairs, the second image name string index (u32)
+    11: Node image-pair flags (u8, 1 if the node's image names form a pair)
+    12: UTF-8 string data
+Nodes are ordered by UTF-8-encoded name, and node i's name is string i.
+A string index of 0xFFFFFFFF represents a null value.
+"""
+
+import argparse
+import os
+import sys
+import struct
+import sqlite3
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # For importing tilo.py
+from tilo import getDbIdentity
+
+DB_FILE = 'data.db'
+OUT_DIR = '.'
+
+MAGIC = b'TILOTREE'
+VERSION = 2
+NO_STR = 0xFFFFFFFF
+TREE_TO_SUFFIX = {'trimmed': 't', 'images': 'i', 'picked': 'p'}
+
+def genData(trees: list[str], dbFile: str, outDir: str) -> None:
+	print('Opening database')
+	dbCon = sqlite3.connect(dbFile)
+	dbCur = dbCon.cursor()
+	dbIdentity = getDbIdentity(dbFile)
+
+	for tree in trees:
+		suffix = TREE_TO_SUFFIX[tree]
+		outFile = os.path.join(outDir, f'tree_{suffix}.bin')
+		print(f'=== Writing tree \'{tree}\' to {outFile} ===')
+		genTreeFile(dbCur, suffix, outFile, dbIdentity)
+
+	print('Closing database')
+	dbCon.close()
+
+def genTreeFile(dbCur: sqlite3.Cursor, suffix: str, outFile: str, dbIdentity: tuple[int, int]) -> None:
+	nodesTbl = f'nodes_{suffix}'
+	edgesTbl = f'edges_{suffix}'
+
+	print('Reading nodes')
+	nodeRows = dbCur.execute(f'SELECT name, id, tips FROM {nodesTbl}').fetchall()
+	nodeRows.sort(key=lambda row: row[0].encode())
+	nameToIdx = {name: idx for idx, (name, _, _) in enumerate(nodeRows)}
+	numNodes = len(nodeRows)
+
+	# Holds strings, with node names first
+	strs: list[bytes] = [name.encode() for name, _, _ in nodeRows]
+	strToIdx: dict[bytes, int] = {}
+	def getStrIdx(s: str | None) -> int:
+		if s is None:
+			return NO_STR
+		b = s.encode()
+		if b not in strToIdx:
+			strToIdx[b] = len(strs)
+			strs.append(b)
+		return strToIdx[b]
+
+	otolIds = array('I', [getStrIdx(otolId) for _, otolId, _ in nodeRows])
+	tips = array('i', [tips for _, _, tips in nodeRows])
+
+	print('Reading edges')
+	parents = array('i', [-1]) * numNodes
+	pSupport = bytearray(numNodes)
+	nodeToChildren: list[list[int]] = [[] for _ in range(numNodes)]
+	hasOrd = any(row[1] == 'ord' for row in dbCur.execute(f'PRAGMA table_info({edgesTbl})'))
+	if hasOrd:
+		query = f'SELECT parent, child, p_support FROM {edgesTbl} ORDER BY parent, ord'
+	else: # For dbs generated before 'ord' was added, order children by tips, then name
+		query = f'SELECT parent, child, p_support FROM {edgesTbl} INNER JOIN {nodesTbl}' \
+			f' ON {edgesTbl}.child = {nodesTbl}.name ORDER BY parent, {nodesTbl}.tips DESC, child'
+	for parent, child, support in dbCur.execute(query):
+		parentIdx, childIdx = nameToIdx[parent], nameToIdx[child]
+		nodeToChildren[parentIdx].append(childIdx)
+		parents[childIdx] = parentIdx
+		pSupport[childIdx] = 1 if support == 1 else 0
+	childStarts = array('I', [0])
+	childIdxs = array('I')
+	for children in nodeToChildren:
+		childIdxs.extend(children)
+		childStarts.append(len(childIdxs))
+
+	print('Reading names and IUCN statuses')
+	commonNames = array('I', [NO_STR]) * numNodes
+	query = f'SELECT {nodesTbl}.name, alt_name FROM {nodesTbl}' \
+		f' INNER JOIN names ON {nodesTbl}.name = names.name WHERE pref_alt = 1'
+	for name, altName in dbCur.execute(query):
+		commonNames[nameToIdx[name]] = getStrIdx(altName)
+	iucns = array('I', [NO_STR]) * numNodes
+	query = f'SELECT {nodesTbl}.name, iucn FROM {nodesTbl} INNER JOIN node_iucn ON {nodesTbl}.name = node_iucn.name'
+	for name, iucn in dbCur.execute(query):
+		iucns[nameToIdx[name]] = getStrIdx(iucn)
+
+	print('Reading image names')
+	imgNames1 = array('I', [NO_STR]) * numNodes
+	imgNames2 = array('I', [NO_STR]) * numNodes
+	imgPairs = bytearray(numNodes)
+	query = f'SELECT {nodesTbl}.name, {nodesTbl}.id FROM {nodesTbl}' \
+		f' INNER JOIN node_imgs ON {nodesTbl}.name = node_imgs.name'
+	for name, otolId in dbCur.execute(query):
+		imgNames1[nameToIdx[name]] = getStrIdx(otolId + '.jpg')
+	query = f'SELECT {nodesTbl}.name, otol_ids FROM {nodesTbl}' \
+		f' INNER JOIN linked_imgs ON {nodesTbl}.name = linked_imgs.name'
+	for name, linkedIds in dbCur.execute(query):
+		idx = nameToIdx[name]
+		if imgNames1[idx] != NO_STR:
+			continue
+		if ',' not in linkedIds:
+			imgNames1[idx] = getStrIdx(linkedIds + '.jpg')
+		else:
+			id1, id2 = linkedIds.split(',')
+			imgNames1[idx] = getStrIdx(id1 + '.jpg' if id1 != '' else None)
+			imgNames2[idx] = getStrIdx(id2 + '.jpg' if id2 != '' else None)
+			imgPairs[idx] = 1
+
+	print('Writing file')
+	strOffsets = array('I', [0])
+	for b in strs:
+		strOffsets.append(strOffsets[-1] + len(b))
+	sections = [
+		strOffsets, otolIds, tips, parents, pSupport, childStarts, childIdxs,
+		commonNames, iucns, imgNames1, imgNames2, imgPairs, b''.join(strs)]
+	sectionBytes = [toLittleEndianBytes(section) for section in sections]
+	dbSize, dbChangeCounter = dbIdentity
+	header = struct.pack('<8sIIIIIIQ',
+		MAGIC, VERSION, numNodes, len(childIdxs), len(strs), len(sections), dbChangeCounter, dbSize)
+	offset = align8(len(header) + 16 * len(sections))
+	sectionTable = b''
+	for data in sectionBytes:
+		sectionTable += struct.pack('<QQ', offset, len(data))
+		offset = align8(offset + len(data))
+	with open(outFile, 'wb') as file:
+		file.write(header)
+		file.write(sectionTable)
+		for data in sectionBytes:
+			file.write(b'\0' * (align8(file.tell()) - file.tell()))
+			file.write(data)
+	print(f'Wrote {numNodes} nodes and {len(strs)} strings')
+
+def toLittleEndianBytes(data: array | bytearray | bytes) -> bytes:
+	if isinstance(data, array):
+		if data.itemsize != 4:
+			raise Exception('ERROR: Expected 4-byte array items')
+		data = array(data.typecode, data)
+		if struct.pack('=I', 1) != struct.pack('<I', 1):
+			data.byteswap()
+		return data.tobytes()
+	return bytes(data)
+
+def align8(n: int) -> int:
+	return (n + 7) // 8 * 8
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--tree', choices=list(TREE_TO_SUFFIX.keys()), help='Only write the specified tree')
+	args = parser.parse_args()
+
+	genData([args.tree] if args.tree is not None else list(TREE_TO_SUFFIX.keys()), DB_FILE, OUT_DIR)
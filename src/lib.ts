@@ -42,6 +42,7 @@ export type SearchSugg = {
 export type SearchSuggResponse = {
 	suggs: SearchSugg[],
 	hasMore: boolean,
+	cursor?: string, // For paged requests, used to get the next page
 };
 
 export type DescInfo = {
@@ -61,7 +62,7 @@ export type ImgInfo = {
 };
 
 export type NodeInfo = {
-	tolNode: TolNode,
+	tolNode: TolNode | null, // Null in a response to a request with 'tolnode=0'
 	descInfo: null | DescInfo,
 	imgInfo: null | ImgInfo,
 };
@@ -71,6 +72,25 @@ export type InfoResponse = {
 	subNodesInfo: [] | [NodeInfo | null, NodeInfo | null],
 };
 
+// Locates a node's image within an atlas of it's parent's children's images
+export type AtlasRef = {
+	file: string, // Atlas image name, as used with getImagePath()
+	size: [number, number], // Numbers of columns and rows of image cells
+	pos: [number, number] | [[number, number] | null, [number, number] | null], // Cell column and row (pairs match TolNode.imgName)
+};
+
+export type AtlasInfo = {
+	file: string,
+	size: [number, number],
+	cellSize: number, // Cell width and height, in pixels
+	offsets: {[imgName: string]: [number, number]},
+};
+
+// Describes the atlases for a node's children's images (sent for 'type=atlas' requests)
+export type AtlasResponse = {
+	atlases: AtlasInfo[],
+};
+
 // ========== Used by auto-mode and tutorial-pane ==========
 
 export type Action =
@@ -2,6 +2,8 @@
  * Types for representing tree-of-life data
  */
 
+import type {AtlasRef} from './lib';
+
 // Represents a tree-of-life node
 export class TolNode {
 	otolId: string | null;
@@ -13,6 +15,7 @@ export class TolNode {
 	imgName: null | string |
 		[string, string] | [null, string] | [string, null]; // Pairs represent compound images
 	iucn: null | string;
+	atlas?: AtlasRef; // Present if the node's images are in an atlas with it's siblings' images
 
 	constructor(children: string[] = [], parent = null, tips = 0, pSupport = false){
 		this.otolId = null;